@@ -0,0 +1,275 @@
+"""
+Measure how throughput scales with the number of concurrent workers, and
+stress the bindings' objects across threads.
+
+The bindings release the GIL while libimagequant runs, so worker threads can
+quantize separate images in parallel. For each worker count, a batch of jobs
+(quantize and remap one image each) is run by a pool of threads or processes.
+The harness then reports throughput, the median and 99th percentile latency
+of a job, and peak resident memory. For threads, that's the RSS of the whole
+process (sampled while the batch runs); for processes, the sum of each
+worker's peak. Memory is read from /proc, so this needs Linux.
+
+--progress reports each job's progress either to Python callbacks, which
+take the GIL on every tick, or to a Progress object that the C code updates
+without it, to show what the callbacks cost threads.
+
+With --stress, it instead runs threads for a while that use the objects the
+ways the documentation allows: copying one shared Attr, and handing Results
+and Images from the threads that make them to threads that remap and then
+drop them. Every output is checked against one made serially beforehand.
+
+Usage: python bench_concurrency.py [--workers 1,2,4] [--processes] [--progress callback|native] [--stress SECONDS]
+"""
+import argparse
+import concurrent.futures
+import os
+import queue
+import resource
+import threading
+import time
+
+import libimagequant as liq
+
+import common
+
+
+# Set in each worker (and in the main process for threads)
+IMAGES = None
+
+
+def init_worker(images):
+    global IMAGES
+    IMAGES = images
+
+
+def keep_going(percent, user_info):
+    return True
+
+
+def run_job(index, speed, progress):
+    """
+    Quantize and remap one image. Return (latency in seconds, process ID,
+    peak RSS of this process in bytes).
+    """
+    width, height, pixels = IMAGES[index % len(IMAGES)]
+    start = time.perf_counter()
+    attr = liq.Attr(progress=liq.Progress() if progress == 'native' else None)
+    if progress == 'callback':
+        attr.set_progress_callback(keep_going, None)
+    attr.speed = speed
+    image = attr.create_rgba(pixels, width, height, 0)
+    result = image.quantize(attr)
+    if progress == 'callback':
+        result.set_progress_callback(keep_going, None)
+    result.dithering_level = 1.0
+    result.remap_image(image)
+    latency = time.perf_counter() - start
+    return latency, os.getpid(), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class RSSSampler(threading.Thread):
+    """
+    Records the highest RSS of this process until stopped
+    """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = current_rss()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(0.005):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return max(self.peak, current_rss())
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_batch(workers, jobs, speed, images, processes, progress):
+    """
+    Return (seconds, latencies, peak RSS in bytes) of running the jobs
+    """
+    if processes:
+        executor = concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker, initargs=(images,))
+        # Start the workers before timing
+        list(executor.map(time.sleep, [0.05] * workers))
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+        sampler = RSSSampler()
+        sampler.start()
+
+    with executor:
+        start = time.perf_counter()
+        futures = [executor.submit(run_job, i, speed, progress) for i in range(jobs)]
+        outcomes = [f.result() for f in futures]
+        seconds = time.perf_counter() - start
+
+    latencies = [latency for latency, _, _ in outcomes]
+    if processes:
+        peaks = {}
+        for _, pid, peak in outcomes:
+            peaks[pid] = max(peaks.get(pid, 0), peak)
+        rss = sum(peaks.values())
+    else:
+        rss = sampler.stop()
+    return seconds, latencies, rss
+
+
+def scaling(args, images):
+    megapixels = sum(w * h for w, h, _ in images) / len(images) / 1e6
+    print('%s, %d jobs of %dx%d at speed %d, progress: %s' % (
+        'processes' if args.processes else 'threads', args.jobs, args.size, args.size, args.speed, args.progress))
+    print('workers  jobs/s    MP/s  speedup  p50 (ms)  p99 (ms)  RSS (MB)')
+    base = None
+    for workers in args.workers:
+        seconds, latencies, rss = run_batch(workers, args.jobs, args.speed, images, args.processes, args.progress)
+        throughput = args.jobs / seconds
+        if base is None:
+            base = throughput
+        print('%7d %7.2f %7.2f %7.2fx %9.1f %9.1f %9.1f' % (
+            workers, throughput, throughput * megapixels, throughput / base,
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, rss / 2**20))
+
+
+def stress(args, images):
+    """
+    Run the stress threads for args.stress seconds. Return the number of
+    outputs that differed from the serial ones, plus the number of threads
+    that raised an exception or were still running a minute after the end.
+    """
+    base_attr = liq.Attr()
+    base_attr.speed = args.speed
+    base_attr.max_colors = 64
+
+    def quantize(attr, index):
+        width, height, pixels = images[index]
+        image = attr.create_rgba(pixels, width, height, 0)
+        histogram = liq.Histogram(attr)
+        histogram.add_image(attr, image)
+        return histogram.quantize(attr), image
+
+    def remap(result, image):
+        result.dithering_level = 1.0
+        return result.get_palette(), result.remap_image(image)
+
+    expected = [remap(*quantize(base_attr.copy(), i)) for i in range(len(images))]
+
+    deadline = time.monotonic() + args.stress
+    # Threads still running this long after the deadline are hung
+    join_deadline = deadline + 60
+    # Unbounded, so producers never wait for a consumer that has failed
+    handoff = queue.Queue()
+    counts = {'outputs': 0, 'mismatches': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def check(index, output):
+        with lock:
+            counts['outputs'] += 1
+            if output != expected[index]:
+                counts['mismatches'] += 1
+
+    def guarded(func):
+        def run():
+            try:
+                func()
+            except Exception:
+                with lock:
+                    counts['errors'] += 1
+                raise
+        return run
+
+    @guarded
+    def copier():
+        # Copies the shared Attr, then uses the copy like any other
+        i = 0
+        while time.monotonic() < deadline:
+            index = i % len(images)
+            check(index, remap(*quantize(base_attr.copy(), index)))
+            i += 1
+
+    @guarded
+    def producer():
+        try:
+            i = 0
+            while time.monotonic() < deadline:
+                index = i % len(images)
+                handoff.put((index,) + quantize(base_attr.copy(), index))
+                i += 1
+        finally:
+            # Each producer stops one consumer
+            handoff.put(None)
+
+    @guarded
+    def consumer():
+        # Remaps what another thread made, and drops the last reference to it
+        while True:
+            item = handoff.get(timeout=max(0, join_deadline - time.monotonic()))
+            if item is None:
+                break
+            index, result, image = item
+            check(index, remap(result, image))
+            del item, result, image
+
+    threads_per_role = max(1, args.workers[-1] // 2)
+    # Daemon threads, so that hung ones don't keep the process alive
+    threads = [threading.Thread(target=role, daemon=True)
+        for role in (copier, producer, consumer)
+        for _ in range(threads_per_role)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(0, join_deadline - time.monotonic()))
+    hung = sum(thread.is_alive() for thread in threads)
+
+    print('%d threads, %d outputs, %d differed from the serial ones, %d exceptions, %d hung' % (
+        len(threads), counts['outputs'], counts['mismatches'], counts['errors'], hung))
+    return counts['mismatches'] + counts['errors'] + hung
+
+
+def parse_list(text):
+    return [int(value) for value in text.split(',')]
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    default_workers = sorted(set([1, 2, 4, 8, 16, cpus, cpus * 2]) & set(range(1, cpus * 2 + 1)))
+
+    parser = argparse.ArgumentParser(description='Measure scaling with concurrent workers.')
+    parser.add_argument('--workers', type=parse_list, default=default_workers,
+        help='comma-separated worker counts (default: powers of 2 up to twice the CPUs)')
+    parser.add_argument('--processes', action='store_true',
+        help='use worker processes instead of threads')
+    parser.add_argument('--progress', choices=['none', 'callback', 'native'], default='none',
+        help='how jobs report progress (default none)')
+    parser.add_argument('--jobs', type=int, default=32, help='jobs per batch (default 32)')
+    parser.add_argument('--size', type=int, default=512, help='size of the square images (default 512)')
+    parser.add_argument('--speed', type=int, default=4, help='speed setting (default 4)')
+    parser.add_argument('--stress', type=float, metavar='SECONDS',
+        help='run the thread stress test for this long instead')
+    args = parser.parse_args()
+
+    # Differently offset tiles of a test image, so no two jobs in a row
+    # quantize the same pixels
+    images = [common.synthetic_image(args.size, args.size, x_offset=97 * i, y_offset=61 * i) for i in range(8)]
+    init_worker(images)
+
+    if args.stress:
+        return 1 if stress(args, images) else 0
+    scaling(args, images)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
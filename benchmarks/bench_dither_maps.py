@@ -0,0 +1,60 @@
+"""
+Measure the cost of the contrast maps and the dither map on a large
+image: quantizing with and without contrast maps, and remapping it
+against several palettes with each cache mode. The maps are built on
+several cores if the bindings were built with OpenMP (LIQ_OPENMP=1); set
+OMP_NUM_THREADS to vary the thread count.
+
+Usage: python bench_dither_maps.py [size]
+"""
+import sys
+
+import libimagequant as liq
+
+import common
+
+
+PALETTE_SIZES = [256, 128, 64, 32]
+
+
+def main(argv):
+    size = int(argv[1]) if len(argv) > 1 else 2048
+
+    width, height, pixels = common.synthetic_image(size, size)
+
+    print('quantization                 time (s)')
+    for contrast_maps in [False, True]:
+        attr = liq.Attr()
+        attr.speed = 10
+        attr.contrast_maps = contrast_maps
+        duration = common.best_time(
+            lambda: attr.create_rgba(pixels, width, height, 0).quantize(attr))
+        print('%-28s %8.3f' % ('with contrast maps' if contrast_maps else 'without contrast maps', duration))
+    print()
+
+    # Palettes are made once, so that only remapping is measured
+    attr = liq.Attr()
+    attr.speed = 10
+    attr.dither_map = liq.DitherMapMode.ALWAYS
+    results = []
+    for colors in PALETTE_SIZES:
+        attr.max_colors = colors
+        results.append(attr.create_rgba(pixels, width, height, 0).quantize(attr))
+
+    print('dithered remap, %d palettes  time (s)  per remap' % len(PALETTE_SIZES))
+    for cache_mode in liq.CacheMode:
+        image = attr.create_rgba(pixels, width, height, 0)
+        image.cache_mode = cache_mode
+
+        def remap_all():
+            for result in results:
+                result.dithering_level = 1.0
+                result.fast_remapping = True
+                result.remap_image(image)
+
+        duration = common.best_time(remap_all)
+        print('%-28s %8.3f %10.3f' % ('cache mode ' + cache_mode.name, duration, duration / len(results)))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,60 @@
+"""
+Compare serial and parallel Floyd-Steinberg dithering on a large image.
+Parallel dithering only uses several cores if the bindings were built
+with OpenMP (LIQ_OPENMP=1); set OMP_NUM_THREADS to vary the thread count.
+
+Usage: python bench_dithering.py [size]
+"""
+import hashlib
+import sys
+
+import libimagequant as liq
+
+import common
+
+
+def remap(image, attr, parallel, deterministic):
+    """
+    Quantize and remap with a fresh Result each time, since remapping
+    refines the palette. Return (remap duration, output).
+    """
+    result = image.quantize(attr)
+    result.dithering_level = 1.0
+    result.parallel_dithering = parallel
+    result.deterministic_dithering = deterministic
+    output = []
+    duration = common.best_time(lambda: output.append(result.remap_image(image)), repeat=1)
+    return duration, output[0]
+
+
+def main(argv):
+    size = int(argv[1]) if len(argv) > 1 else 2048
+
+    width, height, pixels = common.synthetic_image(size, size)
+    attr = liq.Attr()
+    image = attr.create_rgba(pixels, width, height, 0)
+
+    # The first remap of an image also builds the dither map that later
+    # ones reuse, so it's done once before measuring
+    remap(image, attr, False, True)
+    _, serial_output = remap(image, attr, False, True)
+
+    print('mode                         time (s)  Mpx/s  pixels differing from serial  output hash')
+    for name, parallel, deterministic in [
+            ('serial', False, True),
+            ('parallel, deterministic', True, True),
+            ('parallel, thread-dependent', True, False)]:
+        runs = [remap(image, attr, parallel, deterministic) for _ in range(3)]
+        duration = min(d for d, _ in runs)
+        output = runs[0][1]
+        differing = sum(1 for a, b in zip(output, serial_output) if a != b)
+        print('%-28s %8.3f %6.1f %28.2f%%  %s' % (
+            name,
+            duration,
+            width * height / duration / 1e6,
+            differing * 100 / len(output),
+            hashlib.sha1(output).hexdigest()[:12]))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,103 @@
+"""
+Compare the dithering algorithms on the test images: remapping speed,
+plain MSE, and MSE after a 5x5 box blur of both images, which
+approximates how the dither pattern looks from a normal viewing
+distance.
+
+Usage: python bench_dithering_algorithms.py [large-image-size]
+"""
+import sys
+
+import libimagequant as liq
+
+import common
+
+
+def box_blur(channel, width, height, radius=2):
+    """
+    Blur one channel (a list of floats) with a box filter, clamping at
+    the edges
+    """
+    def blur_1d(values, count, stride, lines, line_stride):
+        out = [0.0] * len(values)
+        size = 2 * radius + 1
+        for line in range(lines):
+            base = line * line_stride
+            for i in range(count):
+                total = 0.0
+                for d in range(-radius, radius + 1):
+                    j = min(count - 1, max(0, i + d))
+                    total += values[base + j * stride]
+                out[base + i * stride] = total / size
+        return out
+
+    horizontal = blur_1d(channel, width, 1, height, width)
+    return blur_1d(horizontal, height, width, width, 1)
+
+
+def errors(original, output, palette, width, height):
+    """
+    Return (plain MSE, blurred MSE) of the remapped image, averaged over
+    the RGBA channels
+    """
+    mse = blurred_mse = 0.0
+    for c in range(4):
+        orig = [float(v) for v in original[c::4]]
+        remapped = [float(palette[i][c]) for i in output]
+        mse += sum((a - b) ** 2 for a, b in zip(orig, remapped)) / len(orig)
+        orig = box_blur(orig, width, height)
+        remapped = box_blur(remapped, width, height)
+        blurred_mse += sum((a - b) ** 2 for a, b in zip(orig, remapped)) / len(orig)
+    return mse / 4, blurred_mse / 4
+
+
+def remap(image, attr, algorithm):
+    result = image.quantize(attr)
+    result.dithering_level = 1.0
+    result.dithering_algorithm = algorithm
+    output = []
+    duration = common.best_time(lambda: output.append(result.remap_image(image)), repeat=1)
+    return duration, output[0], result.get_palette()
+
+
+def main(argv):
+    size = int(argv[1]) if len(argv) > 1 else 2048
+
+    algorithms = list(liq.DitheringAlgorithm)
+
+    print('Quality (lower is better):')
+    print('image                algorithm        MSE  blurred MSE')
+    for name in common.TEST_IMAGES:
+        width, height, pixels = common.load_image(name)
+        attr = liq.Attr()
+        attr.max_colors = 32
+        image = attr.create_rgba(pixels, width, height, 0)
+        image.cache_mode = liq.CacheMode.KEEP
+
+        for algorithm in algorithms:
+            _, output, palette = remap(image, attr, algorithm)
+            mse, blurred_mse = errors(pixels, output, palette, width, height)
+            print('%-20s %-15s %6.1f %12.1f' % (name, algorithm.name, mse, blurred_mse))
+
+    print()
+    print('Speed on a %dx%d image:' % (size, size))
+    print('algorithm        time (s)  Mpx/s')
+    width, height, pixels = common.synthetic_image(size, size)
+    attr = liq.Attr()
+    image = attr.create_rgba(pixels, width, height, 0)
+    image.cache_mode = liq.CacheMode.KEEP
+    remap(image, attr, liq.DitheringAlgorithm.FLOYD_STEINBERG)
+    for algorithm in [None] + algorithms:
+        if algorithm is None:
+            # Undithered, for reference
+            result = image.quantize(attr)
+            duration = common.best_time(lambda: result.remap_image(image), repeat=1)
+            label = 'none'
+        else:
+            duration = min(remap(image, attr, algorithm)[0] for _ in range(3))
+            label = algorithm.name
+        print('%-15s %9.3f %6.1f' % (label, duration, width * height / duration / 1e6))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
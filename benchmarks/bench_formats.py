@@ -0,0 +1,154 @@
+"""
+Compare converting pixels to RGBA in Python before Attr.create_rgba with
+having libimagequant convert them as it reads them
+(Attr.create_with_format), for each PixelFormat, on large synthetic images.
+
+Each case builds a histogram of the image, which is where the pixels are
+first read, and separately quantizes and undithered-remaps it. The Python
+conversion uses NumPy if it's installed, and otherwise bytearray slice
+assignments, which is about the fastest pure Python gets (and truncates
+16-bit values rather than rounding them); premultiplied input needs NumPy.
+The converted RGBA copy the Python path makes is reported as extra memory.
+
+Usage: python bench_formats.py [size ...]
+"""
+import sys
+
+import libimagequant as liq
+
+import common
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def from_rgba(pixels, pixel_format):
+    """
+    Make the test input: the RGBA pixels in the given format
+    """
+    if pixel_format in (liq.PixelFormat.RGBA16_LE, liq.PixelFormat.RGBA16_BE):
+        # Each value v becomes v * 257, whose bytes are both v
+        out = bytearray(len(pixels) * 2)
+        out[0::2] = out[1::2] = pixels
+        return bytes(out)
+    r, g, b, a = (pixels[i::4] for i in range(4))
+    channels = {
+        liq.PixelFormat.RGB: [r, g, b],
+        liq.PixelFormat.RGBX: [r, g, b, a],
+        liq.PixelFormat.BGRA: [b, g, r, a],
+        liq.PixelFormat.ARGB: [a, r, g, b],
+        liq.PixelFormat.GRAY: [g],
+        # The synthetic images are opaque, so this is the same as RGBA
+        liq.PixelFormat.RGBA_PREMULTIPLIED: [r, g, b, a],
+    }[pixel_format]
+    out = bytearray(len(r) * len(channels))
+    for i, channel in enumerate(channels):
+        out[i::len(channels)] = channel
+    return bytes(out)
+
+
+def to_rgba_python(pixels, pixel_format):
+    """
+    Convert the pixels to RGBA the way a program would without
+    create_with_format(). Return None if that needs NumPy and it's missing.
+    """
+    is_16bit = pixel_format in (liq.PixelFormat.RGBA16_LE, liq.PixelFormat.RGBA16_BE)
+    if numpy is not None:
+        if is_16bit:
+            src = numpy.frombuffer(pixels, '<u2' if pixel_format == liq.PixelFormat.RGBA16_LE else '>u2')
+            return ((src.astype(numpy.uint32) * 255 + 32767) // 65535).astype(numpy.uint8)
+        if pixel_format == liq.PixelFormat.GRAY:
+            gray = numpy.frombuffer(pixels, numpy.uint8)
+            out = numpy.empty((len(gray), 4), numpy.uint8)
+            out[:, :3] = gray[:, None]
+            out[:, 3] = 255
+            return out
+        size = 3 if pixel_format == liq.PixelFormat.RGB else 4
+        src = numpy.frombuffer(pixels, numpy.uint8).reshape(-1, size)
+        out = numpy.empty((len(src), 4), numpy.uint8)
+        if pixel_format == liq.PixelFormat.RGB:
+            out[:, :3] = src
+            out[:, 3] = 255
+        elif pixel_format == liq.PixelFormat.RGBX:
+            out[:, :3] = src[:, :3]
+            out[:, 3] = 255
+        elif pixel_format == liq.PixelFormat.BGRA:
+            out[:] = src[:, [2, 1, 0, 3]]
+        elif pixel_format == liq.PixelFormat.ARGB:
+            out[:] = src[:, [1, 2, 3, 0]]
+        else:
+            alpha = src[:, 3:].astype(numpy.uint32)
+            color = (src[:, :3] * 255 + alpha // 2) // numpy.maximum(alpha, 1)
+            out[:, :3] = numpy.where(alpha > 0, numpy.minimum(color, 255), 0)
+            out[:, 3] = src[:, 3]
+        return out
+
+    if pixel_format == liq.PixelFormat.RGBA_PREMULTIPLIED:
+        return None
+    if is_16bit:
+        # Keep the high bytes
+        return pixels[1::2] if pixel_format == liq.PixelFormat.RGBA16_LE else pixels[0::2]
+    size = {liq.PixelFormat.RGB: 3, liq.PixelFormat.GRAY: 1}.get(pixel_format, 4)
+    count = len(pixels) // size
+    out = bytearray(b'\xff') * (count * 4)
+    if pixel_format == liq.PixelFormat.GRAY:
+        out[0::4] = out[1::4] = out[2::4] = pixels
+    elif pixel_format in (liq.PixelFormat.RGB, liq.PixelFormat.RGBX):
+        out[0::4], out[1::4], out[2::4] = pixels[0::size], pixels[1::size], pixels[2::size]
+    elif pixel_format == liq.PixelFormat.BGRA:
+        out[0::4], out[1::4], out[2::4], out[3::4] = pixels[2::4], pixels[1::4], pixels[0::4], pixels[3::4]
+    else:
+        out[0::4], out[1::4], out[2::4], out[3::4] = pixels[1::4], pixels[2::4], pixels[3::4], pixels[0::4]
+    return out
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv[1:]] or [2048, 4096]
+    print('Python conversion: %s' % ('NumPy' if numpy is not None else 'bytearray slices'))
+    print('                                           histogram (ms)           total (ms)')
+    print('size       format              convert   python  native      python  native  speedup  extra MB')
+
+    for size in sizes:
+        width, height, rgba = common.synthetic_image(size, size)
+        for pixel_format in liq.PixelFormat:
+            if pixel_format == liq.PixelFormat.RGBA:
+                continue
+            pixels = from_rgba(rgba, pixel_format)
+            attr = liq.Attr()
+
+            def native_image():
+                return attr.create_with_format(pixels, pixel_format, width, height, 0)
+            def python_image():
+                return attr.create_rgba(to_rgba_python(pixels, pixel_format), width, height, 0)
+
+            def histogram(create):
+                liq.Histogram(attr).add_image(attr, create())
+            def total(create):
+                image = create()
+                result = image.quantize(attr)
+                result.dithering_level = 0
+                outputs.append(result.remap_image(image))
+
+            outputs = []
+            native_times = common.best_time(lambda: histogram(native_image)), common.best_time(lambda: total(native_image))
+
+            converted = to_rgba_python(pixels, pixel_format)
+            if converted is None:
+                print('%-10s %-18s %8s %8s %7.1f %11s %7.1f  (needs NumPy)' % (
+                    '%dx%d' % (width, height), pixel_format.name, '-', '-', native_times[0] * 1000, '-', native_times[1] * 1000))
+                continue
+            convert_time = common.best_time(lambda: to_rgba_python(pixels, pixel_format))
+            python_times = common.best_time(lambda: histogram(python_image)), common.best_time(lambda: total(python_image))
+            assert outputs[0] == outputs[-1]
+
+            print('%-10s %-18s %8.1f %8.1f %7.1f %11.1f %7.1f %7.2fx %9.1f' % (
+                '%dx%d' % (width, height), pixel_format.name, convert_time * 1000,
+                python_times[0] * 1000, native_times[0] * 1000,
+                python_times[1] * 1000, native_times[1] * 1000,
+                python_times[1] / native_times[1], memoryview(converted).nbytes / 2**20))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
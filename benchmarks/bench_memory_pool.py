@@ -0,0 +1,55 @@
+"""
+Compare quantizing and remapping many small images with libimagequant's
+default allocator and with a MemoryPool that is reused across images.
+
+Usage: python bench_memory_pool.py [images-per-size] [speed]
+"""
+import sys
+
+import libimagequant as liq
+
+import common
+
+
+SIZES = [64, 128, 256, 512]
+
+
+def run_job(images, pool, speed):
+    for width, height, pixels in images:
+        attr = liq.Attr(memory_pool=pool)
+        attr.speed = speed
+        image = attr.create_rgba(pixels, width, height, 0)
+        result = image.quantize(attr)
+        result.dithering_level = 1.0
+        result.remap_image(image)
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 50
+    speed = int(argv[2]) if len(argv) > 2 else 4
+
+    print('size     default (img/s)  pooled (img/s)  speedup  pool hit rate')
+    for size in SIZES:
+        images = [common.synthetic_image(size, size, x_offset=37 * i, y_offset=23 * i) for i in range(count)]
+
+        default_time = common.best_time(lambda: run_job(images, None, speed))
+
+        # One pool per worker, kept across jobs and reset afterwards
+        pool = liq.MemoryPool()
+        run_job(images[:1], pool, speed)
+        hits, misses = pool.hits, pool.misses
+        pooled_time = common.best_time(lambda: run_job(images, pool, speed))
+        hits, misses = pool.hits - hits, pool.misses - misses
+        hit_rate = hits / max(1, hits + misses)
+        pool.reset()
+
+        print('%-8s %15.1f %15.1f %7.2fx %13.1f%%' % (
+            '%dx%d' % (size, size),
+            count / default_time,
+            count / pooled_time,
+            default_time / pooled_time,
+            hit_rate * 100))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,65 @@
+"""
+Measure nearest-color search throughput of each strategy, by remapping
+images to palettes of several sizes. Remapping without dithering is one
+search per pixel, starting from the previous pixel's color; dithering
+adds the error of earlier pixels, so consecutive searches are less alike.
+
+Usage: python bench_nearest.py [image-size]
+"""
+import random
+import sys
+
+import libimagequant as liq
+
+import common
+
+
+PALETTE_SIZES = [8, 16, 32, 64, 256]
+DITHERING_LEVELS = [0.0, 1.0]
+
+
+def noise_image(width, height):
+    """
+    Opaque random pixels: the worst case, with no coherence between
+    neighbors
+    """
+    rng = random.Random(0)
+    pixels = bytearray(rng.getrandbits(8) for _ in range(width * height * 4))
+    pixels[3::4] = b'\xff' * (width * height)
+    return width, height, bytes(pixels)
+
+
+def main(argv):
+    size = int(argv[1]) if len(argv) > 1 else 1024
+
+    images = [
+        ('flower', common.load_image('flower')),
+        ('alpha-gradient', common.load_image('alpha-gradient')),
+        ('%dx%d' % (size, size), common.synthetic_image(size, size)),
+        ('noise %dx%d' % (size // 2, size // 2), noise_image(size // 2, size // 2)),
+    ]
+
+    print('image                colors  dither  ' + ''.join('%10s' % s.name for s in liq.NearestStrategy if s) + '  (Mpixels/s)')
+    for name, (width, height, pixels) in images:
+        for colors in PALETTE_SIZES:
+            for dithering_level in DITHERING_LEVELS:
+                speeds = []
+                for strategy in liq.NearestStrategy:
+                    if strategy == liq.NearestStrategy.AUTO:
+                        continue
+                    attr = liq.Attr()
+                    attr.max_colors = colors
+                    attr.speed = 10
+                    attr.nearest_strategy = strategy
+                    image = attr.create_rgba(pixels, width, height, 0)
+                    result = image.quantize(attr)
+                    result.dithering_level = dithering_level
+
+                    duration = common.best_time(lambda: result.remap_image(image))
+                    speeds.append(width * height / duration / 1e6)
+
+                print('%-20s %6d  %6.1f  ' % (name, colors, dithering_level) + ''.join('%10.1f' % s for s in speeds))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
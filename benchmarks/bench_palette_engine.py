@@ -0,0 +1,42 @@
+"""
+Compare the palette engines: quantization time and the MSE of the
+remapped (undithered) image, at the fastest speed and the default one.
+
+Usage: python bench_palette_engine.py [large-image-size]
+"""
+import sys
+
+import libimagequant as liq
+
+import common
+
+
+SPEEDS = [10, 4]
+
+
+def main(argv):
+    size = int(argv[1]) if len(argv) > 1 else 2048
+
+    images = [(name, common.load_image(name)) for name in common.TEST_IMAGES]
+    images.append(('%dx%d' % (size, size), common.synthetic_image(size, size)))
+
+    print('image                speed  engine     time (ms)      MSE')
+    for name, (width, height, pixels) in images:
+        for speed in SPEEDS:
+            for engine in liq.PaletteEngine:
+                attr = liq.Attr()
+                attr.speed = speed
+                attr.palette_engine = engine
+                image = attr.create_rgba(pixels, width, height, 0)
+
+                results = []
+                duration = common.best_time(lambda: results.append(image.quantize(attr)))
+
+                result = results[-1]
+                result.remap_image(image)
+                print('%-20s %5d  %-10s %9.1f %8.3f' % (
+                    name, speed, engine.name, duration * 1000, result.remapping_error))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,74 @@
+"""
+Compare quantizing Pillow images the way example.py does -- convert('RGBA'),
+tobytes(), create_rgba, remap_image, frombytes('P') and a putpalette() list
+built in a Python loop -- with libimagequant.pil, which reads the image's
+memory and writes the indices into the new image without copies.
+
+The input stage includes quantizing, since libimagequant.pil has the pixels
+converted as libimagequant reads them, and the output stage is remapping
+undithered and making the "P" image. Images in RGBA mode are used, and in RGB
+mode, which example.py also has to convert. Needs Pillow; zero-copy input
+needs Pillow 11.2 or later, and images that fit in one of Pillow's memory
+blocks (16 MB by default).
+
+Usage: python bench_pil.py [size ...]
+"""
+import sys
+
+import libimagequant as liq
+import libimagequant.pil
+import PIL.Image
+
+import common
+
+
+def example_input(attr, pil_image):
+    pil_image = pil_image.convert('RGBA')
+    return attr.create_rgba(pil_image.tobytes(), pil_image.width, pil_image.height, 0)
+
+
+def example_output(result, image):
+    pixels = result.remap_image(image)
+    pil_image = PIL.Image.frombytes('P', (image.width, image.height), pixels)
+    palette_data = []
+    for color in result.get_palette():
+        palette_data.append(color.r)
+        palette_data.append(color.g)
+        palette_data.append(color.b)
+    pil_image.putpalette(palette_data)
+    return pil_image
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv[1:]] or [1024, 2048]
+
+    images = [(name, common.load_image(name)) for name in common.TEST_IMAGES]
+    for size in sizes:
+        images.append(('%dx%d' % (size, size), common.synthetic_image(size, size)))
+
+    print('                                    example.py (ms)      libimagequant.pil (ms)')
+    print('image                mode         input   output         input   output   speedup')
+    for name, (width, height, pixels) in images:
+        rgba = PIL.Image.frombytes('RGBA', (width, height), pixels)
+        for pil_image in [rgba, rgba.convert('RGB')]:
+            attr = liq.Attr()
+            attr.speed = 10
+            image = attr.create_rgba(pixels, width, height, 0)
+            result = image.quantize(attr)
+            result.dithering_level = 0
+
+            example = (
+                common.best_time(lambda: example_input(attr, pil_image).quantize(attr)),
+                common.best_time(lambda: example_output(result, image)))
+            helper = (
+                common.best_time(lambda: libimagequant.pil.create_image(attr, pil_image).quantize(attr)),
+                common.best_time(lambda: libimagequant.pil.remap_image(result, image)))
+
+            print('%-20s %-6s %9.2f %8.2f %13.2f %8.2f %8.2fx' % (
+                name, pil_image.mode,
+                example[0] * 1000, example[1] * 1000, helper[0] * 1000, helper[1] * 1000,
+                sum(example) / sum(helper)))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
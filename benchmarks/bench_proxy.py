@@ -0,0 +1,77 @@
+"""
+Compare making the palette from the full image and from box-downscaled
+proxies of it (Attr.proxy_downscale): quantization time, quantization plus
+undithered remapping of the full image, and the MSE of the remapped image.
+
+The MSE is measured here on a sample of the pixels, since the error that
+libimagequant reports for a full-size palette comes from the histogram and
+isn't comparable with the one measured on the full image.
+
+Usage: python bench_proxy.py [large-image-size ...]
+"""
+import sys
+
+import libimagequant as liq
+
+import common
+
+
+FACTORS = [1, 2, 4, 8]
+SAMPLE_STEP = 61
+
+
+def sampled_mse(pixels, output, palette):
+    """
+    Mean squared error per channel of every SAMPLE_STEP-th pixel, with the
+    colors premultiplied by alpha so that only visible differences count
+    """
+    total = 0
+    count = 0
+    for i in range(0, len(output), SAMPLE_STEP):
+        color = palette[output[i]]
+        r, g, b, a = pixels[i * 4 : i * 4 + 4]
+        total += ((color.r * color.a - r * a) / 255) ** 2
+        total += ((color.g * color.a - g * a) / 255) ** 2
+        total += ((color.b * color.a - b * a) / 255) ** 2
+        total += (color.a - a) ** 2
+        count += 4
+    return total / count
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv[1:]] or [2048, 4096]
+
+    images = [(name, common.load_image(name)) for name in common.TEST_IMAGES]
+    for size in sizes:
+        images.append(('%dx%d' % (size, size), common.synthetic_image(size, size)))
+
+    print('image                factor  quantize (ms)  speedup  +remap (ms)  speedup      MSE  MSE change')
+    for name, (width, height, pixels) in images:
+        baseline = None
+        for factor in FACTORS:
+            attr = liq.Attr()
+            attr.proxy_downscale = factor
+            image = attr.create_rgba(pixels, width, height, 0)
+
+            results = []
+            quantize_time = common.best_time(lambda: results.append(image.quantize(attr)))
+
+            def quantize_and_remap():
+                result = image.quantize(attr)
+                result.dithering_level = 0
+                results.append((result, result.remap_image(image)))
+            total_time = common.best_time(quantize_and_remap)
+
+            result, output = results[-1]
+            mse = sampled_mse(pixels, output, result.get_palette())
+            if baseline is None:
+                baseline = (quantize_time, total_time, mse)
+            print('%-20s %6d %14.1f %7.2fx %12.1f %7.2fx %8.2f %+10.1f%%' % (
+                name, factor,
+                quantize_time * 1000, baseline[0] / quantize_time,
+                total_time * 1000, baseline[1] / total_time,
+                mse, (mse / baseline[2] - 1) * 100 if baseline[2] else 0))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,214 @@
+"""
+Measure every stage of the pipeline -- Attr.create_rgba, Histogram.add_image,
+Image.quantize, Result.get_palette and undithered and dithered
+Result.remap_image -- on the test images and large synthetic ones, for a
+range of speeds and max_colors values.
+
+For each case it reports megapixels per second and the allocations libimagequant
+made (counted with a MemoryTracker), and can write the results as JSON and
+compare them with the JSON of an earlier run, to catch regressions in the
+bindings or in the C library:
+
+    python bench_suite.py --output baseline.json
+    ... change something and rebuild ...
+    python bench_suite.py --baseline baseline.json
+
+The exit status is 1 if any stage got slower than the threshold, or made more
+allocations, than in the baseline. Timings of short stages vary between runs,
+so compare runs on the same otherwise idle machine, and rerun the cases that
+are reported before trusting them. To get a baseline for a change, run the
+suite with --output on the commit before it.
+
+Allocation counts don't depend on the machine, so baseline-quick.json, made
+with --quick, can be compared with --allocations-only on any build without
+OpenMP, or with OMP_NUM_THREADS=1, since some stages allocate per thread:
+
+    python bench_suite.py --quick --baseline baseline-quick.json --allocations-only
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+import libimagequant as liq
+
+import common
+
+
+STAGES = ['create_rgba', 'histogram', 'quantize', 'get_palette', 'remap', 'remap_dithered']
+MIN_STAGE_SECONDS = 0.02
+
+
+def run_round(width, height, pixels, speed, max_colors, tracker):
+    """
+    Run every stage, each on fresh objects so that nothing cached by an
+    earlier stage (converted pixels, contrast maps, refined palettes) makes a
+    later one look faster. Return {stage: (seconds, allocations, peak bytes)}.
+    """
+    attr = liq.Attr(memory_tracker=tracker)
+    attr.speed = speed
+    attr.max_colors = max_colors
+
+    measurements = {}
+    def measure(stage, func, loop=False):
+        # Allocations are counted for the first call. Stages without side
+        # effects are called again until they've run long enough to time
+        # precisely; the others would reuse what the first call cached.
+        tracker.reset()
+        base_bytes = tracker.current_bytes
+        start = time.perf_counter()
+        output = func()
+        allocations, peak_bytes = tracker.allocations, tracker.peak_bytes - base_bytes
+        calls = 1
+        while loop and time.perf_counter() - start < MIN_STAGE_SECONDS:
+            func()
+            calls += 1
+        measurements[stage] = ((time.perf_counter() - start) / calls, allocations, peak_bytes)
+        return output
+
+    image = measure('create_rgba', lambda: attr.create_rgba(pixels, width, height, 0), loop=True)
+
+    histogram = liq.Histogram(attr)
+    measure('histogram', lambda: histogram.add_image(attr, image))
+    del histogram, image
+
+    image = attr.create_rgba(pixels, width, height, 0)
+    result = measure('quantize', lambda: image.quantize(attr))
+    measure('get_palette', result.get_palette, loop=True)
+    result.dithering_level = 0
+    measure('remap', lambda: result.remap_image(image))
+    del result, image
+
+    image = attr.create_rgba(pixels, width, height, 0)
+    result = image.quantize(attr)
+    result.dithering_level = 1.0
+    measure('remap_dithered', lambda: result.remap_image(image))
+
+    return measurements
+
+
+def run_case(name, width, height, pixels, speed, max_colors, repeat):
+    """
+    Return a result record for each stage, with the best time of several rounds
+    """
+    tracker = liq.MemoryTracker()
+    rounds = [run_round(width, height, pixels, speed, max_colors, tracker) for _ in range(repeat)]
+
+    records = []
+    for stage in STAGES:
+        seconds = min(r[stage][0] for r in rounds)
+        _, allocations, peak_bytes = rounds[-1][stage]
+        records.append({
+            'image': name,
+            'width': width,
+            'height': height,
+            'speed': speed,
+            'max_colors': max_colors,
+            'stage': stage,
+            'seconds': seconds,
+            'mpixels_per_s': width * height / seconds / 1e6,
+            'allocations': allocations,
+            'peak_bytes': peak_bytes,
+        })
+    return records
+
+
+def record_key(record):
+    return (record['image'], record['speed'], record['max_colors'], record['stage'])
+
+
+def compare(records, baseline, threshold, allocations_only=False):
+    """
+    Print the cases that got slower by more than threshold (a fraction)
+    unless allocations_only, or made more allocations, than in the
+    baseline. Return how many there were.
+    """
+    old_records = {record_key(r): r for r in baseline['results']}
+    regressions = 0
+    compared = 0
+    for record in records:
+        old = old_records.get(record_key(record))
+        if old is None:
+            continue
+        compared += 1
+
+        problems = []
+        if not allocations_only and record['seconds'] > old['seconds'] * (1 + threshold):
+            problems.append('%.0f%% slower (%.3f -> %.3f ms)' % (
+                (record['seconds'] / old['seconds'] - 1) * 100, old['seconds'] * 1000, record['seconds'] * 1000))
+        if record['allocations'] > old['allocations']:
+            problems.append('%d -> %d allocations' % (old['allocations'], record['allocations']))
+        if problems:
+            regressions += 1
+            print('REGRESSION %-20s speed %2d  %3d colors  %-15s %s' % (
+                record['image'], record['speed'], record['max_colors'], record['stage'], ', '.join(problems)))
+
+    print('%d of %d cases compared with the baseline regressed' % (regressions, compared))
+    return regressions
+
+
+def parse_list(text):
+    return [int(value) for value in text.split(',')]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark every stage of the pipeline.')
+    parser.add_argument('--sizes', type=parse_list, default=[2048],
+        help='comma-separated sizes of square synthetic images (default 2048)')
+    parser.add_argument('--speeds', type=parse_list, default=list(range(1, 11)),
+        help='comma-separated speeds (default 1-10)')
+    parser.add_argument('--colors', type=parse_list, default=[16, 64, 256],
+        help='comma-separated max_colors values (default 16,64,256)')
+    parser.add_argument('--repeat', type=int, default=3,
+        help='rounds per case; the best time is kept (default 3)')
+    parser.add_argument('--quick', action='store_true',
+        help='only speeds 1, 4 and 10 with 256 colors')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+        help='slowdown to report as a regression, as a fraction (default 0.25)')
+    parser.add_argument('--allocations-only', action='store_true',
+        help='only compare allocations with the baseline, e.g. one from another machine')
+    args = parser.parse_args(argv[1:])
+
+    if args.quick:
+        args.speeds, args.colors = [1, 4, 10], [256]
+
+    images = [(name, common.load_image(name)) for name in common.TEST_IMAGES]
+    for size in args.sizes:
+        images.append(('%dx%d' % (size, size), common.synthetic_image(size, size)))
+
+    print('image                speed  colors  ' + ''.join('%16s' % stage for stage in STAGES))
+    print('                                    ' + ''.join(
+        '%16s' % ('us (allocs)' if stage == 'get_palette' else 'MP/s (allocs)') for stage in STAGES))
+    records = []
+    for name, (width, height, pixels) in images:
+        for speed in args.speeds:
+            for max_colors in args.colors:
+                case = run_case(name, width, height, pixels, speed, max_colors, args.repeat)
+                records.extend(case)
+                print('%-20s %5d  %6d  ' % (name, speed, max_colors) + ''.join('%16s' % (
+                    '%.1f (%d)' % (r['seconds'] * 1e6 if r['stage'] == 'get_palette' else r['mpixels_per_s'], r['allocations'])
+                ) for r in case))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'liq_version': liq.LIQ_VERSION_STRING,
+                'bindings_version': liq.BINDINGS_VERSION_STRING,
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': records,
+            }, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(records, baseline, args.threshold, args.allocations_only):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,48 @@
+"""
+Quantize images of several sizes with a range of latency targets, and
+compare the time taken and the quantization error with the default
+speed setting.
+
+Usage: python bench_target_latency.py [target-ms ...]
+"""
+import sys
+
+import libimagequant as liq
+
+import common
+
+
+SIZES = [None, 1024, 2048] # None is the flower test image itself
+
+
+def main(argv):
+    targets = [float(arg) for arg in argv[1:]] or [400, 150, 50, 20]
+
+    attr = liq.Attr()
+    calibration = common.best_time(attr.calibrate_latency, repeat=1)
+    print('Calibration took %.0f ms' % (calibration * 1000))
+    print()
+
+    print('image        target (ms)  time (ms)    error')
+    for size in SIZES:
+        if size is None:
+            width, height, pixels = common.load_image('flower')
+        else:
+            width, height, pixels = common.synthetic_image(size, size)
+
+        for target in [0] + targets:
+            attr.target_latency = target
+            image = attr.create_rgba(pixels, width, height, 0)
+            results = []
+            duration = common.best_time(lambda: results.append(image.quantize(attr)))
+            # quantization_error is only known if K-Means ran at least once
+            error = results[-1].quantization_error
+            print('%-12s %11s %10.1f %8s' % (
+                '%dx%d' % (width, height),
+                target or 'speed 4',
+                duration * 1000,
+                '%.2f' % error if error >= 0 else '-'))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
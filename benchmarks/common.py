@@ -0,0 +1,54 @@
+"""
+Helpers shared by the benchmark scripts
+"""
+import os, os.path
+import struct
+import time
+import zlib
+
+
+RES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'res')
+
+TEST_IMAGES = ['alpha-gradient', 'flower', 'flower-huechange-1', 'test-card']
+
+
+def load_image(name):
+    """
+    Load the test image with the given name from tests/res.
+    Return a triple (width, height, pixeldata), where pixeldata is
+    a bytes object with RGBA data.
+    """
+    with open(os.path.join(RES_DIR, name + '.raw'), 'rb') as f:
+        width, height = struct.unpack_from('<II', f.read(8))
+        return width, height, zlib.decompress(f.read())
+
+
+def synthetic_image(width, height, source='flower', x_offset=0, y_offset=0):
+    """
+    Make an image of any size by tiling a test image, starting at the
+    given offset into it. Return the same triple as load_image().
+    """
+    src_width, src_height, src_pixels = load_image(source)
+    rows = []
+    for y in range(height):
+        sy = (y + y_offset) % src_height
+        src_row = src_pixels[sy * src_width * 4 : (sy + 1) * src_width * 4]
+        start = (x_offset % src_width) * 4
+        row = (src_row[start:] + src_row * (width // src_width + 1))[:width * 4]
+        rows.append(row)
+    return width, height, b''.join(rows)
+
+
+def best_time(func, repeat=3):
+    """
+    Call func() the given number of times and return the shortest
+    duration in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best
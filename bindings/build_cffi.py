@@ -1,3 +1,4 @@
+import os
 import sys
 
 from cffi import FFI
@@ -37,6 +38,98 @@ ffibuilder.cdef(
         LIQ_COPY_PIXELS=16,
     };
 
+    enum liq_cache_mode {
+        LIQ_CACHE_AUTO=0,
+        LIQ_CACHE_KEEP=1,
+        LIQ_CACHE_DISCARD=2,
+    };
+
+    enum liq_memory_mode {
+        LIQ_MEMORY_AUTO=0,
+        LIQ_MEMORY_LOW=1,
+        LIQ_MEMORY_FULL=2,
+    };
+    enum liq_dithering_algorithm {
+        LIQ_DITHER_FLOYD_STEINBERG=0,
+        LIQ_DITHER_BAYER=1,
+        LIQ_DITHER_BLUE_NOISE=2,
+    };
+    enum liq_dither_map_mode {
+        LIQ_DITHER_MAP_OFF=0,
+        LIQ_DITHER_MAP_AUTO=1,
+        LIQ_DITHER_MAP_ALWAYS=2,
+    };
+    enum liq_palette_engine {
+        LIQ_PALETTE_MEDIANCUT=0,
+        LIQ_PALETTE_WU=1,
+    };
+
+    enum liq_nearest_strategy {
+        LIQ_NEAREST_AUTO=0,
+        LIQ_NEAREST_VP_TREE=1,
+        LIQ_NEAREST_LINEAR=2,
+        LIQ_NEAREST_GRID=3,
+    };
+
+    enum liq_pixel_format {
+        LIQ_PIXEL_RGBA=0,
+        LIQ_PIXEL_RGB=1,
+        LIQ_PIXEL_RGBX=2,
+        LIQ_PIXEL_BGRA=3,
+        LIQ_PIXEL_ARGB=4,
+        LIQ_PIXEL_GRAY=5,
+        LIQ_PIXEL_RGBA_PREMULTIPLIED=6,
+        LIQ_PIXEL_RGBA16_LE=7,
+        LIQ_PIXEL_RGBA16_BE=8,
+    };
+
+    enum liq_timing {
+        LIQ_TIMING_HISTOGRAM=0,
+        LIQ_TIMING_CONTRAST_MAPS=1,
+        LIQ_TIMING_FINALIZE_HISTOGRAM=2,
+        LIQ_TIMING_MEDIANCUT=3,
+        LIQ_TIMING_FEEDBACK_LOOP=4,
+        LIQ_TIMING_KMEANS=5,
+        LIQ_TIMING_REMAP=6,
+        LIQ_TIMING_DITHER_MAP=7,
+        LIQ_TIMING_DITHER=8,
+    };
+
+    enum liq_counter {
+        LIQ_COUNTER_HISTOGRAM_SIZE=0,
+        LIQ_COUNTER_IGNOREBITS=1,
+        LIQ_COUNTER_FEEDBACK_TRIALS=2,
+        LIQ_COUNTER_KMEANS_ITERATIONS=3,
+    };
+
+    enum liq_event_type {
+        LIQ_EVENT_ERROR=0,
+        LIQ_EVENT_LOW_MEMORY=1,
+        LIQ_EVENT_HISTOGRAM=2,
+        LIQ_EVENT_HISTOGRAM_POSTERIZED=3,
+        LIQ_EVENT_HISTOGRAM_FINALIZED=4,
+        LIQ_EVENT_FEEDBACK_TRIAL=5,
+        LIQ_EVENT_KMEANS_ITERATION=6,
+        LIQ_EVENT_QUALITY_TOO_LOW=7,
+        LIQ_EVENT_PALETTE=8,
+        LIQ_EVENT_MIN_COLORS_TRIAL=9,
+        LIQ_EVENT_REMAP=10,
+    };
+
+    enum liq_event_severity {
+        LIQ_SEVERITY_DEBUG=0,
+        LIQ_SEVERITY_INFO=1,
+        LIQ_SEVERITY_WARNING=2,
+        LIQ_SEVERITY_ERROR=3,
+    };
+
+    typedef struct liq_event {
+        int type, severity, stage;
+        double time;
+        double elapsed, mse;
+        int colors, iterations, ignorebits;
+    } liq_event;
+
     typedef struct liq_histogram_entry {
         liq_color color;
         unsigned int count;
@@ -46,17 +139,38 @@ ffibuilder.cdef(
     extern liq_attr* liq_attr_create_with_allocator(void* (*malloc)(size_t), void (*free)(void*));
     extern liq_attr* liq_attr_copy(const liq_attr *orig);
     extern void liq_attr_destroy(liq_attr *attr);
+    extern size_t liq_attr_get_memory_size(const liq_attr *attr);
 
     extern liq_histogram* liq_histogram_create(const liq_attr* attr);
     extern liq_error liq_histogram_add_image(liq_histogram *hist, const liq_attr *attr, liq_image* image);
     extern liq_error liq_histogram_add_colors(liq_histogram *hist, const liq_attr *attr, const liq_histogram_entry entries[], int num_entries, double gamma);
     extern liq_error liq_histogram_add_fixed_color(liq_histogram *hist, liq_color color, double gamma);
     extern void liq_histogram_destroy(liq_histogram *hist);
+    extern size_t liq_histogram_get_memory_size(const liq_histogram *hist);
 
     extern liq_error liq_set_max_colors(liq_attr* attr, int colors);
     extern int liq_get_max_colors(const liq_attr* attr);
     extern liq_error liq_set_speed(liq_attr* attr, int speed);
     extern int liq_get_speed(const liq_attr* attr);
+    extern liq_error liq_set_kmeans_iterations(liq_attr* attr, int iterations);
+    extern int liq_get_kmeans_iterations(const liq_attr* attr);
+    extern liq_error liq_set_kmeans_iteration_limit(liq_attr* attr, double limit);
+    extern double liq_get_kmeans_iteration_limit(const liq_attr* attr);
+    extern liq_error liq_set_feedback_loop_trials(liq_attr* attr, int trials);
+    extern int liq_get_feedback_loop_trials(const liq_attr* attr);
+    extern liq_error liq_set_use_dither_map(liq_attr* attr, enum liq_dither_map_mode mode);
+    extern int liq_get_use_dither_map(const liq_attr* attr);
+    extern void liq_set_use_contrast_maps(liq_attr* attr, int enabled);
+    extern int liq_get_use_contrast_maps(const liq_attr* attr);
+    extern liq_error liq_set_palette_engine(liq_attr* attr, enum liq_palette_engine engine);
+    extern int liq_get_palette_engine(const liq_attr* attr);
+    extern liq_error liq_set_nearest_strategy(liq_attr* attr, enum liq_nearest_strategy strategy);
+    extern int liq_get_nearest_strategy(const liq_attr* attr);
+    extern liq_error liq_set_proxy_downscale(liq_attr* attr, int factor);
+    extern int liq_get_proxy_downscale(const liq_attr* attr);
+    extern liq_error liq_set_target_latency(liq_attr* attr, double milliseconds);
+    extern double liq_get_target_latency(const liq_attr* attr);
+    extern liq_error liq_calibrate_latency(liq_attr* attr);
     extern liq_error liq_set_min_opacity(liq_attr* attr, int min);
     extern int liq_get_min_opacity(const liq_attr* attr);
     extern liq_error liq_set_min_posterization(liq_attr* attr, int bits);
@@ -65,12 +179,17 @@ ffibuilder.cdef(
     extern int liq_get_min_quality(const liq_attr* attr);
     extern int liq_get_max_quality(const liq_attr* attr);
     extern void liq_set_last_index_transparent(liq_attr* attr, int is_last);
+    extern void liq_set_minimize_colors(liq_attr* attr, int enabled);
+    extern int liq_get_minimize_colors(const liq_attr* attr);
 
     typedef void liq_log_callback_function(const liq_attr*, const char *message, void* user_info);
     typedef void liq_log_flush_callback_function(const liq_attr*, void* user_info);
     extern void liq_set_log_callback(liq_attr*, liq_log_callback_function*, void* user_info);
     extern void liq_set_log_flush_callback(liq_attr*, liq_log_flush_callback_function*, void* user_info);
 
+    typedef void liq_event_callback_function(const liq_event *event, void* user_info);
+    extern void liq_set_event_callback(liq_attr*, liq_event_callback_function*, void* user_info);
+
     typedef int liq_progress_callback_function(float progress_percent, void* user_info);
     extern void liq_attr_set_progress_callback(liq_attr*, liq_progress_callback_function*, void* user_info);
     extern void liq_result_set_progress_callback(liq_result*, liq_progress_callback_function*, void* user_info);
@@ -78,6 +197,7 @@ ffibuilder.cdef(
     // The rows and their data are not modified. The type of `rows` is non-const only due to a bug in C's typesystem design.
     extern liq_image *liq_image_create_rgba_rows(const liq_attr *attr, void *const rows[], int width, int height, double gamma);
     extern liq_image *liq_image_create_rgba(const liq_attr *attr, const void *bitmap, int width, int height, double gamma);
+    extern liq_image *liq_image_create_with_format(const liq_attr *attr, const void *bitmap, enum liq_pixel_format format, int width, int height, size_t row_stride, double gamma);
 
     typedef void liq_image_get_rgba_row_callback(liq_color row_out[], int row, int width, void* user_info);
     extern liq_image *liq_image_create_custom(const liq_attr *attr, liq_image_get_rgba_row_callback *row_callback, void* user_info, int width, int height, double gamma);
@@ -86,6 +206,16 @@ ffibuilder.cdef(
     extern liq_error liq_image_set_background(liq_image *img, liq_image *background_image);
     extern liq_error liq_image_set_importance_map(liq_image *img, unsigned char buffer[], size_t buffer_size, enum liq_ownership memory_handling);
     extern liq_error liq_image_add_fixed_color(liq_image *img, liq_color color);
+    extern liq_error liq_image_set_cache_mode(liq_image *img, enum liq_cache_mode mode);
+    extern int liq_image_get_cache_mode(const liq_image *img);
+    extern size_t liq_image_get_cache_size(const liq_image *img);
+    extern size_t liq_image_release_cache(liq_image *img);
+    extern liq_error liq_image_set_memory_mode(liq_image *img, enum liq_memory_mode mode);
+    extern int liq_image_get_memory_mode(const liq_image *img);
+    extern int liq_image_is_low_memory(const liq_image *img);
+    extern size_t liq_image_estimate_quantize_memory(const liq_image *img, const liq_attr *attr);
+    extern size_t liq_image_estimate_remap_memory(const liq_image *img, const liq_result *result);
+    extern size_t liq_image_get_memory_size(const liq_image *img);
     extern int liq_image_get_width(const liq_image *img);
     extern int liq_image_get_height(const liq_image *img);
     extern void liq_image_destroy(liq_image *img);
@@ -94,6 +224,14 @@ ffibuilder.cdef(
     extern liq_error liq_image_quantize(liq_image *const input_image, liq_attr *const options, liq_result **result_output);
 
     extern liq_error liq_set_dithering_level(liq_result *res, float dither_level);
+    extern liq_error liq_set_fast_remapping(liq_result *res, int enabled);
+    extern int liq_get_fast_remapping(const liq_result *res);
+    extern liq_error liq_set_dithering_algorithm(liq_result *res, enum liq_dithering_algorithm algorithm);
+    extern int liq_get_dithering_algorithm(const liq_result *res);
+    extern liq_error liq_set_parallel_dithering(liq_result *res, int enabled);
+    extern int liq_get_parallel_dithering(const liq_result *res);
+    extern liq_error liq_set_deterministic_dithering(liq_result *res, int enabled);
+    extern int liq_get_deterministic_dithering(const liq_result *res);
     extern liq_error liq_set_output_gamma(liq_result* res, double gamma);
     extern double liq_get_output_gamma(const liq_result *result);
 
@@ -101,12 +239,17 @@ ffibuilder.cdef(
 
     extern liq_error liq_write_remapped_image(liq_result *result, liq_image *input_image, void *buffer, size_t buffer_size);
     extern liq_error liq_write_remapped_image_rows(liq_result *result, liq_image *input_image, unsigned char **row_pointers);
+    extern liq_error liq_write_remapped_image_band(liq_result *result, liq_image *input_image, int first_row, int rows, void *buffer, size_t buffer_size);
+    extern liq_error liq_write_remapped_image_band_rows(liq_result *result, liq_image *input_image, int first_row, int rows, unsigned char **row_pointers);
 
     extern double liq_get_quantization_error(const liq_result *result);
     extern int liq_get_quantization_quality(const liq_result *result);
     extern double liq_get_remapping_error(const liq_result *result);
     extern int liq_get_remapping_quality(const liq_result *result);
+    extern double liq_get_timing(const liq_result *result, enum liq_timing stage);
+    extern int liq_get_counter(const liq_result *result, enum liq_counter counter);
 
+    extern size_t liq_result_get_memory_size(const liq_result *result);
     extern void liq_result_destroy(liq_result *);
 
     extern int liq_version(void);
@@ -118,15 +261,547 @@ ffibuilder.cdef(
     extern "Python" int _py_liq_progress_callback_function_impl(float progress_percent, void* user_info);
 
     static const char *_py_get_liq_version_string();
+
+    typedef struct _py_liq_memory_tracker {
+        size_t current_bytes, peak_bytes, largest_allocation, limit;
+        unsigned long long allocations, frees, failed_allocations;
+        ...;
+    } _py_liq_memory_tracker;
+    typedef struct _py_liq_memory_pool {
+        size_t cached_bytes, max_cached_bytes;
+        unsigned long long hits, misses;
+        ...;
+    } _py_liq_memory_pool;
+    static _py_liq_memory_tracker *_py_liq_memory_tracker_create(void);
+    static void _py_liq_memory_tracker_release(_py_liq_memory_tracker *tracker);
+    static void _py_liq_memory_tracker_set_limit(_py_liq_memory_tracker *tracker, size_t limit);
+    static void _py_liq_memory_tracker_reset(_py_liq_memory_tracker *tracker);
+    static _py_liq_memory_pool *_py_liq_memory_pool_create(void);
+    static void _py_liq_memory_pool_release(_py_liq_memory_pool *pool);
+    static void _py_liq_memory_pool_set_max_cached_bytes(_py_liq_memory_pool *pool, size_t max_cached_bytes);
+    static void _py_liq_memory_pool_reset(_py_liq_memory_pool *pool);
+    static void *_py_liq_malloc(size_t size);
+    static void _py_liq_free(void *ptr);
+    static _py_liq_memory_tracker *_py_liq_set_current_memory_tracker(_py_liq_memory_tracker *tracker);
+    static _py_liq_memory_pool *_py_liq_set_current_memory_pool(_py_liq_memory_pool *pool);
+    static int _py_liq_take_allocation_failed(void);
+
+    typedef struct _py_liq_event_log {
+        size_t count, capacity;
+        unsigned long long dropped;
+        int min_severity;
+        ...;
+    } _py_liq_event_log;
+    static _py_liq_event_log *_py_liq_event_log_create(size_t capacity);
+    static void _py_liq_event_log_release(_py_liq_event_log *log);
+    static void _py_liq_event_log_set_min_severity(_py_liq_event_log *log, int min_severity);
+    static void _py_liq_event_log_append(const liq_event *event, void *user_info);
+    static size_t _py_liq_event_log_drain(_py_liq_event_log *log, liq_event *out);
+
+    enum {
+        _PY_LIQ_PROGRESS_IDLE,
+        _PY_LIQ_PROGRESS_QUANTIZE,
+        _PY_LIQ_PROGRESS_REMAP,
+    };
+    typedef struct _py_liq_progress {
+        ...;
+    } _py_liq_progress;
+    static _py_liq_progress *_py_liq_progress_create(void);
+    static void _py_liq_progress_release(_py_liq_progress *progress);
+    static int _py_liq_progress_quantize(float progress_percent, void *user_info);
+    static int _py_liq_progress_remap(float progress_percent, void *user_info);
+    static float _py_liq_progress_get_percent(_py_liq_progress *progress);
+    static int _py_liq_progress_get_stage(_py_liq_progress *progress);
+    static int _py_liq_progress_get_abort(_py_liq_progress *progress);
+    static void _py_liq_progress_set(_py_liq_progress *progress, float percent, int stage, int abort);
+    static void _py_liq_progress_abort(_py_liq_progress *progress);
 """)
 
+# libimagequant's parallel code paths use OpenMP, which is opt-in because
+# the resulting module then depends on the compiler's OpenMP runtime
+extra_compile_args = ['-std=c99']
+extra_link_args = []
+if os.environ.get('LIQ_OPENMP'):
+    if sys.platform == 'win32':
+        extra_compile_args.append('/openmp')
+    else:
+        extra_compile_args.append('-fopenmp')
+        extra_link_args.append('-fopenmp')
+
 ffibuilder.set_source('libimagequant._libimagequant',  # name of the output C extension
 """
     #include "libimagequant.h"
 
+    #include <stdint.h>
+    #include <stdlib.h>
+    #include <string.h>
+
+    // Trackers, pools and event logs can be shared by copies of an Attr used
+    // on several threads, so their state is only changed with their lock held
+    #if defined(_WIN32)
+    #define WIN32_LEAN_AND_MEAN
+    #include <windows.h>
+    typedef SRWLOCK _py_liq_lock;
+    #define _PY_LIQ_LOCK_INIT(lock) InitializeSRWLock(lock)
+    #define _PY_LIQ_LOCK_DESTROY(lock) ((void)0)
+    #define _PY_LIQ_LOCK(lock) AcquireSRWLockExclusive(lock)
+    #define _PY_LIQ_UNLOCK(lock) ReleaseSRWLockExclusive(lock)
+    #else
+    #include <pthread.h>
+    typedef pthread_mutex_t _py_liq_lock;
+    #define _PY_LIQ_LOCK_INIT(lock) pthread_mutex_init(lock, NULL)
+    #define _PY_LIQ_LOCK_DESTROY(lock) pthread_mutex_destroy(lock)
+    #define _PY_LIQ_LOCK(lock) pthread_mutex_lock(lock)
+    #define _PY_LIQ_UNLOCK(lock) pthread_mutex_unlock(lock)
+    #endif
+
     static const char *_py_get_liq_version_string() {
         return LIQ_VERSION_STRING;
     }
+
+    typedef struct _py_liq_memory_tracker {
+        size_t current_bytes, peak_bytes, largest_allocation, limit;
+        unsigned long long allocations, frees, failed_allocations;
+        size_t live_blocks;
+        int released;
+        _py_liq_lock lock;
+    } _py_liq_memory_tracker;
+
+    // Pooled blocks are rounded up to a power of two between 64 bytes and
+    // 64 MB, and freed blocks are kept on a list per size for reuse
+    #define _PY_LIQ_POOL_MIN_CLASS 6
+    #define _PY_LIQ_POOL_MAX_CLASS 26
+
+    typedef struct _py_liq_memory_pool {
+        size_t cached_bytes, max_cached_bytes;
+        unsigned long long hits, misses;
+        size_t live_blocks;
+        int released;
+        void *free_lists[_PY_LIQ_POOL_MAX_CLASS + 1];
+        _py_liq_lock lock;
+    } _py_liq_memory_pool;
+
+    // Placed in front of every block. Padded so that blocks stay 16-byte
+    // aligned, like libimagequant's default allocator.
+    typedef union _py_liq_block_header {
+        struct {
+            void *raw;
+            _py_liq_memory_tracker *tracker;
+            _py_liq_memory_pool *pool;
+            size_t size;
+            unsigned int size_class;
+        } h;
+        unsigned char padding[48];
+    } _py_liq_block_header;
+
+    #define _PY_LIQ_HEADER(ptr) ((_py_liq_block_header *)(ptr) - 1)
+
+    // liq_attr_create_with_allocator() callbacks take no context argument,
+    // so the tracker and pool to use for new allocations are set per thread
+    // by the bindings around every call that can allocate. libimagequant
+    // allocates only on the calling thread, before its OpenMP threads start
+    // (they use buffers made for them), so those never need to know. Frees
+    // read the tracker and pool from the block header, on any thread.
+    //
+    // A failed allocation is also noted per thread, since libimagequant
+    // reports some as other errors, and a shared tracker's count of them
+    // includes other threads' failures.
+    #if defined(_MSC_VER)
+    static __declspec(thread) _py_liq_memory_tracker *_py_liq_current_memory_tracker;
+    static __declspec(thread) _py_liq_memory_pool *_py_liq_current_memory_pool;
+    static __declspec(thread) int _py_liq_allocation_failed;
+    #else
+    static __thread _py_liq_memory_tracker *_py_liq_current_memory_tracker;
+    static __thread _py_liq_memory_pool *_py_liq_current_memory_pool;
+    static __thread int _py_liq_allocation_failed;
+    #endif
+
+    static _py_liq_memory_tracker *_py_liq_set_current_memory_tracker(_py_liq_memory_tracker *tracker) {
+        _py_liq_memory_tracker *previous = _py_liq_current_memory_tracker;
+        _py_liq_current_memory_tracker = tracker;
+        return previous;
+    }
+
+    static _py_liq_memory_pool *_py_liq_set_current_memory_pool(_py_liq_memory_pool *pool) {
+        _py_liq_memory_pool *previous = _py_liq_current_memory_pool;
+        _py_liq_current_memory_pool = pool;
+        return previous;
+    }
+
+    // Whether an allocation on this thread failed since the last call
+    static int _py_liq_take_allocation_failed(void) {
+        const int failed = _py_liq_allocation_failed;
+        _py_liq_allocation_failed = 0;
+        return failed;
+    }
+
+    static _py_liq_memory_tracker *_py_liq_memory_tracker_create(void) {
+        _py_liq_memory_tracker *tracker = calloc(1, sizeof(_py_liq_memory_tracker));
+        if (tracker) {
+            _PY_LIQ_LOCK_INIT(&tracker->lock);
+        }
+        return tracker;
+    }
+
+    static void _py_liq_memory_tracker_destroy(_py_liq_memory_tracker *tracker) {
+        _PY_LIQ_LOCK_DESTROY(&tracker->lock);
+        free(tracker);
+    }
+
+    // The Python objects may be collected before objects that still hold
+    // blocks belonging to them, so whichever goes last frees the struct
+    static void _py_liq_memory_tracker_release(_py_liq_memory_tracker *tracker) {
+        _PY_LIQ_LOCK(&tracker->lock);
+        tracker->released = 1;
+        const int last = !tracker->live_blocks;
+        _PY_LIQ_UNLOCK(&tracker->lock);
+        if (last) {
+            _py_liq_memory_tracker_destroy(tracker);
+        }
+    }
+
+    static void _py_liq_memory_tracker_set_limit(_py_liq_memory_tracker *tracker, size_t limit) {
+        _PY_LIQ_LOCK(&tracker->lock);
+        tracker->limit = limit;
+        _PY_LIQ_UNLOCK(&tracker->lock);
+    }
+
+    static void _py_liq_memory_tracker_reset(_py_liq_memory_tracker *tracker) {
+        _PY_LIQ_LOCK(&tracker->lock);
+        tracker->peak_bytes = tracker->current_bytes;
+        tracker->largest_allocation = 0;
+        tracker->allocations = 0;
+        tracker->frees = 0;
+        tracker->failed_allocations = 0;
+        _PY_LIQ_UNLOCK(&tracker->lock);
+    }
+
+    // Counts an allocation against the tracker, or returns 0 if it would
+    // exceed the limit. The check and the count are made under one lock, so
+    // threads sharing the tracker can't exceed the limit together.
+    static int _py_liq_memory_tracker_reserve(_py_liq_memory_tracker *tracker, size_t size) {
+        _PY_LIQ_LOCK(&tracker->lock);
+        const int ok = !tracker->limit || (size <= tracker->limit && tracker->current_bytes <= tracker->limit - size);
+        if (ok) {
+            tracker->allocations++;
+            tracker->live_blocks++;
+            tracker->current_bytes += size;
+            if (tracker->current_bytes > tracker->peak_bytes) tracker->peak_bytes = tracker->current_bytes;
+            if (size > tracker->largest_allocation) tracker->largest_allocation = size;
+        } else {
+            tracker->failed_allocations++;
+        }
+        _PY_LIQ_UNLOCK(&tracker->lock);
+        return ok;
+    }
+
+    // Undoes a reservation whose allocation failed
+    static void _py_liq_memory_tracker_cancel(_py_liq_memory_tracker *tracker, size_t size) {
+        _PY_LIQ_LOCK(&tracker->lock);
+        tracker->allocations--;
+        tracker->live_blocks--;
+        tracker->current_bytes -= size;
+        tracker->failed_allocations++;
+        _PY_LIQ_UNLOCK(&tracker->lock);
+    }
+
+    static _py_liq_memory_pool *_py_liq_memory_pool_create(void) {
+        _py_liq_memory_pool *pool = calloc(1, sizeof(_py_liq_memory_pool));
+        if (pool) {
+            _PY_LIQ_LOCK_INIT(&pool->lock);
+        }
+        return pool;
+    }
+
+    static void _py_liq_memory_pool_destroy(_py_liq_memory_pool *pool) {
+        _PY_LIQ_LOCK_DESTROY(&pool->lock);
+        free(pool);
+    }
+
+    // The cached blocks are taken off the lists with the lock held, and
+    // given back to the system after it's released
+    static void _py_liq_memory_pool_trim(_py_liq_memory_pool *pool) {
+        void *free_lists[_PY_LIQ_POOL_MAX_CLASS + 1];
+        _PY_LIQ_LOCK(&pool->lock);
+        for (unsigned int size_class = _PY_LIQ_POOL_MIN_CLASS; size_class <= _PY_LIQ_POOL_MAX_CLASS; size_class++) {
+            free_lists[size_class] = pool->free_lists[size_class];
+            pool->free_lists[size_class] = NULL;
+        }
+        pool->cached_bytes = 0;
+        _PY_LIQ_UNLOCK(&pool->lock);
+
+        for (unsigned int size_class = _PY_LIQ_POOL_MIN_CLASS; size_class <= _PY_LIQ_POOL_MAX_CLASS; size_class++) {
+            void *ptr = free_lists[size_class];
+            while (ptr) {
+                void *next = *(void **)ptr;
+                free(_PY_LIQ_HEADER(ptr)->h.raw);
+                ptr = next;
+            }
+        }
+    }
+
+    static void _py_liq_memory_pool_release(_py_liq_memory_pool *pool) {
+        _py_liq_memory_pool_trim(pool);
+        _PY_LIQ_LOCK(&pool->lock);
+        pool->released = 1;
+        const int last = !pool->live_blocks;
+        _PY_LIQ_UNLOCK(&pool->lock);
+        if (last) {
+            _py_liq_memory_pool_destroy(pool);
+        }
+    }
+
+    static void _py_liq_memory_pool_set_max_cached_bytes(_py_liq_memory_pool *pool, size_t max_cached_bytes) {
+        _PY_LIQ_LOCK(&pool->lock);
+        pool->max_cached_bytes = max_cached_bytes;
+        const int over = pool->cached_bytes > max_cached_bytes;
+        _PY_LIQ_UNLOCK(&pool->lock);
+        if (over) {
+            _py_liq_memory_pool_trim(pool);
+        }
+    }
+
+    static void _py_liq_memory_pool_reset(_py_liq_memory_pool *pool) {
+        _py_liq_memory_pool_trim(pool);
+        _PY_LIQ_LOCK(&pool->lock);
+        pool->hits = 0;
+        pool->misses = 0;
+        _PY_LIQ_UNLOCK(&pool->lock);
+    }
+
+    // 0 if blocks of this size aren't pooled
+    static unsigned int _py_liq_pool_size_class(size_t size) {
+        unsigned int size_class = _PY_LIQ_POOL_MIN_CLASS;
+        while (((size_t)1 << size_class) < size) {
+            if (++size_class > _PY_LIQ_POOL_MAX_CLASS) return 0;
+        }
+        return size_class;
+    }
+
+    static void *_py_liq_malloc(size_t size) {
+        _py_liq_memory_tracker *tracker = _py_liq_current_memory_tracker;
+        _py_liq_memory_pool *pool = _py_liq_current_memory_pool;
+        if (tracker && !_py_liq_memory_tracker_reserve(tracker, size)) {
+            _py_liq_allocation_failed = 1;
+            return NULL;
+        }
+
+        unsigned int size_class = pool ? _py_liq_pool_size_class(size) : 0;
+        unsigned char *ptr = NULL;
+        if (size_class) {
+            _PY_LIQ_LOCK(&pool->lock);
+            ptr = pool->free_lists[size_class];
+            if (ptr) {
+                pool->free_lists[size_class] = *(void **)ptr;
+                pool->cached_bytes -= (size_t)1 << size_class;
+                pool->hits++;
+            } else {
+                pool->misses++;
+            }
+            pool->live_blocks++;
+            _PY_LIQ_UNLOCK(&pool->lock);
+        }
+
+        if (!ptr) {
+            size_t capacity = size_class ? (size_t)1 << size_class : size;
+            unsigned char *raw = malloc(capacity + sizeof(_py_liq_block_header) + 16);
+            if (!raw) {
+                _py_liq_allocation_failed = 1;
+                if (tracker) _py_liq_memory_tracker_cancel(tracker, size);
+                if (size_class) {
+                    // The pool's Python object is alive during the call, so it isn't released
+                    _PY_LIQ_LOCK(&pool->lock);
+                    pool->live_blocks--;
+                    _PY_LIQ_UNLOCK(&pool->lock);
+                }
+                return NULL;
+            }
+            ptr = raw + sizeof(_py_liq_block_header);
+            ptr += (16 - ((uintptr_t)ptr & 15)) & 15;
+            _PY_LIQ_HEADER(ptr)->h.raw = raw;
+        }
+
+        _py_liq_block_header *header = _PY_LIQ_HEADER(ptr);
+        header->h.tracker = tracker;
+        header->h.pool = size_class ? pool : NULL;
+        header->h.size = size;
+        header->h.size_class = size_class;
+        return ptr;
+    }
+
+    static void _py_liq_free(void *ptr) {
+        if (!ptr) return;
+
+        _py_liq_block_header *header = _PY_LIQ_HEADER(ptr);
+        _py_liq_memory_tracker *tracker = header->h.tracker;
+        if (tracker) {
+            _PY_LIQ_LOCK(&tracker->lock);
+            tracker->frees++;
+            tracker->current_bytes -= header->h.size;
+            const int last = !--tracker->live_blocks && tracker->released;
+            _PY_LIQ_UNLOCK(&tracker->lock);
+            if (last) {
+                _py_liq_memory_tracker_destroy(tracker);
+            }
+        }
+
+        _py_liq_memory_pool *pool = header->h.pool;
+        if (pool) {
+            size_t capacity = (size_t)1 << header->h.size_class;
+            _PY_LIQ_LOCK(&pool->lock);
+            pool->live_blocks--;
+            const int cached = !pool->released && pool->cached_bytes + capacity <= pool->max_cached_bytes;
+            if (cached) {
+                *(void **)ptr = pool->free_lists[header->h.size_class];
+                pool->free_lists[header->h.size_class] = ptr;
+                pool->cached_bytes += capacity;
+            }
+            const int last = pool->released && !pool->live_blocks;
+            _PY_LIQ_UNLOCK(&pool->lock);
+            if (cached) {
+                return;
+            }
+            if (last) {
+                _py_liq_memory_pool_destroy(pool);
+            }
+        }
+        free(header->h.raw);
+    }
+
+    // Events are stored here by libimagequant's event callback, and only
+    // converted to Python objects when the bindings drain the log, so
+    // emitting an event never calls into Python
+    typedef struct _py_liq_event_log {
+        liq_event *events;
+        size_t count, capacity;
+        unsigned long long dropped;
+        int min_severity;
+        _py_liq_lock lock;
+    } _py_liq_event_log;
+
+    static _py_liq_event_log *_py_liq_event_log_create(size_t capacity) {
+        _py_liq_event_log *log = calloc(1, sizeof(_py_liq_event_log));
+        if (!log) return NULL;
+        log->events = malloc((capacity ? capacity : 1) * sizeof(liq_event));
+        if (!log->events) {
+            free(log);
+            return NULL;
+        }
+        log->capacity = capacity;
+        _PY_LIQ_LOCK_INIT(&log->lock);
+        return log;
+    }
+
+    static void _py_liq_event_log_release(_py_liq_event_log *log) {
+        _PY_LIQ_LOCK_DESTROY(&log->lock);
+        free(log->events);
+        free(log);
+    }
+
+    static void _py_liq_event_log_set_min_severity(_py_liq_event_log *log, int min_severity) {
+        _PY_LIQ_LOCK(&log->lock);
+        log->min_severity = min_severity;
+        _PY_LIQ_UNLOCK(&log->lock);
+    }
+
+    static void _py_liq_event_log_append(const liq_event *event, void *user_info) {
+        _py_liq_event_log *log = user_info;
+        _PY_LIQ_LOCK(&log->lock);
+        if (event->severity >= log->min_severity) {
+            if (log->count >= log->capacity) {
+                log->dropped++;
+            } else {
+                log->events[log->count++] = *event;
+            }
+        }
+        _PY_LIQ_UNLOCK(&log->lock);
+    }
+
+    // Copies the recorded events to out, which has room for the capacity,
+    // and empties the log. Returns the number of events.
+    static size_t _py_liq_event_log_drain(_py_liq_event_log *log, liq_event *out) {
+        _PY_LIQ_LOCK(&log->lock);
+        const size_t count = log->count;
+        memcpy(out, log->events, count * sizeof(liq_event));
+        log->count = 0;
+        _PY_LIQ_UNLOCK(&log->lock);
+        return count;
+    }
+
+    // Written by libimagequant's progress callbacks while the GIL is
+    // released, and read or aborted by any Python thread, so every access
+    // is atomic. MSVC makes volatile accesses atomic.
+    enum {
+        _PY_LIQ_PROGRESS_IDLE,
+        _PY_LIQ_PROGRESS_QUANTIZE,
+        _PY_LIQ_PROGRESS_REMAP,
+    };
+
+    typedef struct _py_liq_progress {
+        volatile float percent;
+        volatile int stage, abort;
+    } _py_liq_progress;
+
+    #if defined(_MSC_VER)
+    #define _PY_LIQ_LOAD(ptr, out) (*(out) = *(ptr))
+    #define _PY_LIQ_STORE(ptr, value) (*(ptr) = *(value))
+    #else
+    #define _PY_LIQ_LOAD(ptr, out) __atomic_load(ptr, out, __ATOMIC_ACQUIRE)
+    #define _PY_LIQ_STORE(ptr, value) __atomic_store(ptr, value, __ATOMIC_RELEASE)
+    #endif
+
+    static _py_liq_progress *_py_liq_progress_create(void) {
+        return calloc(1, sizeof(_py_liq_progress));
+    }
+
+    static void _py_liq_progress_release(_py_liq_progress *progress) {
+        free(progress);
+    }
+
+    static float _py_liq_progress_get_percent(_py_liq_progress *progress) {
+        float percent;
+        _PY_LIQ_LOAD(&progress->percent, &percent);
+        return percent;
+    }
+
+    static int _py_liq_progress_get_stage(_py_liq_progress *progress) {
+        int stage;
+        _PY_LIQ_LOAD(&progress->stage, &stage);
+        return stage;
+    }
+
+    static int _py_liq_progress_get_abort(_py_liq_progress *progress) {
+        int abort;
+        _PY_LIQ_LOAD(&progress->abort, &abort);
+        return abort;
+    }
+
+    static void _py_liq_progress_set(_py_liq_progress *progress, float percent, int stage, int abort) {
+        _PY_LIQ_STORE(&progress->percent, &percent);
+        _PY_LIQ_STORE(&progress->stage, &stage);
+        _PY_LIQ_STORE(&progress->abort, &abort);
+    }
+
+    // Only sets abort, so it can't undo an update made while the caller ran
+    static void _py_liq_progress_abort(_py_liq_progress *progress) {
+        const int abort = 1;
+        _PY_LIQ_STORE(&progress->abort, &abort);
+    }
+
+    // Returns 0 to make libimagequant stop
+    static int _py_liq_progress_update(_py_liq_progress *progress, float percent, int stage) {
+        _PY_LIQ_STORE(&progress->stage, &stage);
+        _PY_LIQ_STORE(&progress->percent, &percent);
+        return !_py_liq_progress_get_abort(progress);
+    }
+
+    static int _py_liq_progress_quantize(float progress_percent, void *user_info) {
+        return _py_liq_progress_update(user_info, progress_percent, _PY_LIQ_PROGRESS_QUANTIZE);
+    }
+
+    static int _py_liq_progress_remap(float progress_percent, void *user_info) {
+        return _py_liq_progress_update(user_info, progress_percent, _PY_LIQ_PROGRESS_REMAP);
+    }
 """,
     sources=['libimagequant_c/blur.c',
              'libimagequant_c/kmeans.c',
@@ -134,8 +809,10 @@ ffibuilder.set_source('libimagequant._libimagequant',  # name of the output C ex
              'libimagequant_c/mediancut.c',
              'libimagequant_c/mempool.c',
              'libimagequant_c/nearest.c',
-             'libimagequant_c/pam.c'],
-    extra_compile_args=['-std=c99'],
+             'libimagequant_c/pam.c',
+             'libimagequant_c/wu.c'],
+    extra_compile_args=extra_compile_args,
+    extra_link_args=extra_link_args,
     include_dirs=['libimagequant_c'])
 
 if __name__ == '__main__':
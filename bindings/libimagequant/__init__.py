@@ -1,4 +1,7 @@
+import abc
 import collections
+import contextlib
+import enum
 from typing import Callable, List
 
 from ._libimagequant import lib, ffi
@@ -112,6 +115,316 @@ def _py_liq_progress_callback_function_impl(progress_percent, user_info_raw):
 
 
 Color = collections.namedtuple('Color', ['r', 'g', 'b', 'a'])
+Event = collections.namedtuple('Event', ['type', 'severity', 'stage', 'time', 'elapsed', 'mse', 'colors', 'iterations', 'ignorebits'])
+
+
+class CacheMode(enum.IntEnum):
+    """
+    Equivalent to enum liq_cache_mode
+    """
+    AUTO = lib.LIQ_CACHE_AUTO
+    KEEP = lib.LIQ_CACHE_KEEP
+    DISCARD = lib.LIQ_CACHE_DISCARD
+
+
+class MemoryMode(enum.IntEnum):
+    """
+    Equivalent to enum liq_memory_mode
+    """
+    AUTO = lib.LIQ_MEMORY_AUTO
+    LOW = lib.LIQ_MEMORY_LOW
+    FULL = lib.LIQ_MEMORY_FULL
+
+
+class DitheringAlgorithm(enum.IntEnum):
+    """
+    Equivalent to enum liq_dithering_algorithm
+    """
+    FLOYD_STEINBERG = lib.LIQ_DITHER_FLOYD_STEINBERG
+    BAYER = lib.LIQ_DITHER_BAYER
+    BLUE_NOISE = lib.LIQ_DITHER_BLUE_NOISE
+
+
+class DitherMapMode(enum.IntEnum):
+    """
+    Equivalent to enum liq_dither_map_mode
+    """
+    OFF = lib.LIQ_DITHER_MAP_OFF
+    AUTO = lib.LIQ_DITHER_MAP_AUTO
+    ALWAYS = lib.LIQ_DITHER_MAP_ALWAYS
+
+
+class PaletteEngine(enum.IntEnum):
+    """
+    Equivalent to enum liq_palette_engine
+    """
+    MEDIANCUT = lib.LIQ_PALETTE_MEDIANCUT
+    WU = lib.LIQ_PALETTE_WU
+
+
+class NearestStrategy(enum.IntEnum):
+    """
+    Equivalent to enum liq_nearest_strategy
+    """
+    AUTO = lib.LIQ_NEAREST_AUTO
+    VP_TREE = lib.LIQ_NEAREST_VP_TREE
+    LINEAR = lib.LIQ_NEAREST_LINEAR
+    GRID = lib.LIQ_NEAREST_GRID
+
+
+class PixelFormat(enum.IntEnum):
+    """
+    Equivalent to enum liq_pixel_format
+    """
+    RGBA = lib.LIQ_PIXEL_RGBA
+    RGB = lib.LIQ_PIXEL_RGB
+    RGBX = lib.LIQ_PIXEL_RGBX
+    BGRA = lib.LIQ_PIXEL_BGRA
+    ARGB = lib.LIQ_PIXEL_ARGB
+    GRAY = lib.LIQ_PIXEL_GRAY
+    RGBA_PREMULTIPLIED = lib.LIQ_PIXEL_RGBA_PREMULTIPLIED
+    RGBA16_LE = lib.LIQ_PIXEL_RGBA16_LE
+    RGBA16_BE = lib.LIQ_PIXEL_RGBA16_BE
+
+
+# Bytes per pixel of the formats that don't have 4
+_PIXEL_FORMAT_SIZES = {PixelFormat.RGB: 3, PixelFormat.GRAY: 1, PixelFormat.RGBA16_LE: 8, PixelFormat.RGBA16_BE: 8}
+
+
+class EventType(enum.IntEnum):
+    """
+    Equivalent to enum liq_event_type
+    """
+    ERROR = lib.LIQ_EVENT_ERROR
+    LOW_MEMORY = lib.LIQ_EVENT_LOW_MEMORY
+    HISTOGRAM = lib.LIQ_EVENT_HISTOGRAM
+    HISTOGRAM_POSTERIZED = lib.LIQ_EVENT_HISTOGRAM_POSTERIZED
+    HISTOGRAM_FINALIZED = lib.LIQ_EVENT_HISTOGRAM_FINALIZED
+    FEEDBACK_TRIAL = lib.LIQ_EVENT_FEEDBACK_TRIAL
+    KMEANS_ITERATION = lib.LIQ_EVENT_KMEANS_ITERATION
+    QUALITY_TOO_LOW = lib.LIQ_EVENT_QUALITY_TOO_LOW
+    PALETTE = lib.LIQ_EVENT_PALETTE
+    MIN_COLORS_TRIAL = lib.LIQ_EVENT_MIN_COLORS_TRIAL
+    REMAP = lib.LIQ_EVENT_REMAP
+
+
+class EventSeverity(enum.IntEnum):
+    """
+    Equivalent to enum liq_event_severity
+    """
+    DEBUG = lib.LIQ_SEVERITY_DEBUG
+    INFO = lib.LIQ_SEVERITY_INFO
+    WARNING = lib.LIQ_SEVERITY_WARNING
+    ERROR = lib.LIQ_SEVERITY_ERROR
+
+
+class ProgressStage(enum.IntEnum):
+    """
+    The operation a Progress was last updated by
+    """
+    IDLE = lib._PY_LIQ_PROGRESS_IDLE
+    QUANTIZE = lib._PY_LIQ_PROGRESS_QUANTIZE
+    REMAP = lib._PY_LIQ_PROGRESS_REMAP
+
+
+class MemoryTracker:
+    _c = None
+
+    def __init__(self, limit: int = 0):
+        c = lib._py_liq_memory_tracker_create()
+        if c == ffi.NULL:
+            raise MemoryError
+        self._c = ffi.gc(c, lib._py_liq_memory_tracker_release)
+        self.limit = limit
+
+    @property
+    def limit(self):
+        return self._c.limit
+    @limit.setter
+    def limit(self, value: int):
+        if value < 0:
+            raise ValueError
+        lib._py_liq_memory_tracker_set_limit(self._c, value)
+
+    @property
+    def current_bytes(self):
+        return self._c.current_bytes
+
+    @property
+    def peak_bytes(self):
+        return self._c.peak_bytes
+
+    @property
+    def largest_allocation(self):
+        return self._c.largest_allocation
+
+    @property
+    def allocations(self):
+        return self._c.allocations
+
+    @property
+    def frees(self):
+        return self._c.frees
+
+    @property
+    def failed_allocations(self):
+        return self._c.failed_allocations
+
+    def reset(self):
+        lib._py_liq_memory_tracker_reset(self._c)
+
+
+class MemoryPool:
+    _c = None
+
+    def __init__(self, max_cached_bytes: int = 64 * 1024 * 1024):
+        c = lib._py_liq_memory_pool_create()
+        if c == ffi.NULL:
+            raise MemoryError
+        self._c = ffi.gc(c, lib._py_liq_memory_pool_release)
+        self.max_cached_bytes = max_cached_bytes
+
+    @property
+    def max_cached_bytes(self):
+        return self._c.max_cached_bytes
+    @max_cached_bytes.setter
+    def max_cached_bytes(self, value: int):
+        if value < 0:
+            raise ValueError
+        lib._py_liq_memory_pool_set_max_cached_bytes(self._c, value)
+
+    @property
+    def cached_bytes(self):
+        return self._c.cached_bytes
+
+    @property
+    def hits(self):
+        return self._c.hits
+
+    @property
+    def misses(self):
+        return self._c.misses
+
+    def reset(self):
+        lib._py_liq_memory_pool_reset(self._c)
+
+
+def _optional(value):
+    return None if value < 0 else value
+
+def _c_to_event(c, stages):
+    return Event(EventType(c.type), EventSeverity(c.severity), stages.get(c.stage),
+                 c.time, _optional(c.elapsed), _optional(c.mse),
+                 _optional(c.colors), _optional(c.iterations), _optional(c.ignorebits))
+
+
+class EventLog:
+    _c = None
+
+    def __init__(self, capacity: int = 4096, min_severity: EventSeverity = EventSeverity.DEBUG):
+        if capacity < 0:
+            raise ValueError
+        c = lib._py_liq_event_log_create(capacity)
+        if c == ffi.NULL:
+            raise MemoryError
+        self._c = ffi.gc(c, lib._py_liq_event_log_release)
+        self.min_severity = min_severity
+
+    @property
+    def capacity(self):
+        return self._c.capacity
+
+    @property
+    def min_severity(self):
+        return EventSeverity(self._c.min_severity)
+    @min_severity.setter
+    def min_severity(self, value: EventSeverity):
+        lib._py_liq_event_log_set_min_severity(self._c, EventSeverity(value))
+
+    @property
+    def pending(self):
+        return self._c.count
+
+    @property
+    def dropped(self):
+        return self._c.dropped
+
+    def drain(self) -> List[Event]:
+        # Copied out in C first, so threads appending events only wait for that
+        c_events = ffi.new('liq_event[]', max(1, self._c.capacity))
+        count = lib._py_liq_event_log_drain(self._c, c_events)
+        stages = {stage: name for name, stage in _RESULT_TIMINGS}
+        return [_c_to_event(c_events[i], stages) for i in range(count)]
+
+
+class Progress:
+    _c = None
+
+    def __init__(self):
+        c = lib._py_liq_progress_create()
+        if c == ffi.NULL:
+            raise MemoryError
+        self._c = ffi.gc(c, lib._py_liq_progress_release)
+
+    @property
+    def percent(self):
+        return lib._py_liq_progress_get_percent(self._c)
+
+    @property
+    def stage(self):
+        return ProgressStage(lib._py_liq_progress_get_stage(self._c))
+
+    @property
+    def aborted(self):
+        return bool(lib._py_liq_progress_get_abort(self._c))
+
+    def abort(self):
+        lib._py_liq_progress_abort(self._c)
+
+    def reset(self):
+        lib._py_liq_progress_set(self._c, 0, ProgressStage.IDLE, 0)
+
+
+@contextlib.contextmanager
+def _allocating(*objs):
+    """
+    Make allocations by libimagequant in this block use the
+    MemoryTracker and MemoryPool of the first of the given objects
+    that has either. An error raised in the block after one of them
+    failed (which libimagequant may report as something else) becomes
+    a MemoryError.
+    """
+    owner = next((o for o in objs if o._memory_tracker is not None or o._memory_pool is not None), None)
+    if owner is None:
+        yield
+        return
+
+    previous_tracker = lib._py_liq_set_current_memory_tracker(owner._memory_tracker._c if owner._memory_tracker is not None else ffi.NULL)
+    previous_pool = lib._py_liq_set_current_memory_pool(owner._memory_pool._c if owner._memory_pool is not None else ffi.NULL)
+    lib._py_liq_take_allocation_failed()
+    try:
+        yield
+    except MemoryError:
+        raise
+    except Exception as e:
+        if lib._py_liq_take_allocation_failed():
+            raise MemoryError from e
+        raise
+    finally:
+        lib._py_liq_set_current_memory_tracker(previous_tracker)
+        lib._py_liq_set_current_memory_pool(previous_pool)
+
+def _create(create, owner):
+    """
+    Call a liq_*_create*() function with allocations using the owner's
+    MemoryTracker and MemoryPool (if any), and raise MemoryError if it
+    returned NULL because a tracked allocation failed
+    """
+    with _allocating(owner):
+        c = create()
+        if c == ffi.NULL and lib._py_liq_take_allocation_failed():
+            raise MemoryError
+    return c
 
 def _color_to_c(color: Color):
     c = ffi.new('liq_color *')[0]
@@ -125,6 +438,57 @@ def _c_to_color(c):
     return Color(c.r, c.g, c.b, c.a)
 
 
+class _NativeHandle:
+    """
+    Descriptor for the _c attribute of a _NativeObject, which raises
+    ValueError once the object is closed instead of passing a freed
+    pointer to libimagequant
+    """
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        c = obj.__dict__.get('_c')
+        if c is None:
+            raise ValueError('operation on closed %s' % type(obj).__name__)
+        return c
+
+    def __set__(self, obj, value):
+        obj.__dict__['_c'] = value
+
+
+class _NativeObject(abc.ABC):
+    """
+    Base class for objects that own a libimagequant struct, freed by the
+    ffi.gc() destructor of _c. close() frees it right away instead.
+    """
+    _c = _NativeHandle()
+
+    @abc.abstractmethod
+    def _native_size(self) -> int:
+        """
+        The bytes of native memory that freeing _c releases
+        """
+
+    @property
+    def closed(self):
+        return self.__dict__.get('_c') is None
+
+    def close(self) -> int:
+        if self.closed:
+            return 0
+        released = self._native_size()
+        c = self._c
+        self._c = None
+        ffi.release(c)
+        return released
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 class HistogramEntry:
     _c = None
     color = None
@@ -150,19 +514,36 @@ class HistogramEntry:
         self._c.count = value
 
 
-class Attr:
-    _c = None
+class Attr(_NativeObject):
+    _memory_tracker = None
+    _memory_pool = None
+    _event_log = None
+    _progress = None
 
     _log_callback_function = None
     _log_callback_user_info = None
     _progress_callback_function = None
     _progress_callback_user_info = None
 
-    def __init__(self, *, _c=None):
+    def __init__(self, *, memory_tracker: MemoryTracker = None, memory_pool: MemoryPool = None, event_log: EventLog = None,
+                 progress: Progress = None, _c=None):
+        self._memory_tracker = memory_tracker
+        self._memory_pool = memory_pool
+        self._event_log = event_log
+        self._progress = progress
+
         if _c is None:
-            _c = ffi.gc(lib.liq_attr_create(), lib.liq_attr_destroy)
+            if memory_tracker is None and memory_pool is None:
+                _c = ffi.gc(lib.liq_attr_create(), lib.liq_attr_destroy)
+            else:
+                _c = ffi.gc(_create(lambda: lib.liq_attr_create_with_allocator(lib._py_liq_malloc, lib._py_liq_free), self),
+                            lib.liq_attr_destroy)
 
         self._c = _c
+        if event_log is not None:
+            lib.liq_set_event_callback(self._c, ffi.addressof(lib, '_py_liq_event_log_append'), event_log._c)
+        if progress is not None:
+            lib.liq_attr_set_progress_callback(self._c, ffi.addressof(lib, '_py_liq_progress_quantize'), progress._c)
 
     _handle = None
     def _get_self_handle(self):
@@ -170,9 +551,26 @@ class Attr:
             self._handle = ffi.new_handle(self)
         return self._handle
 
+    @property
+    def memory_tracker(self):
+        return self._memory_tracker
+
+    @property
+    def memory_pool(self):
+        return self._memory_pool
+
+    @property
+    def event_log(self):
+        return self._event_log
+
+    @property
+    def progress(self):
+        return self._progress
+
     def copy(self) -> 'Attr':
-        new = Attr()
-        new._c = ffi.gc(lib.liq_attr_copy(self._c), lib.liq_attr_destroy)
+        c = _create(lambda: lib.liq_attr_copy(self._c), self)
+        new = Attr(memory_tracker=self._memory_tracker, memory_pool=self._memory_pool, event_log=self._event_log,
+                   progress=self._progress, _c=ffi.gc(c, lib.liq_attr_destroy))
         new._log_callback_function = self._log_callback_function
         new._log_callback_user_info = self._log_callback_user_info
         new._progress_callback_function = self._progress_callback_function
@@ -193,6 +591,73 @@ class Attr:
     def speed(self, value: int):
         _check_ret(lib.liq_set_speed(self._c, value))
 
+    @property
+    def kmeans_iterations(self):
+        return lib.liq_get_kmeans_iterations(self._c)
+    @kmeans_iterations.setter
+    def kmeans_iterations(self, value: int):
+        _check_ret(lib.liq_set_kmeans_iterations(self._c, value))
+
+    @property
+    def kmeans_iteration_limit(self):
+        return lib.liq_get_kmeans_iteration_limit(self._c)
+    @kmeans_iteration_limit.setter
+    def kmeans_iteration_limit(self, value: float):
+        _check_ret(lib.liq_set_kmeans_iteration_limit(self._c, value))
+
+    @property
+    def feedback_loop_trials(self):
+        return lib.liq_get_feedback_loop_trials(self._c)
+    @feedback_loop_trials.setter
+    def feedback_loop_trials(self, value: int):
+        _check_ret(lib.liq_set_feedback_loop_trials(self._c, value))
+
+    @property
+    def dither_map(self):
+        return DitherMapMode(lib.liq_get_use_dither_map(self._c))
+    @dither_map.setter
+    def dither_map(self, value: DitherMapMode):
+        _check_ret(lib.liq_set_use_dither_map(self._c, value))
+
+    @property
+    def contrast_maps(self):
+        return bool(lib.liq_get_use_contrast_maps(self._c))
+    @contrast_maps.setter
+    def contrast_maps(self, value: bool):
+        lib.liq_set_use_contrast_maps(self._c, 1 if value else 0)
+
+    @property
+    def palette_engine(self):
+        return PaletteEngine(lib.liq_get_palette_engine(self._c))
+    @palette_engine.setter
+    def palette_engine(self, value: PaletteEngine):
+        _check_ret(lib.liq_set_palette_engine(self._c, value))
+
+    @property
+    def nearest_strategy(self):
+        return NearestStrategy(lib.liq_get_nearest_strategy(self._c))
+    @nearest_strategy.setter
+    def nearest_strategy(self, value: NearestStrategy):
+        _check_ret(lib.liq_set_nearest_strategy(self._c, value))
+
+    @property
+    def proxy_downscale(self):
+        return lib.liq_get_proxy_downscale(self._c)
+    @proxy_downscale.setter
+    def proxy_downscale(self, value: int):
+        _check_ret(lib.liq_set_proxy_downscale(self._c, value))
+
+    @property
+    def target_latency(self):
+        return lib.liq_get_target_latency(self._c)
+    @target_latency.setter
+    def target_latency(self, value: float):
+        _check_ret(lib.liq_set_target_latency(self._c, value))
+
+    def calibrate_latency(self):
+        with _allocating(self):
+            _check_ret(lib.liq_calibrate_latency(self._c))
+
     @property
     def min_opacity(self):
         return lib.liq_get_min_opacity(self._c)
@@ -225,6 +690,13 @@ class Attr:
         lib.liq_set_last_index_transparent(self._c, 1 if value else 0)
     last_index_transparent = property(None, last_index_transparent) # setter only
 
+    @property
+    def minimize_colors(self):
+        return bool(lib.liq_get_minimize_colors(self._c))
+    @minimize_colors.setter
+    def minimize_colors(self, value: bool):
+        lib.liq_set_minimize_colors(self._c, 1 if value else 0)
+
     def set_log_callback(self, log_callback_function: Callable[['Attr', str, object], None], user_info: object):
         self._log_callback_function = log_callback_function
         self._log_callback_user_info = user_info
@@ -237,6 +709,7 @@ class Attr:
     # liq_set_log_flush_callback is not supported (due to dtor-related issues in Python)
 
     def set_progress_callback(self, progress_callback_function: Callable[[float, object], bool], user_info: object):
+        self._progress = None
         self._progress_callback_function = progress_callback_function
         self._progress_callback_user_info = user_info
 
@@ -253,16 +726,45 @@ class Attr:
         # give it a fake one and then monkeypatch the true _c object
         # into the Image afterwards.
         img = Image(_c=object())
-        img._c = ffi.gc(lib.liq_image_create_rgba(self._c, ffi.from_buffer(bitmap), width, height, gamma), img._destroy)
+        c = _create(lambda: lib.liq_image_create_rgba(self._c, ffi.from_buffer(bitmap), width, height, gamma), self)
+        img._c = ffi.gc(c, img._destroy)
+        img._memory_tracker = self._memory_tracker
+        img._memory_pool = self._memory_pool
         img._bitmap = bitmap # to prevent it from being GC'd
         return img
 
+    def create_with_format(self, bitmap, pixel_format: PixelFormat, width: int, height: int, gamma: float, row_stride: int = 0, *, owner: object = None) -> 'Image':
+        pixel_format = PixelFormat(pixel_format)
+        c_bitmap = ffi.from_buffer(bitmap)
+        if width > 0 and height > 0:
+            row_size = width * _PIXEL_FORMAT_SIZES.get(pixel_format, 4)
+            if len(c_bitmap) < (row_stride or row_size) * (height - 1) + row_size:
+                raise BufferTooSmallError
+
+        # See create_rgba()
+        img = Image(_c=object())
+        c = _create(lambda: lib.liq_image_create_with_format(self._c, c_bitmap, pixel_format, width, height, row_stride, gamma), self)
+        img._c = ffi.gc(c, img._destroy)
+        img._memory_tracker = self._memory_tracker
+        img._memory_pool = self._memory_pool
+        img._bitmap = c_bitmap # read whenever libimagequant needs the pixels
+        img._owner = owner # whatever keeps the memory of bitmap valid
+        return img
+
     # liq_image_create_custom is not supported
 
+    def _native_size(self):
+        return lib.liq_attr_get_memory_size(self._c)
 
-class Image:
-    _c = None
+
+class Image(_NativeObject):
+    _memory_tracker = None
+    _memory_pool = None
     _is_background = False
+    _background = None
+    _bitmap = None
+    _owner = None
+    _importance_map = None
 
     def __init__(self, *, _c=None):
         if _c is None:
@@ -273,12 +775,26 @@ class Image:
     def background(self, background_image: 'Image'):
         _check_ret(lib.liq_image_set_background(self._c, background_image._c))
         background_image._is_background = True
+        self._background = background_image # freed along with this image
     background = property(None, background) # setter only
 
     def importance_map(self, buffer: bytes):
-        _check_ret(lib.liq_image_set_importance_map(self._c, ffi.from_buffer(buffer), len(buffer), lib.LIQ_COPY_PIXELS))
+        self.set_importance_map(buffer)
     importance_map = property(None, importance_map) # setter only
 
+    def set_importance_map(self, buffer, copy: bool = True):
+        c_buffer = ffi.from_buffer(buffer)
+        if copy:
+            with _allocating(self):
+                _check_ret(lib.liq_image_set_importance_map(self._c, c_buffer, len(c_buffer), lib.LIQ_COPY_PIXELS))
+            self._importance_map = None
+        else:
+            _check_ret(lib.liq_image_set_importance_map(self._c, c_buffer, len(c_buffer), 0))
+            # libimagequant reads it until the image is destroyed, and
+            # keeping the cdata (not just the object) also stops a
+            # bytearray from being resized meanwhile
+            self._importance_map = c_buffer
+
     def add_fixed_color(self, color: Color):
         _check_ret(lib.liq_image_add_fixed_color(self._c, _color_to_c(color)))
 
@@ -290,10 +806,49 @@ class Image:
     def height(self):
         return lib.liq_image_get_height(self._c)
 
+    @property
+    def cache_mode(self):
+        return CacheMode(lib.liq_image_get_cache_mode(self._c))
+    @cache_mode.setter
+    def cache_mode(self, value: CacheMode):
+        _check_ret(lib.liq_image_set_cache_mode(self._c, value))
+
+    @property
+    def cache_size(self):
+        return lib.liq_image_get_cache_size(self._c)
+
+    def release_cache(self) -> int:
+        return lib.liq_image_release_cache(self._c)
+
+    @property
+    def memory_mode(self):
+        return MemoryMode(lib.liq_image_get_memory_mode(self._c))
+    @memory_mode.setter
+    def memory_mode(self, value: MemoryMode):
+        _check_ret(lib.liq_image_set_memory_mode(self._c, value))
+
+    @property
+    def low_memory(self):
+        return bool(lib.liq_image_is_low_memory(self._c))
+
+    def estimated_quantize_bytes(self, options: Attr) -> int:
+        return lib.liq_image_estimate_quantize_memory(self._c, options._c)
+
+    def estimated_remap_bytes(self, result: 'Result') -> int:
+        return lib.liq_image_estimate_remap_memory(self._c, result._c)
+
     def quantize(self, options: Attr) -> 'Result':
         result_c = ffi.new('liq_result **')
-        _check_ret(lib.liq_image_quantize(self._c, options._c, result_c))
-        return Result(_c=ffi.gc(result_c[0], lib.liq_result_destroy))
+        with _allocating(options, self):
+            _check_ret(lib.liq_image_quantize(self._c, options._c, result_c))
+        result = Result(_c=ffi.gc(result_c[0], lib.liq_result_destroy))
+        result._memory_tracker = options._memory_tracker
+        result._memory_pool = options._memory_pool
+        result._event_log = options._event_log
+        if options._progress is not None:
+            result._progress = options._progress
+            lib.liq_result_set_progress_callback(result._c, ffi.addressof(lib, '_py_liq_progress_remap'), options._progress._c)
+        return result
 
     def _destroy(self, obj):
         """
@@ -307,9 +862,47 @@ class Image:
         if not self._is_background:
             lib.liq_image_destroy(obj)
 
-
-class Result:
-    _c = None
+    def _native_size(self):
+        # A background is freed by the image it belongs to
+        return 0 if self._is_background else lib.liq_image_get_memory_size(self._c)
+
+    def close(self) -> int:
+        released = super().close()
+        if self._background is not None:
+            # liq_image_destroy() has freed it too
+            self._background.close()
+            self._background = None
+        self._bitmap = None
+        self._owner = None
+        self._importance_map = None
+        return released
+
+
+_RESULT_TIMINGS = [
+    ('histogram', lib.LIQ_TIMING_HISTOGRAM),
+    ('contrast_maps', lib.LIQ_TIMING_CONTRAST_MAPS),
+    ('finalize_histogram', lib.LIQ_TIMING_FINALIZE_HISTOGRAM),
+    ('mediancut', lib.LIQ_TIMING_MEDIANCUT),
+    ('feedback_loop', lib.LIQ_TIMING_FEEDBACK_LOOP),
+    ('kmeans', lib.LIQ_TIMING_KMEANS),
+    ('remap', lib.LIQ_TIMING_REMAP),
+    ('dither_map', lib.LIQ_TIMING_DITHER_MAP),
+    ('dither', lib.LIQ_TIMING_DITHER),
+]
+
+_RESULT_COUNTERS = [
+    ('histogram_size', lib.LIQ_COUNTER_HISTOGRAM_SIZE),
+    ('ignorebits', lib.LIQ_COUNTER_IGNOREBITS),
+    ('feedback_trials', lib.LIQ_COUNTER_FEEDBACK_TRIALS),
+    ('kmeans_iterations', lib.LIQ_COUNTER_KMEANS_ITERATIONS),
+]
+
+
+class Result(_NativeObject):
+    _memory_tracker = None
+    _memory_pool = None
+    _event_log = None # kept alive while libimagequant can still write events to it
+    _progress = None
 
     _progress_callback_function = None
     _progress_callback_user_info = None
@@ -327,6 +920,7 @@ class Result:
         return self._handle
 
     def set_progress_callback(self, progress_callback_function: Callable[[float, object], bool], user_info: object):
+        self._progress = None
         self._progress_callback_function = progress_callback_function
         self._progress_callback_user_info = user_info
 
@@ -339,6 +933,34 @@ class Result:
         _check_ret(lib.liq_set_dithering_level(self._c, value))
     dithering_level = property(None, dithering_level) # setter only
 
+    @property
+    def fast_remapping(self):
+        return bool(lib.liq_get_fast_remapping(self._c))
+    @fast_remapping.setter
+    def fast_remapping(self, value: bool):
+        _check_ret(lib.liq_set_fast_remapping(self._c, 1 if value else 0))
+
+    @property
+    def dithering_algorithm(self):
+        return DitheringAlgorithm(lib.liq_get_dithering_algorithm(self._c))
+    @dithering_algorithm.setter
+    def dithering_algorithm(self, value: DitheringAlgorithm):
+        _check_ret(lib.liq_set_dithering_algorithm(self._c, value))
+
+    @property
+    def parallel_dithering(self):
+        return bool(lib.liq_get_parallel_dithering(self._c))
+    @parallel_dithering.setter
+    def parallel_dithering(self, value: bool):
+        _check_ret(lib.liq_set_parallel_dithering(self._c, 1 if value else 0))
+
+    @property
+    def deterministic_dithering(self):
+        return bool(lib.liq_get_deterministic_dithering(self._c))
+    @deterministic_dithering.setter
+    def deterministic_dithering(self, value: bool):
+        _check_ret(lib.liq_set_deterministic_dithering(self._c, 1 if value else 0))
+
     @property
     def output_gamma(self):
         return lib.liq_get_output_gamma(self._c)
@@ -362,32 +984,75 @@ class Result:
     def remapping_quality(self):
         return lib.liq_get_remapping_quality(self._c)
 
+    @property
+    def timings(self):
+        timings = {}
+        for name, stage in _RESULT_TIMINGS:
+            seconds = lib.liq_get_timing(self._c, stage)
+            if seconds >= 0:
+                timings[name] = seconds
+        return timings
+
+    @property
+    def counters(self):
+        return {name: lib.liq_get_counter(self._c, counter) for name, counter in _RESULT_COUNTERS}
+
     def get_palette(self) -> List[Color]:
         palette_raw = lib.liq_get_palette(self._c)
         return [_c_to_color(palette_raw.entries[i]) for i in range(palette_raw.count)]
 
     def remap_image(self, input_image: Image) -> bytes:
-        buffer = ffi.new('unsigned char[%d]' % (input_image.width * input_image.height))
-        _check_ret(lib.liq_write_remapped_image(self._c, input_image._c, buffer, len(buffer)))
+        buffer = bytearray(input_image.width * input_image.height)
+        self.remap_image_into(input_image, buffer)
         return bytes(buffer)
 
+    def remap_image_into(self, input_image: Image, buffer) -> None:
+        c_buffer = ffi.from_buffer(buffer, require_writable=True)
+        with _allocating(self, input_image):
+            _check_ret(lib.liq_write_remapped_image(self._c, input_image._c, c_buffer, len(c_buffer)))
 
-class Histogram:
-    _c = None
+    def remap_image_band(self, input_image: Image, first_row: int, rows: int) -> bytes:
+        buffer = ffi.new('unsigned char[%d]' % (input_image.width * max(rows, 0)))
+        with _allocating(self, input_image):
+            _check_ret(lib.liq_write_remapped_image_band(self._c, input_image._c, first_row, rows, buffer, len(buffer)))
+        return bytes(buffer)
+
+    def _native_size(self):
+        return lib.liq_result_get_memory_size(self._c)
+
+
+class Histogram(_NativeObject):
+    _memory_tracker = None
+    _memory_pool = None
 
     def __init__(self, attr: Attr):
-        self._c = ffi.gc(lib.liq_histogram_create(attr._c), lib.liq_histogram_destroy)
+        self._memory_tracker = attr._memory_tracker
+        self._memory_pool = attr._memory_pool
+        self._c = ffi.gc(_create(lambda: lib.liq_histogram_create(attr._c), attr), lib.liq_histogram_destroy)
 
     def add_image(self, attr: Attr, image: Image):
-        _check_ret(lib.liq_histogram_add_image(self._c, attr._c, image._c))
+        with _allocating(self, attr, image):
+            _check_ret(lib.liq_histogram_add_image(self._c, attr._c, image._c))
 
     def add_colors(self, attr: Attr, entries: List[HistogramEntry], gamma: float):
-        _check_ret(lib.liq_histogram_add_colors(self._c, attr._c, [e._c for e in entries], len(entries), gamma))
+        with _allocating(self, attr):
+            _check_ret(lib.liq_histogram_add_colors(self._c, attr._c, [e._c for e in entries], len(entries), gamma))
 
     def add_fixed_color(self, color: Color, gamma: float):
         _check_ret(lib.liq_histogram_add_fixed_color(self._c, _color_to_c(color), gamma))
         
     def quantize(self, options: Attr) -> Result:
         result_c = ffi.new('liq_result **')
-        _check_ret(lib.liq_histogram_quantize(self._c, options._c, result_c))
-        return Result(_c=ffi.gc(result_c[0], lib.liq_result_destroy))
+        with _allocating(options, self):
+            _check_ret(lib.liq_histogram_quantize(self._c, options._c, result_c))
+        result = Result(_c=ffi.gc(result_c[0], lib.liq_result_destroy))
+        result._memory_tracker = options._memory_tracker
+        result._memory_pool = options._memory_pool
+        result._event_log = options._event_log
+        if options._progress is not None:
+            result._progress = options._progress
+            lib.liq_result_set_progress_callback(result._c, ffi.addressof(lib, '_py_liq_progress_remap'), options._progress._c)
+        return result
+
+    def _native_size(self):
+        return lib.liq_histogram_get_memory_size(self._c)
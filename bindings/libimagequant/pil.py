@@ -0,0 +1,114 @@
+import ctypes
+
+import PIL.Image
+
+from . import Attr, Image, PixelFormat, Result
+
+
+# How Pillow stores these modes in memory: RGB is padded to 4 bytes per
+# pixel, and LA is stored as L, L, L, A
+_MEMORY_FORMATS = {
+    'RGBA': PixelFormat.RGBA,
+    'RGBX': PixelFormat.RGBX,
+    'RGB': PixelFormat.RGBX,
+    'RGBa': PixelFormat.RGBA_PREMULTIPLIED,
+    'LA': PixelFormat.RGBA,
+    'L': PixelFormat.GRAY,
+}
+
+# The formats of tobytes() for them
+_TOBYTES_FORMATS = {
+    'RGBA': PixelFormat.RGBA,
+    'RGBX': PixelFormat.RGBX,
+    'RGB': PixelFormat.RGB,
+    'RGBa': PixelFormat.RGBA_PREMULTIPLIED,
+    'L': PixelFormat.GRAY,
+}
+
+
+class _ArrowArray(ctypes.Structure):
+    """
+    struct ArrowArray of the Arrow C data interface
+    """
+_ArrowArray._fields_ = [
+    ('length', ctypes.c_int64),
+    ('null_count', ctypes.c_int64),
+    ('offset', ctypes.c_int64),
+    ('n_buffers', ctypes.c_int64),
+    ('n_children', ctypes.c_int64),
+    ('buffers', ctypes.POINTER(ctypes.c_void_p)),
+    ('children', ctypes.POINTER(ctypes.POINTER(_ArrowArray))),
+    ('dictionary', ctypes.POINTER(_ArrowArray)),
+    ('release', ctypes.c_void_p),
+    ('private_data', ctypes.c_void_p),
+]
+
+# Not available on PyPy, which then always copies the pixels
+try:
+    _PyCapsule_GetPointer = ctypes.pythonapi.PyCapsule_GetPointer
+except AttributeError:
+    _PyCapsule_GetPointer = None
+else:
+    _PyCapsule_GetPointer.restype = ctypes.c_void_p
+    _PyCapsule_GetPointer.argtypes = [ctypes.py_object, ctypes.c_char_p]
+
+
+def _export_pixels(pil_image: PIL.Image.Image):
+    """
+    Return a buffer over the pixel memory of the image (in
+    _MEMORY_FORMATS[mode]) and the Arrow capsules that keep it alive, or
+    None if it can't be exported: Pillow before 11.2 can't, neither can any
+    version if the image spans several of its memory blocks, and PyPy can't
+    read the export.
+    """
+    if _PyCapsule_GetPointer is None:
+        return None
+    try:
+        schema, array = pil_image.__arrow_c_array__()
+    except (AttributeError, ValueError):
+        return None
+
+    # Pillow exports 1-byte modes as an array of bytes, and 4-byte ones as
+    # an array of 4-byte lists, whose bytes are in the child array
+    exported = _ArrowArray.from_address(_PyCapsule_GetPointer(array, b'arrow_array'))
+    if exported.n_children:
+        exported = exported.children[0].contents
+    pixels = (ctypes.c_ubyte * exported.length).from_address(exported.buffers[1] + exported.offset)
+    return pixels, (schema, array)
+
+
+def create_image(attr: Attr, pil_image: PIL.Image.Image, gamma: float = 0) -> Image:
+    if pil_image.mode not in _MEMORY_FORMATS:
+        pil_image = pil_image.convert('RGBA')
+
+    exported = _export_pixels(pil_image)
+    if exported is not None:
+        pixels, capsules = exported
+        # The capsules keep Pillow's memory alive
+        return attr.create_with_format(pixels, _MEMORY_FORMATS[pil_image.mode], pil_image.width, pil_image.height, gamma, owner=capsules)
+
+    if pil_image.mode not in _TOBYTES_FORMATS:
+        pil_image = pil_image.convert('RGBA')
+    return attr.create_with_format(pil_image.tobytes(), _TOBYTES_FORMATS[pil_image.mode], pil_image.width, pil_image.height, gamma)
+
+
+def remap_image(result: Result, input_image: Image) -> PIL.Image.Image:
+    size = (input_image.width, input_image.height)
+    pixels = bytearray(size[0] * size[1])
+    result.remap_image_into(input_image, pixels)
+
+    # Pillow uses the bytearray as the image's memory instead of copying it
+    pil_image = PIL.Image.frombuffer('P', size, pixels, 'raw', 'P', 0, 1)
+
+    # The palette is final only after remapping
+    pil_image.putpalette(bytes(value for color in result.get_palette() for value in color), 'RGBA')
+    return pil_image
+
+
+def quantize(pil_image: PIL.Image.Image, attr: Attr = None, dithering_level: float = 1.0) -> PIL.Image.Image:
+    if attr is None:
+        attr = Attr()
+    with create_image(attr, pil_image) as image:
+        result = image.quantize(attr)
+        result.dithering_level = dithering_level
+        return remap_image(result, image)
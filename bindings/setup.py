@@ -24,14 +24,17 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     python_requires='>=3.6',
     setup_requires=[
-        'cffi>=1.0.0'
+        'cffi>=1.12.0'
     ],
     cffi_modules=[
         'build_cffi.py:ffibuilder',
     ],
     install_requires=[
-        'cffi>=1.0.0',
+        'cffi>=1.12.0',
     ],
+    extras_require={
+        'pil': ['Pillow'],
+    },
     classifiers=[
         'Programming Language :: C',
         'Programming Language :: Python :: 3.6',
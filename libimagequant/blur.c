@@ -21,6 +21,9 @@ along with libimagequant. If not, see <http://www.gnu.org/licenses/>.
 #include "pam.h"
 #include "blur.h"
 
+/* filters are split across threads by rows, but only for images large enough to be worth starting threads */
+#define LIQ_BLUR_PARALLEL_MIN_PIXELS (1<<16)
+
 /*
  Blurs image horizontally (width 2*size+1) and writes it transposed to dst (called twice gives 2d blur)
  */
@@ -28,7 +31,9 @@ static void transposing_1d_blur(unsigned char *restrict src, unsigned char *rest
 {
     assert(size > 0);
 
-    for(unsigned int j=0; j < height; j++) {
+    // every row of src becomes a column of dst, so rows are independent
+    #pragma omp parallel for if (width*height > LIQ_BLUR_PARALLEL_MIN_PIXELS) schedule(static)
+    for(int j=0; j < (int)height; j++) {
         unsigned char *restrict row = src + j*width;
 
         // accumulate sum for pixels outside line
@@ -68,10 +73,12 @@ static void transposing_1d_blur(unsigned char *restrict src, unsigned char *rest
  */
 LIQ_PRIVATE void liq_max3(unsigned char *src, unsigned char *dst, unsigned int width, unsigned int height)
 {
-    for(unsigned int j=0; j < height; j++) {
+    #pragma omp parallel for if (width*height > LIQ_BLUR_PARALLEL_MIN_PIXELS) schedule(static)
+    for(int j=0; j < (int)height; j++) {
         const unsigned char *row = src + j*width,
         *prevrow = src + (j > 1 ? j-1 : 0)*width,
         *nextrow = src + MIN(height-1,j+1)*width;
+        unsigned char *restrict out = dst + j*width;
 
         unsigned char prev,curr=row[0],next=row[0];
 
@@ -82,11 +89,11 @@ LIQ_PRIVATE void liq_max3(unsigned char *src, unsigned char *dst, unsigned int w
 
             unsigned char t1 = MAX(prev,next);
             unsigned char t2 = MAX(nextrow[i],prevrow[i]);
-            *dst++ = MAX(curr,MAX(t1,t2));
+            *out++ = MAX(curr,MAX(t1,t2));
         }
         unsigned char t1 = MAX(curr,next);
         unsigned char t2 = MAX(nextrow[width-1],prevrow[width-1]);
-        *dst++ = MAX(t1,t2);
+        *out++ = MAX(t1,t2);
     }
 }
 
@@ -95,10 +102,12 @@ LIQ_PRIVATE void liq_max3(unsigned char *src, unsigned char *dst, unsigned int w
  */
 LIQ_PRIVATE void liq_min3(unsigned char *src, unsigned char *dst, unsigned int width, unsigned int height)
 {
-    for(unsigned int j=0; j < height; j++) {
+    #pragma omp parallel for if (width*height > LIQ_BLUR_PARALLEL_MIN_PIXELS) schedule(static)
+    for(int j=0; j < (int)height; j++) {
         const unsigned char *row = src + j*width,
         *prevrow = src + (j > 1 ? j-1 : 0)*width,
         *nextrow = src + MIN(height-1,j+1)*width;
+        unsigned char *restrict out = dst + j*width;
 
         unsigned char prev,curr=row[0],next=row[0];
 
@@ -109,11 +118,11 @@ LIQ_PRIVATE void liq_min3(unsigned char *src, unsigned char *dst, unsigned int w
 
             unsigned char t1 = MIN(prev,next);
             unsigned char t2 = MIN(nextrow[i],prevrow[i]);
-            *dst++ = MIN(curr,MIN(t1,t2));
+            *out++ = MIN(curr,MIN(t1,t2));
         }
         unsigned char t1 = MIN(curr,next);
         unsigned char t2 = MIN(nextrow[width-1],prevrow[width-1]);
-        *dst++ = MIN(t1,t2);
+        *out++ = MIN(t1,t2);
     }
 }
 
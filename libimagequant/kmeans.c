@@ -72,12 +72,15 @@ LIQ_PRIVATE void kmeans_finalize(colormap *map, const unsigned int max_threads,
     }
 }
 
-LIQ_PRIVATE double kmeans_do_iteration(histogram *hist, colormap *const map, kmeans_callback callback)
+LIQ_PRIVATE double kmeans_do_iteration(histogram *hist, colormap *const map, const enum liq_nearest_strategy nearest_strategy, kmeans_callback callback)
 {
     const unsigned int max_threads = omp_get_max_threads();
     LIQ_ARRAY(kmeans_state, average_color, (KMEANS_CACHE_LINE_GAP+map->colors) * max_threads);
     kmeans_init(map, max_threads, average_color);
-    struct nearest_map *const n = nearest_init(map);
+    struct nearest_map *const n = nearest_init(map, nearest_strategy);
+    if (!n) {
+        return -1;
+    }
     hist_item *const achv = hist->achv;
     const int hist_size = hist->size;
 
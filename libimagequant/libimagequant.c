@@ -6,6 +6,10 @@
 ** See COPYRIGHT file for license.
 */
 
+#if !defined(_WIN32) && !defined(__APPLE__) && !defined(_POSIX_C_SOURCE)
+#define _POSIX_C_SOURCE 199309L /* clock_gettime() in -std=c99 builds */
+#endif
+
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
@@ -13,12 +17,20 @@
 #include <stdbool.h>
 #include <stdint.h>
 #include <limits.h>
+#include <time.h>
 
 #if !(defined(__STDC_VERSION__) && __STDC_VERSION__ >= 199900L) && !(defined(_MSC_VER) && _MSC_VER >= 1800)
 #error "This program requires C99, e.g. -std=c99 switch in GCC or it requires MSVC 18.0 or higher."
 #error "Ignore torrent of syntax errors that may follow. It's only because compiler is set to use too old C version."
 #endif
 
+#define LIQ_DITHER_STRIPE_HEIGHT 128 /* rows dithered by one thread in parallel dithering */
+#define LIQ_DITHER_STRIPE_OVERLAP 16 /* rows of the previous stripe dithered again to warm up the error rows */
+#define LIQ_CONTRAST_MAPS_MIN_BAND_ROWS 64 /* smallest band of rows that contrast_maps() gives a thread */
+#define LIQ_REMAP_BAND_MAP_MARGIN 16 /* rows around a remapped band that its contrast maps and dither map depend on */
+#define LIQ_REMAP_BAND_ALIGNMENT 32 /* remapped bands are processed from a multiple of this row, to line up threshold maps */
+#define LIQ_PROXY_MAX_DOWNSCALE 16 /* keeps sums of a block of the proxy image within 32 bits */
+
 #ifdef _OPENMP
 #include <omp.h>
 #define LIQ_TEMP_ROW_WIDTH(img_width) (((img_width) | 15) + 1) /* keep alignment & leave space between rows to avoid cache line contention */
@@ -31,7 +43,9 @@
 #include "libimagequant.h"
 
 #include "pam.h"
+#include "mempool.h"
 #include "mediancut.h"
+#include "wu.h"
 #include "nearest.h"
 #include "blur.h"
 #include "kmeans.h"
@@ -48,6 +62,14 @@ static const char liq_freed_magic[] = "free";
 #define CHECK_STRUCT_TYPE(attr, kind) liq_crash_if_invalid_handle_pointer_given((const liq_attr*)attr, kind ## _magic)
 #define CHECK_USER_POINTER(ptr) liq_crash_if_invalid_pointer_given(ptr)
 
+/**
+ Per-machine costs used to pick search budgets for a target latency. liq_calibrate_latency() measures them.
+ */
+typedef struct liq_cost_model {
+    double histogram_ms_per_pixel, contrast_maps_ms_per_pixel;
+    double mediancut_ms_per_color, kmeans_ms_per_color; // per histogram entry
+} liq_cost_model;
+
 struct liq_attr {
     const char *magic_header;
     void* (*malloc)(size_t);
@@ -57,9 +79,12 @@ struct liq_attr {
     unsigned int max_colors, max_histogram_entries;
     unsigned int min_posterization_output /* user setting */, min_posterization_input /* speed setting */;
     unsigned int kmeans_iterations, feedback_loop_trials;
-    bool last_index_transparent, use_contrast_maps;
+    bool last_index_transparent, use_contrast_maps, minimize_colors;
     unsigned char use_dither_map;
     unsigned char speed;
+    unsigned char palette_engine, nearest_strategy, proxy_downscale;
+    double target_latency_ms;
+    liq_cost_model cost_model;
 
     unsigned char progress_stage1, progress_stage2, progress_stage3;
     liq_progress_callback_function *progress_callback;
@@ -69,6 +94,9 @@ struct liq_attr {
     void *log_callback_user_info;
     liq_log_flush_callback_function *log_flush_callback;
     void *log_flush_callback_user_info;
+
+    liq_event_callback_function *event_callback;
+    void *event_callback_user_info;
 };
 
 struct liq_image {
@@ -85,12 +113,21 @@ struct liq_image {
     f_pixel *temp_f_row;
     liq_image_get_rgba_row_callback *row_callback;
     void *row_callback_user_info;
+    const unsigned char *format_pixels; // converted by liq_image_format_row_callback()
+    size_t format_row_stride;
     liq_image *background;
     f_pixel fixed_colors[256];
     unsigned short fixed_colors_count;
-    bool free_pixels, free_rows, free_rows_internal;
+    bool free_pixels, free_rows, free_rows_internal, user_importance_map, borrowed_importance_map;
+    unsigned char cache_mode, memory_mode, format;
 };
 
+/* Time spent in each stage of quantization and the work done there, for liq_get_timing() and liq_get_counter() */
+typedef struct {
+    double histogram_ms, contrast_maps_ms, finalize_histogram_ms, mediancut_ms, feedback_loop_ms, kmeans_ms;
+    unsigned int histogram_size, ignorebits, feedback_trials, kmeans_iterations;
+} liq_quantization_stats;
+
 typedef struct liq_remapping_result {
     const char *magic_header;
     void* (*malloc)(size_t);
@@ -100,12 +137,18 @@ typedef struct liq_remapping_result {
     colormap *palette;
     liq_progress_callback_function *progress_callback;
     void *progress_callback_user_info;
+    liq_event_callback_function *event_callback;
+    void *event_callback_user_info;
 
     liq_palette int_palette;
     double gamma, palette_error;
     float dither_level;
     unsigned char use_dither_map;
     unsigned char progress_stage1;
+    bool parallel_dithering, deterministic_dithering;
+    unsigned char dithering_algorithm, nearest_strategy;
+    bool fast_remapping;
+    double remap_ms, dither_map_ms, dither_ms;
 } liq_remapping_result;
 
 struct liq_result {
@@ -117,12 +160,18 @@ struct liq_result {
     colormap *palette;
     liq_progress_callback_function *progress_callback;
     void *progress_callback_user_info;
+    liq_event_callback_function *event_callback;
+    void *event_callback_user_info;
 
     liq_palette int_palette;
     float dither_level;
     double gamma, palette_error;
     int min_posterization_output;
     unsigned char use_dither_map;
+    bool parallel_dithering, deterministic_dithering;
+    unsigned char dithering_algorithm, nearest_strategy;
+    bool fast_remapping;
+    liq_quantization_stats stats;
 };
 
 struct liq_histogram {
@@ -136,16 +185,19 @@ struct liq_histogram {
     unsigned short fixed_colors_count;
     unsigned short ignorebits;
     bool had_image_added;
+    double histogram_ms, contrast_maps_ms;
 };
 
 static void contrast_maps(liq_image *image) LIQ_NONNULL;
 static liq_error finalize_histogram(liq_histogram *input_hist, liq_attr *options, histogram **hist_output) LIQ_NONNULL;
+static liq_error histogram_add_image_colors(liq_histogram *input_hist, const liq_attr *options, liq_image *input_image) LIQ_NONNULL;
 static const rgba_pixel *liq_image_get_row_rgba(liq_image *input_image, unsigned int row) LIQ_NONNULL;
 static bool liq_image_get_row_f_init(liq_image *img) LIQ_NONNULL;
 static const f_pixel *liq_image_get_row_f(liq_image *input_image, unsigned int row) LIQ_NONNULL;
 static void liq_remapping_result_destroy(liq_remapping_result *result) LIQ_NONNULL;
-static liq_error pngquant_quantize(histogram *hist, const liq_attr *options, const int fixed_colors_count, const f_pixel fixed_colors[], const double gamma, bool fixed_result_colors, liq_result **) LIQ_NONNULL;
-static liq_error liq_histogram_quantize_internal(liq_histogram *input_hist, liq_attr *attr, bool fixed_result_colors, liq_result **result_output) LIQ_NONNULL;
+static liq_error pngquant_quantize(histogram *hist, const liq_attr *options, const int fixed_colors_count, const f_pixel fixed_colors[], const double gamma, bool fixed_result_colors, liq_quantization_stats *stats, liq_result **) LIQ_NONNULL;
+static liq_error pngquant_quantize_min_colors(histogram *hist, const liq_attr *options, const int fixed_colors_count, const f_pixel fixed_colors[], const double gamma, bool fixed_result_colors, liq_quantization_stats *stats, liq_result **) LIQ_NONNULL;
+static liq_error liq_histogram_quantize_internal(liq_histogram *input_hist, liq_attr *attr, bool fixed_result_colors, double start_ms, liq_result **result_output) LIQ_NONNULL;
 
 LIQ_NONNULL static void liq_verbose_printf(const liq_attr *context, const char *fmt, ...)
 {
@@ -188,6 +240,20 @@ LIQ_NONNULL static bool liq_remap_progress(const liq_remapping_result *quant, co
     return quant->progress_callback && !quant->progress_callback(percent, quant->progress_callback_user_info);
 }
 
+/**
+ Monotonic time in milliseconds, for latency targets
+ */
+static double liq_time_ms(void)
+{
+    struct timespec now;
+#if defined(_WIN32)
+    timespec_get(&now, TIME_UTC);
+#else
+    clock_gettime(CLOCK_MONOTONIC, &now);
+#endif
+    return now.tv_sec * 1000.0 + now.tv_nsec / 1000000.0;
+}
+
 #if USE_SSE
 inline static bool is_sse_available()
 {
@@ -237,10 +303,41 @@ LIQ_EXPORT bool liq_crash_if_invalid_pointer_given(const void *pointer)
     return test_access || true;
 }
 
+/**
+ Event with the fields that don't apply to its type set to -1
+ */
+static liq_event liq_event_init(enum liq_event_type type, enum liq_event_severity severity, int stage)
+{
+    return (liq_event){
+        .type = type,
+        .severity = severity,
+        .stage = stage,
+        .elapsed = -1,
+        .mse = -1,
+        .colors = -1,
+        .iterations = -1,
+        .ignorebits = -1,
+    };
+}
+
+static void liq_emit_event(liq_event_callback_function *callback, void *user_info, liq_event event)
+{
+    if (callback) {
+        event.time = liq_time_ms() / 1000.0;
+        callback(&event, user_info);
+    }
+}
+
+LIQ_NONNULL static void liq_attr_event(const liq_attr *attr, liq_event event)
+{
+    liq_emit_event(attr->event_callback, attr->event_callback_user_info, event);
+}
+
 LIQ_NONNULL static void liq_log_error(const liq_attr *attr, const char *msg)
 {
     if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return;
     liq_verbose_printf(attr, "  error: %s", msg);
+    liq_attr_event(attr, liq_event_init(LIQ_EVENT_ERROR, LIQ_SEVERITY_ERROR, -1));
 }
 
 static double quality_to_mse(long quality)
@@ -329,32 +426,81 @@ LIQ_EXPORT LIQ_NONNULL int liq_get_min_posterization(const liq_attr *attr)
     return attr->min_posterization_output;
 }
 
-LIQ_EXPORT LIQ_NONNULL liq_error liq_set_speed(liq_attr* attr, int speed)
+LIQ_EXPORT LIQ_NONNULL void liq_set_minimize_colors(liq_attr* attr, int enabled)
 {
-    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return LIQ_INVALID_POINTER;
-    if (speed < 1 || speed > 10) return LIQ_VALUE_OUT_OF_RANGE;
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return;
 
-    unsigned int iterations = MAX(8-speed, 0);
-    iterations += iterations * iterations/2;
-    attr->kmeans_iterations = iterations;
-    attr->kmeans_iteration_limit = 1.0/(double)(1<<(23-speed));
-    attr->feedback_loop_trials = MAX(56-9*speed, 0);
+    attr->minimize_colors = !!enabled;
+}
 
-    attr->max_histogram_entries = (1<<17) + (1<<18)*(10-speed);
-    attr->min_posterization_input = (speed >= 8) ? 1 : 0;
-    attr->use_dither_map = (speed <= (omp_get_max_threads() > 1 ? 7 : 5)); // parallelized dither map might speed up floyd remapping
-    if (attr->use_dither_map && speed < 3) {
-        attr->use_dither_map = 2; // always
-    }
-    attr->use_contrast_maps = (speed <= 7) || attr->use_dither_map;
-    attr->speed = speed;
+LIQ_EXPORT LIQ_NONNULL int liq_get_minimize_colors(const liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return -1;
+
+    return attr->minimize_colors;
+}
+
+/**
+ Search budgets that liq_set_speed() maps onto, indexed by speed-1. Each of them can be overridden afterwards.
+ */
+static const struct liq_speed_preset {
+    unsigned int kmeans_iterations, feedback_loop_trials, max_histogram_entries;
+    double kmeans_iteration_limit;
+    unsigned char min_posterization_input, use_dither_map;
+    bool use_contrast_maps;
+} liq_speed_presets[10] = {
+    {31, 47, (1<<17) + (1<<18)*9, 1.0/(1<<22), 0, LIQ_DITHER_MAP_ALWAYS, true},
+    {24, 38, (1<<17) + (1<<18)*8, 1.0/(1<<21), 0, LIQ_DITHER_MAP_ALWAYS, true},
+    {17, 29, (1<<17) + (1<<18)*7, 1.0/(1<<20), 0, LIQ_DITHER_MAP_AUTO, true},
+    {12, 20, (1<<17) + (1<<18)*6, 1.0/(1<<19), 0, LIQ_DITHER_MAP_AUTO, true},
+    { 7, 11, (1<<17) + (1<<18)*5, 1.0/(1<<18), 0, LIQ_DITHER_MAP_AUTO, true},
+    { 4,  2, (1<<17) + (1<<18)*4, 1.0/(1<<17), 0, LIQ_DITHER_MAP_AUTO, true}, // dither map only when multi-threaded
+    { 1,  0, (1<<17) + (1<<18)*3, 1.0/(1<<16), 0, LIQ_DITHER_MAP_AUTO, true}, // dither map only when multi-threaded
+    { 0,  0, (1<<17) + (1<<18)*2, 1.0/(1<<15), 1, LIQ_DITHER_MAP_OFF, false},
+    { 0,  0, (1<<17) + (1<<18)*1, 1.0/(1<<14), 1, LIQ_DITHER_MAP_OFF, false},
+    { 0,  0, (1<<17),             1.0/(1<<13), 1, LIQ_DITHER_MAP_OFF, false},
+};
+
+/**
+ Costs measured on a typical x86-64 core, used until liq_calibrate_latency() is called
+ */
+static const liq_cost_model liq_default_cost_model = {
+    .histogram_ms_per_pixel = 0.000028,
+    .contrast_maps_ms_per_pixel = 0.000028,
+    .mediancut_ms_per_color = 0.00032,
+    .kmeans_ms_per_color = 0.000075,
+};
 
+LIQ_NONNULL static void liq_attr_update_progress_stages(liq_attr *attr)
+{
     attr->progress_stage1 = attr->use_contrast_maps ? 20 : 8;
     if (attr->feedback_loop_trials < 2) {
         attr->progress_stage1 += 30;
     }
-    attr->progress_stage3 = 50 / (1+speed);
+    attr->progress_stage3 = 50 / (1+attr->speed);
     attr->progress_stage2 = 100 - attr->progress_stage1 - attr->progress_stage3;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_speed(liq_attr* attr, int speed)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return LIQ_INVALID_POINTER;
+    if (speed < 1 || speed > 10) return LIQ_VALUE_OUT_OF_RANGE;
+
+    const struct liq_speed_preset *const preset = &liq_speed_presets[speed-1];
+    attr->kmeans_iterations = preset->kmeans_iterations;
+    attr->kmeans_iteration_limit = preset->kmeans_iteration_limit;
+    attr->feedback_loop_trials = preset->feedback_loop_trials;
+
+    attr->max_histogram_entries = preset->max_histogram_entries;
+    attr->min_posterization_input = preset->min_posterization_input;
+    attr->use_dither_map = preset->use_dither_map;
+    if (speed > 5 && omp_get_max_threads() <= 1) {
+        attr->use_dither_map = LIQ_DITHER_MAP_OFF; // parallelized dither map might speed up floyd remapping
+    }
+    attr->use_contrast_maps = preset->use_contrast_maps;
+    attr->speed = speed;
+
+    liq_attr_update_progress_stages(attr);
     return LIQ_OK;
 }
 
@@ -365,6 +511,150 @@ LIQ_EXPORT LIQ_NONNULL int liq_get_speed(const liq_attr *attr)
     return attr->speed;
 }
 
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_kmeans_iterations(liq_attr* attr, int iterations)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return LIQ_INVALID_POINTER;
+    if (iterations < 0) return LIQ_VALUE_OUT_OF_RANGE;
+
+    attr->kmeans_iterations = iterations;
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_get_kmeans_iterations(const liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return -1;
+
+    return attr->kmeans_iterations;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_kmeans_iteration_limit(liq_attr* attr, double limit)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return LIQ_INVALID_POINTER;
+    if (!(limit >= 0)) return LIQ_VALUE_OUT_OF_RANGE;
+
+    attr->kmeans_iteration_limit = limit;
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL double liq_get_kmeans_iteration_limit(const liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return -1;
+
+    return attr->kmeans_iteration_limit;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_feedback_loop_trials(liq_attr* attr, int trials)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return LIQ_INVALID_POINTER;
+    if (trials < 0) return LIQ_VALUE_OUT_OF_RANGE;
+
+    attr->feedback_loop_trials = trials;
+    liq_attr_update_progress_stages(attr);
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_get_feedback_loop_trials(const liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return -1;
+
+    return attr->feedback_loop_trials;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_use_dither_map(liq_attr* attr, enum liq_dither_map_mode mode)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return LIQ_INVALID_POINTER;
+    if (mode < LIQ_DITHER_MAP_OFF || mode > LIQ_DITHER_MAP_ALWAYS) return LIQ_VALUE_OUT_OF_RANGE;
+
+    attr->use_dither_map = mode;
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_get_use_dither_map(const liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return -1;
+
+    return attr->use_dither_map;
+}
+
+LIQ_EXPORT LIQ_NONNULL void liq_set_use_contrast_maps(liq_attr* attr, int enabled)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return;
+
+    attr->use_contrast_maps = !!enabled;
+    liq_attr_update_progress_stages(attr);
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_get_use_contrast_maps(const liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return -1;
+
+    return attr->use_contrast_maps;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_palette_engine(liq_attr* attr, enum liq_palette_engine engine)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return LIQ_INVALID_POINTER;
+    if (engine != LIQ_PALETTE_MEDIANCUT && engine != LIQ_PALETTE_WU) return LIQ_VALUE_OUT_OF_RANGE;
+
+    attr->palette_engine = engine;
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_get_palette_engine(const liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return -1;
+
+    return attr->palette_engine;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_nearest_strategy(liq_attr* attr, enum liq_nearest_strategy strategy)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return LIQ_INVALID_POINTER;
+    if (strategy < LIQ_NEAREST_AUTO || strategy > LIQ_NEAREST_GRID) return LIQ_VALUE_OUT_OF_RANGE;
+
+    attr->nearest_strategy = strategy;
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_get_nearest_strategy(const liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return -1;
+
+    return attr->nearest_strategy;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_proxy_downscale(liq_attr* attr, int factor)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return LIQ_INVALID_POINTER;
+    if (factor < 1 || factor > LIQ_PROXY_MAX_DOWNSCALE) return LIQ_VALUE_OUT_OF_RANGE;
+
+    attr->proxy_downscale = factor;
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_get_proxy_downscale(const liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return -1;
+
+    return attr->proxy_downscale;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_target_latency(liq_attr* attr, double milliseconds)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return LIQ_INVALID_POINTER;
+    if (!(milliseconds >= 0)) return LIQ_VALUE_OUT_OF_RANGE;
+
+    attr->target_latency_ms = milliseconds;
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL double liq_get_target_latency(const liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return -1;
+
+    return attr->target_latency_ms;
+}
+
 LIQ_EXPORT LIQ_NONNULL liq_error liq_set_output_gamma(liq_result* res, double gamma)
 {
     if (!CHECK_STRUCT_TYPE(res, liq_result)) return LIQ_INVALID_POINTER;
@@ -429,6 +719,14 @@ LIQ_EXPORT void liq_set_log_flush_callback(liq_attr *attr, liq_log_flush_callbac
     attr->log_flush_callback_user_info = user_info;
 }
 
+LIQ_EXPORT void liq_set_event_callback(liq_attr *attr, liq_event_callback_function *callback, void* user_info)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return;
+
+    attr->event_callback = callback;
+    attr->event_callback_user_info = user_info;
+}
+
 LIQ_EXPORT liq_attr* liq_attr_create()
 {
     return liq_attr_create_with_allocator(NULL, NULL);
@@ -446,6 +744,13 @@ LIQ_EXPORT LIQ_NONNULL void liq_attr_destroy(liq_attr *attr)
     attr->free(attr);
 }
 
+LIQ_EXPORT LIQ_NONNULL size_t liq_attr_get_memory_size(const liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return 0;
+
+    return sizeof(liq_attr);
+}
+
 LIQ_EXPORT LIQ_NONNULL liq_attr* liq_attr_copy(const liq_attr *orig)
 {
     if (!CHECK_STRUCT_TYPE(orig, liq_attr)) {
@@ -504,6 +809,8 @@ LIQ_EXPORT liq_attr* liq_attr_create_with_allocator(void* (*custom_malloc)(size_
         .last_index_transparent = false, // puts transparent color at last index. This is workaround for blu-ray subtitles.
         .target_mse = 0,
         .max_mse = MAX_DIFF,
+        .cost_model = liq_default_cost_model,
+        .proxy_downscale = 1,
     };
     liq_set_speed(attr, 4);
     return attr;
@@ -550,15 +857,35 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_histogram_add_fixed_color(liq_histogram *hi
 
 LIQ_NONNULL static bool liq_image_use_low_memory(liq_image *img)
 {
+    if (img->temp_f_row) {
+        return true;
+    }
     img->temp_f_row = img->malloc(sizeof(img->f_pixels[0]) * LIQ_TEMP_ROW_WIDTH(img->width) * omp_get_max_threads());
     return img->temp_f_row != NULL;
 }
 
-LIQ_NONNULL static bool liq_image_should_use_low_memory(liq_image *img, const bool low_memory_hint)
+LIQ_NONNULL static bool liq_image_should_use_low_memory(const liq_image *img, const bool low_memory_hint)
 {
     return (size_t)img->width * (size_t)img->height > (low_memory_hint ? LIQ_HIGH_MEMORY_LIMIT/8 : LIQ_HIGH_MEMORY_LIMIT) / sizeof(f_pixel); // Watch out for integer overflow
 }
 
+/**
+ Whether converted pixels are (or will be) produced one row at a time, instead of being precomputed for the whole image
+ */
+LIQ_NONNULL static bool liq_image_low_memory_path(const liq_image *img)
+{
+    if (img->f_pixels) {
+        return false;
+    }
+    if (img->memory_mode == LIQ_MEMORY_LOW) {
+        return true;
+    }
+    if (img->memory_mode == LIQ_MEMORY_FULL || img->cache_mode == LIQ_CACHE_KEEP) {
+        return false;
+    }
+    return liq_image_should_use_low_memory(img, false);
+}
+
 static liq_image *liq_image_create_internal(const liq_attr *attr, rgba_pixel* rows[], liq_image_get_rgba_row_callback *row_callback, void *row_callback_user_info, int width, int height, double gamma)
 {
     if (gamma < 0 || gamma > 1.0) {
@@ -592,6 +919,7 @@ static liq_image *liq_image_create_internal(const liq_attr *attr, rgba_pixel* ro
     // if image is huge or converted pixels are not likely to be reused then don't cache converted pixels
     if (liq_image_should_use_low_memory(img, !img->temp_row && !attr->use_contrast_maps && !attr->use_dither_map)) {
         verbose_print(attr, "  conserving memory");
+        liq_attr_event(attr, liq_event_init(LIQ_EVENT_LOW_MEMORY, LIQ_SEVERITY_INFO, -1));
         if (!liq_image_use_low_memory(img)) return NULL;
     }
 
@@ -645,16 +973,63 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_image_set_importance_map(liq_image *img, un
         }
         memcpy(tmp, importance_map, required_size);
         importance_map = tmp;
-    } else if (ownership != LIQ_OWN_PIXELS) {
+    } else if (ownership != LIQ_OWN_PIXELS && ownership != 0) {
         return LIQ_UNSUPPORTED;
     }
 
     liq_image_free_importance_map(img);
     img->importance_map = importance_map;
+    img->user_importance_map = true;
+    img->borrowed_importance_map = !ownership; // the caller keeps it valid until the image is destroyed
+
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_image_set_cache_mode(liq_image *img, enum liq_cache_mode mode)
+{
+    if (!CHECK_STRUCT_TYPE(img, liq_image)) return LIQ_INVALID_POINTER;
+    if (mode != LIQ_CACHE_AUTO && mode != LIQ_CACHE_KEEP && mode != LIQ_CACHE_DISCARD) return LIQ_VALUE_OUT_OF_RANGE;
+
+    img->cache_mode = mode;
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_image_get_cache_mode(const liq_image *img)
+{
+    if (!CHECK_STRUCT_TYPE(img, liq_image)) return -1;
 
+    return img->cache_mode;
+}
+
+LIQ_NONNULL static bool liq_image_can_release_f_pixels(const liq_image *img);
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_image_set_memory_mode(liq_image *img, enum liq_memory_mode mode)
+{
+    if (!CHECK_STRUCT_TYPE(img, liq_image)) return LIQ_INVALID_POINTER;
+    if (mode != LIQ_MEMORY_AUTO && mode != LIQ_MEMORY_LOW && mode != LIQ_MEMORY_FULL) return LIQ_VALUE_OUT_OF_RANGE;
+
+    img->memory_mode = mode;
+    if (mode == LIQ_MEMORY_LOW && liq_image_can_release_f_pixels(img)) {
+        img->free(img->f_pixels);
+        img->f_pixels = NULL;
+    }
     return LIQ_OK;
 }
 
+LIQ_EXPORT LIQ_NONNULL int liq_image_get_memory_mode(const liq_image *img)
+{
+    if (!CHECK_STRUCT_TYPE(img, liq_image)) return -1;
+
+    return img->memory_mode;
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_image_is_low_memory(const liq_image *img)
+{
+    if (!CHECK_STRUCT_TYPE(img, liq_image)) return -1;
+
+    return liq_image_low_memory_path(img);
+}
+
 LIQ_EXPORT LIQ_NONNULL liq_error liq_image_set_background(liq_image *img, liq_image *background)
 {
     if (!CHECK_STRUCT_TYPE(img, liq_image)) return LIQ_INVALID_POINTER;
@@ -746,64 +1121,201 @@ LIQ_EXPORT LIQ_NONNULL liq_image *liq_image_create_rgba(const liq_attr *attr, co
     return image;
 }
 
-NEVER_INLINE LIQ_EXPORT void liq_executing_user_callback(liq_image_get_rgba_row_callback *callback, liq_color *temp_row, int row, int width, void *user_info);
-LIQ_EXPORT void liq_executing_user_callback(liq_image_get_rgba_row_callback *callback, liq_color *temp_row, int row, int width, void *user_info)
-{
-    assert(callback);
-    assert(temp_row);
-    callback(temp_row, row, width, user_info);
-}
-
-LIQ_NONNULL inline static bool liq_image_has_rgba_pixels(const liq_image *img)
+LIQ_NONNULL static unsigned int liq_pixel_format_size(const enum liq_pixel_format format)
 {
-    if (!CHECK_STRUCT_TYPE(img, liq_image)) {
-        return false;
+    switch(format) {
+        case LIQ_PIXEL_RGB: return 3;
+        case LIQ_PIXEL_GRAY: return 1;
+        case LIQ_PIXEL_RGBA16_LE: case LIQ_PIXEL_RGBA16_BE: return 8;
+        default: return 4;
     }
-    return img->rows || (img->temp_row && img->row_callback);
 }
 
-LIQ_NONNULL inline static bool liq_image_can_use_rgba_rows(const liq_image *img)
+inline static bool liq_pixel_format_is_16bit(const unsigned char format)
 {
-    assert(liq_image_has_rgba_pixels(img));
-    return img->rows;
+    return format == LIQ_PIXEL_RGBA16_LE || format == LIQ_PIXEL_RGBA16_BE;
 }
 
-LIQ_NONNULL static const rgba_pixel *liq_image_get_row_rgba(liq_image *img, unsigned int row)
+/* Reads the 4 channels of a 16-bit pixel */
+inline static void liq_read_rgba16(const unsigned char *in, const bool big_endian, unsigned int channels[4])
 {
-    if (liq_image_can_use_rgba_rows(img)) {
-        return img->rows[row];
-    }
-
-    assert(img->temp_row);
-    rgba_pixel *temp_row = img->temp_row + LIQ_TEMP_ROW_WIDTH(img->width) * omp_get_thread_num();
-    if (img->rows) {
-        memcpy(temp_row, img->rows[row], img->width * sizeof(temp_row[0]));
-    } else {
-        liq_executing_user_callback(img->row_callback, (liq_color*)temp_row, row, img->width, img->row_callback_user_info);
+    for(int i=0; i < 4; i++) {
+        channels[i] = big_endian ? (in[2*i] << 8) | in[2*i+1] : in[2*i] | (in[2*i+1] << 8);
     }
-
-    return temp_row;
 }
 
-LIQ_NONNULL static void convert_row_to_f(liq_image *img, f_pixel *row_f_pixels, const unsigned int row, const float gamma_lut[])
+/**
+ Row callback of images made by liq_image_create_with_format(). It's given the image (or, for bands, the image they're cut from),
+ and may be called by several threads at once.
+ */
+static void liq_image_format_row_callback(liq_color row_out[], int row, int width, void *user_info)
 {
-    assert(row_f_pixels);
-    assert(!USE_SSE || 0 == ((uintptr_t)row_f_pixels & 15));
+    const liq_image *img = user_info;
+    const unsigned char *restrict in = img->format_pixels + img->format_row_stride * row;
+    liq_color *restrict out = row_out;
 
-    const rgba_pixel *const row_pixels = liq_image_get_row_rgba(img, row);
-
-    for(unsigned int col=0; col < img->width; col++) {
-        row_f_pixels[col] = rgba_to_f(gamma_lut, row_pixels[col]);
+    switch(img->format) {
+        case LIQ_PIXEL_RGBA:
+            memcpy(out, in, sizeof(out[0]) * width);
+            break;
+        case LIQ_PIXEL_RGB:
+            for(int col=0; col < width; col++, in += 3) out[col] = (liq_color){in[0], in[1], in[2], 255};
+            break;
+        case LIQ_PIXEL_RGBX:
+            for(int col=0; col < width; col++, in += 4) out[col] = (liq_color){in[0], in[1], in[2], 255};
+            break;
+        case LIQ_PIXEL_BGRA:
+            for(int col=0; col < width; col++, in += 4) out[col] = (liq_color){in[2], in[1], in[0], in[3]};
+            break;
+        case LIQ_PIXEL_ARGB:
+            for(int col=0; col < width; col++, in += 4) out[col] = (liq_color){in[1], in[2], in[3], in[0]};
+            break;
+        case LIQ_PIXEL_GRAY:
+            for(int col=0; col < width; col++, in++) out[col] = (liq_color){in[0], in[0], in[0], 255};
+            break;
+        case LIQ_PIXEL_RGBA_PREMULTIPLIED:
+            for(int col=0; col < width; col++, in += 4) {
+                const unsigned int a = in[3];
+                out[col] = a ? (liq_color){
+                    MIN(255, (in[0] * 255 + a/2) / a),
+                    MIN(255, (in[1] * 255 + a/2) / a),
+                    MIN(255, (in[2] * 255 + a/2) / a),
+                    a,
+                } : (liq_color){0,0,0,0};
+            }
+            break;
+        case LIQ_PIXEL_RGBA16_LE:
+        case LIQ_PIXEL_RGBA16_BE:
+            for(int col=0; col < width; col++, in += 8) {
+                unsigned int c[4];
+                liq_read_rgba16(in, img->format == LIQ_PIXEL_RGBA16_BE, c);
+                out[col] = (liq_color){
+                    (c[0] * 255 + 32767) / 65535,
+                    (c[1] * 255 + 32767) / 65535,
+                    (c[2] * 255 + 32767) / 65535,
+                    (c[3] * 255 + 32767) / 65535,
+                };
+            }
+            break;
     }
 }
 
-LIQ_NONNULL static bool liq_image_get_row_f_init(liq_image *img)
-{
+/**
+ Converts 16-bit pixels straight to f_pixel, without rounding them to 8 bits first. The gamma of values between
+ two 8-bit ones is interpolated from the lookup table, since the curve is smooth and a 16-bit table would be large.
+ */
+LIQ_NONNULL static void convert_row16_to_f(const liq_image *img, f_pixel *row_f_pixels, const unsigned int row, const float gamma_lut[])
+{
+    const unsigned char *in = img->format_pixels + img->format_row_stride * row;
+    const bool big_endian = img->format == LIQ_PIXEL_RGBA16_BE;
+
+    for(unsigned int col=0; col < img->width; col++, in += 8) {
+        unsigned int c[4];
+        liq_read_rgba16(in, big_endian, c);
+        float rgb[3];
+        for(int i=0; i < 3; i++) {
+            const unsigned int index = c[i] / 257, rest = c[i] % 257; // c[i] == 257 * index + rest
+            rgb[i] = rest ? gamma_lut[index] + (gamma_lut[index + 1] - gamma_lut[index]) * (rest / 257.f) : gamma_lut[index];
+        }
+        const float a = c[3] / 65535.f;
+        row_f_pixels[col] = (f_pixel){.a = a, .r = rgb[0]*a, .g = rgb[1]*a, .b = rgb[2]*a};
+    }
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_image *liq_image_create_with_format(const liq_attr *attr, const void *bitmap, enum liq_pixel_format format, int width, int height, size_t row_stride, double gamma)
+{
+    if (!check_image_size(attr, width, height)) {
+        return NULL;
+    }
+    if (!CHECK_USER_POINTER(bitmap)) {
+        liq_log_error(attr, "invalid bitmap pointer");
+        return NULL;
+    }
+    if ((unsigned int)format > LIQ_PIXEL_RGBA16_BE) {
+        liq_log_error(attr, "unknown pixel format");
+        return NULL;
+    }
+
+    const size_t packed_stride = (size_t)width * liq_pixel_format_size(format);
+    if (!row_stride) {
+        row_stride = packed_stride;
+    } else if (row_stride < packed_stride) {
+        liq_log_error(attr, "row stride is smaller than a row");
+        return NULL;
+    }
+
+    liq_image *image = liq_image_create_internal(attr, NULL, liq_image_format_row_callback, NULL, width, height, gamma);
+    if (!image) return NULL;
+    image->row_callback_user_info = image;
+    image->format_pixels = bitmap;
+    image->format_row_stride = row_stride;
+    image->format = format;
+    return image;
+}
+
+NEVER_INLINE LIQ_EXPORT void liq_executing_user_callback(liq_image_get_rgba_row_callback *callback, liq_color *temp_row, int row, int width, void *user_info);
+LIQ_EXPORT void liq_executing_user_callback(liq_image_get_rgba_row_callback *callback, liq_color *temp_row, int row, int width, void *user_info)
+{
+    assert(callback);
+    assert(temp_row);
+    callback(temp_row, row, width, user_info);
+}
+
+LIQ_NONNULL inline static bool liq_image_has_rgba_pixels(const liq_image *img)
+{
+    if (!CHECK_STRUCT_TYPE(img, liq_image)) {
+        return false;
+    }
+    return img->rows || (img->temp_row && img->row_callback);
+}
+
+LIQ_NONNULL inline static bool liq_image_can_use_rgba_rows(const liq_image *img)
+{
+    assert(liq_image_has_rgba_pixels(img));
+    return img->rows;
+}
+
+LIQ_NONNULL static const rgba_pixel *liq_image_get_row_rgba(liq_image *img, unsigned int row)
+{
+    if (liq_image_can_use_rgba_rows(img)) {
+        return img->rows[row];
+    }
+
+    assert(img->temp_row);
+    rgba_pixel *temp_row = img->temp_row + LIQ_TEMP_ROW_WIDTH(img->width) * omp_get_thread_num();
+    if (img->rows) {
+        memcpy(temp_row, img->rows[row], img->width * sizeof(temp_row[0]));
+    } else {
+        liq_executing_user_callback(img->row_callback, (liq_color*)temp_row, row, img->width, img->row_callback_user_info);
+    }
+
+    return temp_row;
+}
+
+LIQ_NONNULL static void convert_row_to_f(liq_image *img, f_pixel *row_f_pixels, const unsigned int row, const float gamma_lut[])
+{
+    assert(row_f_pixels);
+    assert(!USE_SSE || 0 == ((uintptr_t)row_f_pixels & 15));
+
+    if (img->row_callback == liq_image_format_row_callback && liq_pixel_format_is_16bit(img->format)) {
+        convert_row16_to_f(img, row_f_pixels, row, gamma_lut);
+        return;
+    }
+
+    const rgba_pixel *const row_pixels = liq_image_get_row_rgba(img, row);
+
+    for(unsigned int col=0; col < img->width; col++) {
+        row_f_pixels[col] = rgba_to_f(gamma_lut, row_pixels[col]);
+    }
+}
+
+LIQ_NONNULL static bool liq_image_get_row_f_init(liq_image *img)
+{
     assert(omp_get_thread_num() == 0);
     if (img->f_pixels) {
         return true;
     }
-    if (!liq_image_should_use_low_memory(img, false)) {
+    if (!liq_image_low_memory_path(img)) {
         img->f_pixels = img->malloc(sizeof(img->f_pixels[0]) * img->width * img->height);
     }
     if (!img->f_pixels) {
@@ -882,9 +1394,13 @@ LIQ_NONNULL static void liq_image_free_rgba_source(liq_image *input_image)
 
 LIQ_NONNULL static void liq_image_free_importance_map(liq_image *input_image) {
     if (input_image->importance_map) {
-        input_image->free(input_image->importance_map);
+        if (!input_image->borrowed_importance_map) {
+            input_image->free(input_image->importance_map);
+        }
         input_image->importance_map = NULL;
     }
+    input_image->user_importance_map = false;
+    input_image->borrowed_importance_map = false;
 }
 
 LIQ_NONNULL static void liq_image_free_maps(liq_image *input_image) {
@@ -904,6 +1420,148 @@ LIQ_NONNULL static void liq_image_free_dither_map(liq_image *input_image) {
     }
 }
 
+/**
+ Converted pixels can only be dropped if they can be recreated from the RGBA source
+ */
+LIQ_NONNULL static bool liq_image_can_release_f_pixels(const liq_image *img)
+{
+    return img->f_pixels && (img->rows || (img->temp_row && img->row_callback));
+}
+
+LIQ_EXPORT LIQ_NONNULL size_t liq_image_get_cache_size(const liq_image *img)
+{
+    if (!CHECK_STRUCT_TYPE(img, liq_image)) return 0;
+
+    const size_t map_size = (size_t)img->width * (size_t)img->height;
+    size_t size = 0;
+    if (liq_image_can_release_f_pixels(img)) size += map_size * sizeof(img->f_pixels[0]);
+    if (img->importance_map && !img->user_importance_map) size += map_size;
+    if (img->edges) size += map_size;
+    if (img->dither_map) size += map_size;
+    return size;
+}
+
+LIQ_EXPORT LIQ_NONNULL size_t liq_image_release_cache(liq_image *img)
+{
+    if (!CHECK_STRUCT_TYPE(img, liq_image)) return 0;
+
+    const size_t released = liq_image_get_cache_size(img);
+
+    if (liq_image_can_release_f_pixels(img)) {
+        img->free(img->f_pixels);
+        img->f_pixels = NULL;
+    }
+    if (!img->user_importance_map) {
+        liq_image_free_importance_map(img);
+    }
+    if (img->edges) {
+        img->free(img->edges);
+        img->edges = NULL;
+    }
+    liq_image_free_dither_map(img);
+
+    return released;
+}
+
+LIQ_NONNULL static size_t estimate_f_pixels_memory(const liq_image *img)
+{
+    if (img->f_pixels) {
+        return 0;
+    }
+    if (liq_image_low_memory_path(img)) {
+        return img->temp_f_row ? 0 : sizeof(img->f_pixels[0]) * LIQ_TEMP_ROW_WIDTH(img->width) * omp_get_max_threads();
+    }
+    return sizeof(img->f_pixels[0]) * img->width * img->height;
+}
+
+/**
+ Mirrors allocations made by contrast_maps()
+ */
+LIQ_NONNULL static size_t estimate_contrast_maps_memory(const liq_image *img)
+{
+    const size_t cols = img->width, rows = img->height;
+    if (cols < 4 || rows < 4 || (3*cols*rows) > LIQ_HIGH_MEMORY_LIMIT) {
+        return 0;
+    }
+
+    size_t size = cols*rows; // tmp
+    if (!img->importance_map) size += cols*rows;
+    if (!img->edges) size += cols*rows;
+    if (liq_image_low_memory_path(img)) size += 3 * cols * sizeof(img->f_pixels[0]);
+    return size + estimate_f_pixels_memory(img);
+}
+
+LIQ_EXPORT LIQ_NONNULL size_t liq_image_estimate_quantize_memory(const liq_image *img, const liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(img, liq_image)) return 0;
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return 0;
+
+    size_t size = sizeof(liq_histogram) + sizeof(liq_result);
+
+    if (!img->importance_map && attr->use_contrast_maps) {
+        size += estimate_contrast_maps_memory(img);
+    }
+
+    // same guess pam_allocacolorhash() makes; the hash table and histogram briefly coexist
+    const size_t surface = (size_t)img->width * (size_t)img->height;
+    const unsigned int ignorebits = MAX(attr->min_posterization_output, attr->min_posterization_input);
+    const size_t colors = MIN(attr->max_histogram_entries, surface/(ignorebits + (surface > 512*512 ? 6 : 5)));
+    const size_t hash_size = colors < 66000 ? 6673 : (colors < 200000 ? 12011 : 24019);
+    size += sizeof(struct acolorhash_table) + hash_size * sizeof(struct acolorhist_arr_head) + colors * sizeof(struct acolorhist_arr_item);
+    size += sizeof(histogram) + colors * sizeof(hist_item);
+
+    // the best palette so far, the candidate and the copy made for the result
+    size += 3 * (sizeof(colormap) + attr->max_colors * sizeof(colormap_item));
+    return size;
+}
+
+LIQ_EXPORT LIQ_NONNULL size_t liq_image_estimate_remap_memory(const liq_image *img, const liq_result *result)
+{
+    if (!CHECK_STRUCT_TYPE(img, liq_image)) return 0;
+    if (!CHECK_STRUCT_TYPE(result, liq_result)) return 0;
+
+    size_t size = sizeof(liq_remapping_result) + sizeof(colormap) + result->palette->colors * sizeof(colormap_item);
+    size += img->height * sizeof(unsigned char *); // row pointers made by liq_write_remapped_image()
+
+    size += estimate_f_pixels_memory(img);
+    if (img->background) {
+        size += estimate_f_pixels_memory(img->background);
+    }
+
+    if (!img->edges && !img->dither_map && result->use_dither_map) {
+        size += estimate_contrast_maps_memory(img);
+    }
+    if (result->dither_level > 0) {
+        size += 2 * (img->width + 2) * sizeof(f_pixel); // Floyd-Steinberg error rows
+        if (img->cache_mode == LIQ_CACHE_KEEP && result->use_dither_map) {
+            size += (size_t)img->width * (size_t)img->height; // dither map is built in a copy of the edges
+        }
+    }
+    return size;
+}
+
+/**
+ Everything the image frees when it's destroyed, including its background
+ */
+LIQ_EXPORT LIQ_NONNULL size_t liq_image_get_memory_size(const liq_image *img)
+{
+    if (!CHECK_STRUCT_TYPE(img, liq_image)) return 0;
+
+    const size_t map_size = (size_t)img->width * (size_t)img->height;
+    const size_t temp_row_pixels = LIQ_TEMP_ROW_WIDTH(img->width) * omp_get_max_threads();
+    size_t size = sizeof(liq_image);
+    if (img->free_pixels && img->pixels) size += map_size * sizeof(img->pixels[0]);
+    if (img->free_rows && img->rows) size += img->height * sizeof(img->rows[0]);
+    if (img->f_pixels) size += map_size * sizeof(img->f_pixels[0]);
+    if (img->importance_map && !img->borrowed_importance_map) size += map_size;
+    if (img->edges) size += map_size;
+    if (img->dither_map) size += map_size;
+    if (img->temp_row) size += temp_row_pixels * sizeof(img->temp_row[0]);
+    if (img->temp_f_row) size += temp_row_pixels * sizeof(img->temp_f_row[0]);
+    if (img->background) size += liq_image_get_memory_size(img->background);
+    return size;
+}
+
 LIQ_EXPORT LIQ_NONNULL void liq_image_destroy(liq_image *input_image)
 {
     if (!CHECK_STRUCT_TYPE(input_image, liq_image)) return;
@@ -950,6 +1608,19 @@ LIQ_EXPORT liq_histogram* liq_histogram_create(const liq_attr* attr)
     return hist;
 }
 
+/**
+ Fixed colors are stored in the struct, and the color hash table with all its
+ entries in its mempool, so these two are everything the histogram frees
+ */
+LIQ_EXPORT LIQ_NONNULL size_t liq_histogram_get_memory_size(const liq_histogram *hist)
+{
+    if (!CHECK_STRUCT_TYPE(hist, liq_histogram)) return 0;
+
+    size_t size = sizeof(liq_histogram);
+    if (hist->acht) size += mempool_size(hist->acht->mempool);
+    return size;
+}
+
 LIQ_EXPORT LIQ_NONNULL void liq_histogram_destroy(liq_histogram *hist)
 {
     if (!CHECK_STRUCT_TYPE(hist, liq_histogram)) return;
@@ -968,6 +1639,174 @@ LIQ_EXPORT LIQ_NONNULL liq_result *liq_quantize_image(liq_attr *attr, liq_image
     return res;
 }
 
+/**
+ Search budgets are reduced for large histograms
+ */
+static unsigned int liq_scale_budget_for_histogram(unsigned int budget, const unsigned int hist_size)
+{
+    if (hist_size > 5000) {budget = (budget*3 + 3)/4;}
+    if (hist_size > 25000) {budget = (budget*3 + 3)/4;}
+    if (hist_size > 50000) {budget = (budget*3 + 3)/4;}
+    if (hist_size > 100000) {budget = (budget*3 + 3)/4;}
+    return budget;
+}
+
+/**
+ Lowers the budgets spent while the histogram is made, if they alone would take most of the target latency
+ */
+LIQ_NONNULL static void liq_fit_latency_to_image(liq_attr *budget, const liq_image *img)
+{
+    const double pixels = (double)img->width * img->height;
+    const double histogram_ms = pixels * budget->cost_model.histogram_ms_per_pixel;
+    const double contrast_maps_ms = pixels * budget->cost_model.contrast_maps_ms_per_pixel;
+
+    if (budget->use_contrast_maps && !img->importance_map && histogram_ms + contrast_maps_ms > budget->target_latency_ms / 2) {
+        budget->use_contrast_maps = false;
+    }
+    if (histogram_ms > budget->target_latency_ms / 2) {
+        budget->min_posterization_input = MAX(budget->min_posterization_input, 1); // makes the histogram smaller
+    }
+}
+
+/**
+ Picks the most thorough palette search that is expected to finish in remaining_ms. Candidates are the configured
+ budgets, then the speed presets capped by them.
+ */
+LIQ_NONNULL static void liq_fit_latency_to_histogram(liq_attr *budget, const unsigned int hist_size, const double remaining_ms)
+{
+    const double mediancut_ms = hist_size * budget->cost_model.mediancut_ms_per_color;
+    const double kmeans_ms = hist_size * budget->cost_model.kmeans_ms_per_color;
+
+    unsigned int trials = budget->feedback_loop_trials, iterations = budget->kmeans_iterations;
+    double iteration_limit = budget->kmeans_iteration_limit;
+    for(unsigned int speed = 1; speed <= 10; speed++) {
+        // each feedback loop trial is a mediancut and a K-Means iteration
+        const unsigned int scaled_trials = liq_scale_budget_for_histogram(trials, hist_size);
+        const unsigned int scaled_iterations = liq_scale_budget_for_histogram(iterations, hist_size);
+        const double estimate_ms = mediancut_ms * (1 + scaled_trials) + kmeans_ms * (scaled_trials + scaled_iterations);
+        if (estimate_ms <= remaining_ms) {
+            break;
+        }
+
+        const struct liq_speed_preset *const preset = &liq_speed_presets[speed-1];
+        trials = MIN(budget->feedback_loop_trials, preset->feedback_loop_trials);
+        iterations = MIN(budget->kmeans_iterations, preset->kmeans_iterations);
+        iteration_limit = MAX(budget->kmeans_iteration_limit, preset->kmeans_iteration_limit);
+    }
+
+    budget->feedback_loop_trials = trials;
+    budget->kmeans_iterations = iterations;
+    budget->kmeans_iteration_limit = iteration_limit;
+    liq_attr_update_progress_stages(budget);
+    liq_verbose_printf(budget, "  %.0fms left: up to %u feedback loop trials and %u K-Means iterations", remaining_ms, trials, iterations);
+}
+
+/**
+ Box-downscales the importance map of img into proxy, averaging the same blocks as the pixels
+ */
+LIQ_NONNULL static bool liq_image_downscale_importance_map(liq_image *proxy, const liq_image *img, const unsigned int factor)
+{
+    unsigned char *const importance_map = proxy->malloc((size_t)proxy->width * proxy->height);
+    if (!importance_map) {
+        return false;
+    }
+
+    for(unsigned int y=0; y < proxy->height; y++) {
+        const unsigned int start_row = y * factor, end_row = MIN(img->height, start_row + factor);
+        for(unsigned int x=0; x < proxy->width; x++) {
+            const unsigned int start_col = x * factor, end_col = MIN(img->width, start_col + factor);
+            unsigned int sum = 0;
+            for(unsigned int row = start_row; row < end_row; row++) {
+                const unsigned char *const map_row = img->importance_map + (size_t)row * img->width;
+                for(unsigned int col = start_col; col < end_col; col++) {
+                    sum += map_row[col];
+                }
+            }
+            const unsigned int count = (end_row - start_row) * (end_col - start_col);
+            importance_map[(size_t)y * proxy->width + x] = (sum + count/2) / count;
+        }
+    }
+
+    proxy->importance_map = importance_map;
+    proxy->user_importance_map = true;
+    return true;
+}
+
+/**
+ Creates an image factor times smaller than img, with each pixel the average of a block of factor×factor pixels.
+ Colors are weighted by alpha, so that transparent pixels don't darken their neighbors. Fixed colors and
+ the user's importance map are carried over. The proxy borrows *pixels_output, which the caller frees after the proxy.
+ */
+LIQ_NONNULL static liq_image *liq_image_create_proxy(liq_image *img, const liq_attr *attr, const unsigned int factor, rgba_pixel **pixels_output)
+{
+    const unsigned int width = (img->width + factor - 1) / factor, height = (img->height + factor - 1) / factor;
+    const int max_threads = omp_get_max_threads();
+    rgba_pixel *const pixels = attr->malloc(sizeof(pixels[0]) * width * height);
+    rgba_pixel **const rows = attr->malloc(sizeof(rows[0]) * height);
+    unsigned int *const sums = attr->malloc(sizeof(sums[0]) * 4 * width * max_threads);
+    if (!pixels || !rows || !sums) {
+        if (pixels) attr->free(pixels);
+        if (rows) attr->free(rows);
+        if (sums) attr->free(sums);
+        return NULL;
+    }
+
+    const unsigned int img_width = img->width, img_height = img->height;
+    #pragma omp parallel for if (img_width*img_height > 3000) schedule(static)
+    for(int y=0; y < (int)height; y++) {
+        unsigned int *const sum = sums + 4 * width * omp_get_thread_num();
+        memset(sum, 0, sizeof(sum[0]) * 4 * width);
+
+        const unsigned int start_row = y * factor, end_row = MIN(img_height, start_row + factor);
+        for(unsigned int row = start_row; row < end_row; row++) {
+            const rgba_pixel *const row_pixels = liq_image_get_row_rgba(img, row);
+            for(unsigned int col=0; col < img_width; col++) {
+                const rgba_pixel px = row_pixels[col];
+                unsigned int *const block = sum + 4 * (col / factor);
+                block[0] += px.r * px.a;
+                block[1] += px.g * px.a;
+                block[2] += px.b * px.a;
+                block[3] += px.a;
+            }
+        }
+
+        rows[y] = pixels + y * width;
+        for(unsigned int x=0; x < width; x++) {
+            const unsigned int *const block = sum + 4 * x;
+            const unsigned int alpha = block[3];
+            const unsigned int count = (end_row - start_row) * (MIN(img_width, (x + 1) * factor) - x * factor);
+            rows[y][x] = alpha ? (rgba_pixel){
+                .r = (block[0] + alpha/2) / alpha,
+                .g = (block[1] + alpha/2) / alpha,
+                .b = (block[2] + alpha/2) / alpha,
+                .a = (alpha + count/2) / count,
+            } : (rgba_pixel){0,0,0,0};
+        }
+    }
+    attr->free(sums);
+
+    liq_image *proxy = liq_image_create_internal(attr, rows, NULL, NULL, width, height, img->gamma);
+    if (!proxy) {
+        attr->free(rows);
+        attr->free(pixels);
+        return NULL;
+    }
+    proxy->free_rows = true;
+    proxy->free_rows_internal = true;
+
+    memcpy(proxy->fixed_colors, img->fixed_colors, sizeof(img->fixed_colors[0]) * img->fixed_colors_count);
+    proxy->fixed_colors_count = img->fixed_colors_count;
+
+    if (img->user_importance_map && !liq_image_downscale_importance_map(proxy, img, factor)) {
+        liq_image_destroy(proxy);
+        attr->free(pixels);
+        return NULL;
+    }
+
+    *pixels_output = pixels;
+    return proxy;
+}
+
 LIQ_EXPORT LIQ_NONNULL liq_error liq_image_quantize(liq_image *const img, liq_attr *const attr, liq_result **result_output)
 {
     if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return LIQ_INVALID_POINTER;
@@ -975,27 +1814,56 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_image_quantize(liq_image *const img, liq_at
         return LIQ_UNSUPPORTED;
     }
 
-    liq_histogram *hist = liq_histogram_create(attr);
-    if (!hist) {
-        return LIQ_OUT_OF_MEMORY;
+    const double start_ms = liq_time_ms();
+
+    // the palette is made from a smaller copy of the image, and it's the caller that remaps the full image
+    liq_image *histogram_image = img, *proxy = NULL;
+    rgba_pixel *proxy_pixels = NULL;
+    if (attr->proxy_downscale > 1) {
+        proxy = liq_image_create_proxy(img, attr, attr->proxy_downscale, &proxy_pixels);
+        if (!proxy) {
+            return LIQ_OUT_OF_MEMORY;
+        }
+        liq_verbose_printf(attr, "  making palette from %ux%u proxy image", proxy->width, proxy->height);
+        histogram_image = proxy;
     }
-    liq_error err = liq_histogram_add_image(hist, attr, img);
-    if (LIQ_OK != err) {
-        liq_histogram_destroy(hist);
-        return err;
+
+    liq_attr *options = attr, budget;
+    if (attr->target_latency_ms > 0) {
+        budget = *attr;
+        liq_fit_latency_to_image(&budget, histogram_image);
+        options = &budget;
     }
 
-    err = liq_histogram_quantize_internal(hist, attr, false, result_output);
-    liq_histogram_destroy(hist);
+    liq_error err = LIQ_OUT_OF_MEMORY;
+    liq_histogram *hist = liq_histogram_create(options);
+    if (hist) {
+        if (proxy) {
+            hist->histogram_ms = liq_time_ms() - start_ms; // making the proxy is part of building the histogram
+        }
+        err = liq_histogram_add_image(hist, options, histogram_image);
+        if (LIQ_OK == err) {
+            err = liq_histogram_quantize_internal(hist, options, false, start_ms, result_output);
+        }
+        liq_histogram_destroy(hist);
+    }
 
+    if (proxy) {
+        // the proxy's error underestimates the full image's, so the remapping measures it instead
+        if (LIQ_OK == err) {
+            (*result_output)->palette_error = -1;
+        }
+        liq_image_destroy(proxy);
+        attr->free(proxy_pixels);
+    }
     return err;
 }
 
 LIQ_EXPORT LIQ_NONNULL liq_error liq_histogram_quantize(liq_histogram *input_hist, liq_attr *attr, liq_result **result_output) {
-    return liq_histogram_quantize_internal(input_hist, attr, true, result_output);
+    return liq_histogram_quantize_internal(input_hist, attr, true, liq_time_ms(), result_output);
 }
 
-LIQ_NONNULL static liq_error liq_histogram_quantize_internal(liq_histogram *input_hist, liq_attr *attr, bool fixed_result_colors, liq_result **result_output)
+LIQ_NONNULL static liq_error liq_histogram_quantize_internal(liq_histogram *input_hist, liq_attr *attr, bool fixed_result_colors, const double start_ms, liq_result **result_output)
 {
     if (!CHECK_USER_POINTER(result_output)) return LIQ_INVALID_POINTER;
     *result_output = NULL;
@@ -1005,15 +1873,134 @@ LIQ_NONNULL static liq_error liq_histogram_quantize_internal(liq_histogram *inpu
 
     if (liq_progress(attr, 0)) return LIQ_ABORTED;
 
+    liq_quantization_stats stats = {
+        .histogram_ms = input_hist->histogram_ms,
+        .contrast_maps_ms = input_hist->contrast_maps_ms,
+    };
+    const double finalize_start_ms = liq_time_ms();
     histogram *hist;
     liq_error err = finalize_histogram(input_hist, attr, &hist);
     if (err != LIQ_OK) {
         return err;
     }
+    stats.finalize_histogram_ms = liq_time_ms() - finalize_start_ms;
+    stats.histogram_size = hist->size;
+    stats.ignorebits = hist->ignorebits;
 
-    err = pngquant_quantize(hist, attr, input_hist->fixed_colors_count, input_hist->fixed_colors, input_hist->gamma, fixed_result_colors, result_output);
+    liq_attr budget;
+    if (attr->target_latency_ms > 0) {
+        budget = *attr;
+        liq_fit_latency_to_histogram(&budget, hist->size, attr->target_latency_ms - (liq_time_ms() - start_ms));
+        attr = &budget;
+    }
+
+    if (attr->minimize_colors) {
+        err = pngquant_quantize_min_colors(hist, attr, input_hist->fixed_colors_count, input_hist->fixed_colors, input_hist->gamma, fixed_result_colors, &stats, result_output);
+    } else {
+        err = pngquant_quantize(hist, attr, input_hist->fixed_colors_count, input_hist->fixed_colors, input_hist->gamma, fixed_result_colors, &stats, result_output);
+    }
     pam_freeacolorhist(hist);
 
+    if (err == LIQ_OK) {
+        (*result_output)->stats = stats;
+    }
+
+    return err;
+}
+
+/**
+ Measures the liq_cost_model constants on this machine by quantizing a synthetic image with noisy gradients
+ */
+LIQ_EXPORT LIQ_NONNULL liq_error liq_calibrate_latency(liq_attr *attr)
+{
+    if (!CHECK_STRUCT_TYPE(attr, liq_attr)) return LIQ_INVALID_POINTER;
+
+    const unsigned int width = 256, height = 256, kmeans_iterations = 4;
+    rgba_pixel *pixels = attr->malloc(width * height * sizeof(rgba_pixel));
+    if (!pixels) return LIQ_OUT_OF_MEMORY;
+
+    unsigned int seed = 1;
+    for(unsigned int y=0; y < height; y++) {
+        for(unsigned int x=0; x < width; x++) {
+            seed = seed * 1103515245 + 12345;
+            const unsigned int noise = (seed >> 16) & 15;
+            pixels[y*width + x] = (rgba_pixel){
+                .r = x + noise,
+                .g = y + noise,
+                .b = (x + y) / 2 + noise,
+                .a = 255 - (noise & 3) * 16,
+            };
+        }
+    }
+
+    liq_attr options = *attr;
+    options.progress_callback = NULL;
+    options.log_callback = NULL;
+    options.log_flush_callback = NULL;
+    options.event_callback = NULL;
+    options.target_latency_ms = 0;
+    options.minimize_colors = false;
+    options.use_contrast_maps = false;
+    options.feedback_loop_trials = 0;
+    options.kmeans_iteration_limit = 0;
+
+    liq_image *img = liq_image_create_rgba(&options, pixels, width, height, 0);
+    if (!img) {
+        attr->free(pixels);
+        return LIQ_OUT_OF_MEMORY;
+    }
+
+    const f_pixel no_fixed_colors[1] = {{0}};
+    // the fastest of a few runs is the least disturbed by other processes
+    liq_cost_model best = {MAX_DIFF, MAX_DIFF, MAX_DIFF, MAX_DIFF};
+    liq_error err = LIQ_OK;
+    for(int run=0; run < 3 && err == LIQ_OK; run++) {
+        double start = liq_time_ms();
+        liq_image_free_maps(img);
+        contrast_maps(img);
+        const double contrast_maps_ms = liq_time_ms() - start;
+
+        liq_histogram *input_hist = liq_histogram_create(&options);
+        histogram *hist = NULL;
+        err = input_hist ? liq_histogram_add_image(input_hist, &options, img) : LIQ_OUT_OF_MEMORY;
+        // adding the image again only finds existing entries, which is the cost per pixel
+        start = liq_time_ms();
+        if (err == LIQ_OK) err = liq_histogram_add_image(input_hist, &options, img);
+        const double histogram_ms = liq_time_ms() - start;
+        if (err == LIQ_OK) err = finalize_histogram(input_hist, &options, &hist);
+        const double gamma = input_hist ? input_hist->gamma : 0;
+        if (input_hist) liq_histogram_destroy(input_hist);
+        if (err != LIQ_OK) break;
+
+        liq_result *res = NULL;
+        liq_quantization_stats stats = {0};
+        options.kmeans_iterations = 0;
+        start = liq_time_ms();
+        err = pngquant_quantize(hist, &options, 0, no_fixed_colors, gamma, false, &stats, &res);
+        const double mediancut_ms = liq_time_ms() - start;
+        if (res) liq_result_destroy(res);
+
+        options.kmeans_iterations = kmeans_iterations;
+        start = liq_time_ms();
+        if (err == LIQ_OK) err = pngquant_quantize(hist, &options, 0, no_fixed_colors, gamma, false, &stats, &res);
+        const double kmeans_ms = (liq_time_ms() - start - mediancut_ms) / kmeans_iterations;
+        if (res) liq_result_destroy(res);
+
+        const double colors = MAX(1, hist->size);
+        pam_freeacolorhist(hist);
+
+        best.histogram_ms_per_pixel = MIN(best.histogram_ms_per_pixel, histogram_ms / (width * height));
+        best.contrast_maps_ms_per_pixel = MIN(best.contrast_maps_ms_per_pixel, contrast_maps_ms / (width * height));
+        best.mediancut_ms_per_color = MIN(best.mediancut_ms_per_color, mediancut_ms / colors);
+        best.kmeans_ms_per_color = MIN(best.kmeans_ms_per_color, MAX(0, kmeans_ms) / colors);
+    }
+
+    liq_image_destroy(img);
+    attr->free(pixels);
+
+    if (err == LIQ_OK) {
+        attr->cost_model = best;
+    }
     return err;
 }
 
@@ -1031,6 +2018,87 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_set_dithering_level(liq_result *res, float
     return LIQ_OK;
 }
 
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_fast_remapping(liq_result *res, int enabled)
+{
+    if (!CHECK_STRUCT_TYPE(res, liq_result)) return LIQ_INVALID_POINTER;
+
+    if (res->remapping) {
+        liq_remapping_result_destroy(res->remapping);
+        res->remapping = NULL;
+    }
+
+    res->fast_remapping = enabled;
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_get_fast_remapping(const liq_result *res)
+{
+    if (!CHECK_STRUCT_TYPE(res, liq_result)) return -1;
+
+    return res->fast_remapping;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_dithering_algorithm(liq_result *res, enum liq_dithering_algorithm algorithm)
+{
+    if (!CHECK_STRUCT_TYPE(res, liq_result)) return LIQ_INVALID_POINTER;
+    if (algorithm != LIQ_DITHER_FLOYD_STEINBERG && algorithm != LIQ_DITHER_BAYER && algorithm != LIQ_DITHER_BLUE_NOISE) return LIQ_VALUE_OUT_OF_RANGE;
+
+    if (res->remapping) {
+        liq_remapping_result_destroy(res->remapping);
+        res->remapping = NULL;
+    }
+
+    res->dithering_algorithm = algorithm;
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_get_dithering_algorithm(const liq_result *res)
+{
+    if (!CHECK_STRUCT_TYPE(res, liq_result)) return -1;
+
+    return res->dithering_algorithm;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_parallel_dithering(liq_result *res, int enabled)
+{
+    if (!CHECK_STRUCT_TYPE(res, liq_result)) return LIQ_INVALID_POINTER;
+
+    if (res->remapping) {
+        liq_remapping_result_destroy(res->remapping);
+        res->remapping = NULL;
+    }
+
+    res->parallel_dithering = enabled;
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_get_parallel_dithering(const liq_result *res)
+{
+    if (!CHECK_STRUCT_TYPE(res, liq_result)) return -1;
+
+    return res->parallel_dithering;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_set_deterministic_dithering(liq_result *res, int enabled)
+{
+    if (!CHECK_STRUCT_TYPE(res, liq_result)) return LIQ_INVALID_POINTER;
+
+    if (res->remapping) {
+        liq_remapping_result_destroy(res->remapping);
+        res->remapping = NULL;
+    }
+
+    res->deterministic_dithering = enabled;
+    return LIQ_OK;
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_get_deterministic_dithering(const liq_result *res)
+{
+    if (!CHECK_STRUCT_TYPE(res, liq_result)) return -1;
+
+    return res->deterministic_dithering;
+}
+
 LIQ_NONNULL static liq_remapping_result *liq_remapping_result_create(liq_result *result)
 {
     if (!CHECK_STRUCT_TYPE(result, liq_result)) {
@@ -1050,8 +2118,19 @@ LIQ_NONNULL static liq_remapping_result *liq_remapping_result_create(liq_result
         .palette = pam_duplicate_colormap(result->palette),
         .progress_callback = result->progress_callback,
         .progress_callback_user_info = result->progress_callback_user_info,
+        .event_callback = result->event_callback,
+        .event_callback_user_info = result->event_callback_user_info,
         .progress_stage1 = result->use_dither_map ? 20 : 0,
+        .parallel_dithering = result->parallel_dithering,
+        .deterministic_dithering = result->deterministic_dithering,
+        .dithering_algorithm = result->dithering_algorithm,
+        .fast_remapping = result->fast_remapping,
+        .nearest_strategy = result->nearest_strategy,
     };
+    if (!res->palette) {
+        result->free(res);
+        return NULL;
+    }
     return res;
 }
 
@@ -1073,6 +2152,22 @@ LIQ_NONNULL static void liq_remapping_result_destroy(liq_remapping_result *resul
     result->free(result);
 }
 
+LIQ_NONNULL static size_t colormap_memory_size(const colormap *map)
+{
+    return sizeof(colormap) + map->colors * sizeof(map->palette[0]);
+}
+
+LIQ_EXPORT LIQ_NONNULL size_t liq_result_get_memory_size(const liq_result *result)
+{
+    if (!CHECK_STRUCT_TYPE(result, liq_result)) return 0;
+
+    size_t size = sizeof(liq_result) + colormap_memory_size(result->palette);
+    if (result->remapping) {
+        size += sizeof(liq_remapping_result) + colormap_memory_size(result->remapping->palette);
+    }
+    return size;
+}
+
 LIQ_EXPORT LIQ_NONNULL void liq_result_destroy(liq_result *res)
 {
     if (!CHECK_STRUCT_TYPE(res, liq_result)) return;
@@ -1131,6 +2226,39 @@ LIQ_EXPORT LIQ_NONNULL int liq_get_remapping_quality(const liq_result *result) {
     return -1;
 }
 
+LIQ_EXPORT LIQ_NONNULL double liq_get_timing(const liq_result *result, enum liq_timing stage)
+{
+    if (!CHECK_STRUCT_TYPE(result, liq_result)) return -1;
+
+    const liq_remapping_result *const remapping = result->remapping;
+    switch(stage) {
+        case LIQ_TIMING_HISTOGRAM: return result->stats.histogram_ms / 1000.0;
+        case LIQ_TIMING_CONTRAST_MAPS: return result->stats.contrast_maps_ms / 1000.0;
+        case LIQ_TIMING_FINALIZE_HISTOGRAM: return result->stats.finalize_histogram_ms / 1000.0;
+        case LIQ_TIMING_MEDIANCUT: return result->stats.mediancut_ms / 1000.0;
+        case LIQ_TIMING_FEEDBACK_LOOP: return result->stats.feedback_loop_ms / 1000.0;
+        case LIQ_TIMING_KMEANS: return result->stats.kmeans_ms / 1000.0;
+        // remapping stages are only known once the image has been remapped
+        case LIQ_TIMING_REMAP: return remapping ? remapping->remap_ms / 1000.0 : -1;
+        case LIQ_TIMING_DITHER_MAP: return remapping ? remapping->dither_map_ms / 1000.0 : -1;
+        case LIQ_TIMING_DITHER: return remapping ? remapping->dither_ms / 1000.0 : -1;
+        default: return -1;
+    }
+}
+
+LIQ_EXPORT LIQ_NONNULL int liq_get_counter(const liq_result *result, enum liq_counter counter)
+{
+    if (!CHECK_STRUCT_TYPE(result, liq_result)) return -1;
+
+    switch(counter) {
+        case LIQ_COUNTER_HISTOGRAM_SIZE: return result->stats.histogram_size;
+        case LIQ_COUNTER_IGNOREBITS: return result->stats.ignorebits;
+        case LIQ_COUNTER_FEEDBACK_TRIALS: return result->stats.feedback_trials;
+        case LIQ_COUNTER_KMEANS_ITERATIONS: return result->stats.kmeans_iterations;
+        default: return -1;
+    }
+}
+
 LIQ_NONNULL static int compare_popularity(const void *ch1, const void *ch2)
 {
     const float v1 = ((const colormap_item*)ch1)->popularity;
@@ -1249,7 +2377,11 @@ LIQ_EXPORT LIQ_NONNULL const liq_palette *liq_get_palette(liq_result *result)
     return &result->int_palette;
 }
 
-LIQ_NONNULL static float remap_to_palette(liq_image *const input_image, unsigned char *const *const output_pixels, colormap *const map)
+/**
+ Remaps without dithering. Unless refine_palette is false, the colors of the image are also used for a K-Means iteration
+ that moves the palette closer to them.
+ */
+LIQ_NONNULL static float remap_to_palette(liq_image *const input_image, unsigned char *const *const output_pixels, colormap *const map, const enum liq_nearest_strategy nearest_strategy, const bool refine_palette)
 {
     const int rows = input_image->height;
     const unsigned int cols = input_image->width;
@@ -1264,7 +2396,10 @@ LIQ_NONNULL static float remap_to_palette(liq_image *const input_image, unsigned
 
     const colormap_item *acolormap = map->palette;
 
-    struct nearest_map *const n = nearest_init(map);
+    struct nearest_map *const n = nearest_init(map, nearest_strategy);
+    if (!n) {
+        return -1;
+    }
     liq_image *background = input_image->background;
     const int transparent_index = background ? nearest_search(n, &(f_pixel){0,0,0,0}, 0, NULL) : -1;
     if (background && acolormap[transparent_index].acolor.a > 1.f/256.f) {
@@ -1275,11 +2410,13 @@ LIQ_NONNULL static float remap_to_palette(liq_image *const input_image, unsigned
 
     const unsigned int max_threads = omp_get_max_threads();
     LIQ_ARRAY(kmeans_state, average_color, (KMEANS_CACHE_LINE_GAP+map->colors) * max_threads);
-    kmeans_init(map, max_threads, average_color);
+    if (refine_palette) {
+        kmeans_init(map, max_threads, average_color);
+    }
 
 #if __GNUC__ >= 9 || __clang__
     #pragma omp parallel for if (rows*cols > 3000) \
-        schedule(static) default(none) shared(background,acolormap,average_color,cols,input_image,map,n,output_pixels,rows,transparent_index) reduction(+:remapping_error)
+        schedule(static) default(none) shared(background,acolormap,average_color,cols,input_image,map,n,output_pixels,refine_palette,rows,transparent_index) reduction(+:remapping_error)
 #endif
     for(int row = 0; row < rows; ++row) {
         const f_pixel *const row_pixels = liq_image_get_row_f(input_image, row);
@@ -1299,13 +2436,15 @@ LIQ_NONNULL static float remap_to_palette(liq_image *const input_image, unsigned
             output_pixels[row][col] = last_match;
 
             remapping_error += diff;
-            if (last_match != transparent_index) {
+            if (refine_palette && last_match != transparent_index) {
                 kmeans_update_color(row_pixels[col], 1.0, map, last_match, omp_get_thread_num(), average_color);
             }
         }
     }
 
-    kmeans_finalize(map, max_threads, average_color);
+    if (refine_palette) {
+        kmeans_finalize(map, max_threads, average_color);
+    }
 
     nearest_free(n);
 
@@ -1355,56 +2494,26 @@ inline static f_pixel get_dithered_pixel(const float dither_level, const float m
 }
 
 /**
-  Uses edge/noise map to apply dithering only to flat areas. Dithering on edges creates jagged lines, and noisy areas are "naturally" dithered.
-
-  If output_image_is_remapped is true, only pixels noticeably changed by error diffusion will be written to output image.
+ Dithers rows start_row..end_row-1. Dithering starts at warmup_row, but output is written only from start_row,
+ so that the error rows are already realistic at the top of a stripe instead of starting from zero.
+ `thiserr` must have room for two error rows.
  */
-LIQ_NONNULL static bool remap_to_palette_floyd(liq_image *input_image, unsigned char *const output_pixels[], liq_remapping_result *quant, const float max_dither_error, const bool output_image_is_remapped)
+static bool remap_to_palette_floyd_stripe(liq_image *input_image, unsigned char *const output_pixels[], liq_remapping_result *quant, const float max_dither_error, const bool output_image_is_remapped,
+    const unsigned char *dither_map, const struct nearest_map *const n, liq_image *background, const int transparent_index, const float base_dithering_level,
+    const int warmup_row, const int start_row, const int end_row, f_pixel *restrict thiserr, const bool report_progress)
 {
     const int rows = input_image->height, cols = input_image->width;
-    const unsigned char *dither_map = quant->use_dither_map ? (input_image->dither_map ? input_image->dither_map : input_image->edges) : NULL;
-
-    const colormap *map = quant->palette;
-    const colormap_item *acolormap = map->palette;
+    const colormap_item *acolormap = quant->palette->palette;
 
-    if (!liq_image_get_row_f_init(input_image)) {
-        return false;
-    }
-    if (input_image->background && !liq_image_get_row_f_init(input_image->background)) {
-        return false;
-    }
-
-    /* Initialize Floyd-Steinberg error vectors. */
     const size_t errwidth = cols+2;
-    f_pixel *restrict thiserr = input_image->malloc(errwidth * sizeof(thiserr[0]) * 2); // +2 saves from checking out of bounds access
-    if (!thiserr) return false;
     f_pixel *restrict nexterr = thiserr + errwidth;
     memset(thiserr, 0, errwidth * sizeof(thiserr[0]));
 
-    bool ok = true;
-    struct nearest_map *const n = nearest_init(map);
-    liq_image *background = input_image->background;
-    const int transparent_index = background ? nearest_search(n, &(f_pixel){0,0,0,0}, 0, NULL) : -1;
-    if (background && acolormap[transparent_index].acolor.a > 1.f/256.f) {
-        // palette unsuitable for using the bg
-        background = NULL;
-    }
-
-    // response to this value is non-linear and without it any value < 0.8 would give almost no dithering
-    float base_dithering_level = quant->dither_level;
-    base_dithering_level = 1.f - (1.f-base_dithering_level)*(1.f-base_dithering_level);
-
-    if (dither_map) {
-        base_dithering_level *= 1.f/255.f; // convert byte to float
-    }
-    base_dithering_level *= 15.f/16.f; // prevent small errors from accumulating
-
-    int fs_direction = 1;
+    int fs_direction = (warmup_row & 1) ? -1 : 1; // same zig-zag as dithering the whole image in one go
     unsigned int last_match=0;
-    for (int row = 0; row < rows; ++row) {
-        if (liq_remap_progress(quant, quant->progress_stage1 + row * (100.f - quant->progress_stage1) / rows)) {
-            ok = false;
-            break;
+    for (int row = warmup_row; row < end_row; ++row) {
+        if (report_progress && liq_remap_progress(quant, quant->progress_stage1 + row * (100.f - quant->progress_stage1) / rows)) {
+            return false;
         }
 
         memset(nexterr, 0, errwidth * sizeof(nexterr[0]));
@@ -1422,7 +2531,8 @@ LIQ_NONNULL static bool remap_to_palette_floyd(liq_image *input_image, unsigned
 
             const f_pixel spx = get_dithered_pixel(dither_level, max_dither_error, thiserr[col + 1], row_pixels[col]);
 
-            const unsigned int guessed_match = output_image_is_remapped ? output_pixels[row][col] : last_match;
+            // rows before the stripe's own may be getting written by another stripe, so they can't be used as a guess
+            const unsigned int guessed_match = output_image_is_remapped && row >= start_row ? output_pixels[row][col] : last_match;
             float dither_diff;
             last_match = nearest_search(n, &spx, guessed_match, &dither_diff);
             f_pixel output_px = acolormap[last_match].acolor;
@@ -1457,7 +2567,9 @@ LIQ_NONNULL static bool remap_to_palette_floyd(liq_image *input_image, unsigned
                 }
             }
 
-            output_pixels[row][col] = last_match;
+            if (row >= start_row) {
+                output_pixels[row][col] = last_match;
+            }
 
             f_pixel err = {
                 .r = (spx.r - output_px.r),
@@ -1519,27 +2631,299 @@ LIQ_NONNULL static bool remap_to_palette_floyd(liq_image *input_image, unsigned
                 nexterr[col + 2].b += err.b * (3.f/16.f);
             }
 
-            // remapping is done in zig-zag
-            col += fs_direction;
-            if (fs_direction > 0) {
-                if (col >= cols) break;
-            } else {
-                if (col < 0) break;
+            // remapping is done in zig-zag
+            col += fs_direction;
+            if (fs_direction > 0) {
+                if (col >= cols) break;
+            } else {
+                if (col < 0) break;
+            }
+        } while(1);
+
+        f_pixel *const temperr = thiserr;
+        thiserr = nexterr;
+        nexterr = temperr;
+        fs_direction = -fs_direction;
+    }
+    return true;
+}
+
+/* thresholds for ordered dithering, scaled to 0-255 */
+static const unsigned char liq_bayer_matrix[8][8] = {
+    {  0, 128,  32, 160,   8, 136,  40, 168},
+    {192,  64, 224,  96, 200,  72, 232, 104},
+    { 48, 176,  16, 144,  56, 184,  24, 152},
+    {240, 112, 208,  80, 248, 120, 216,  88},
+    { 12, 140,  44, 172,   4, 132,  36, 164},
+    {204,  76, 236, 108, 196,  68, 228, 100},
+    { 60, 188,  28, 156,  52, 180,  20, 148},
+    {252, 124, 220,  92, 244, 116, 212,  84}
+};
+
+/* 32x32 tile of blue noise made with the void-and-cluster method */
+static const unsigned char liq_blue_noise[32][32] = {
+    {196,  84,  17, 255,  74, 135, 191, 153,  12, 252,  39, 127,  14, 241,  57, 212, 155,  27, 222,  16, 240,  46, 152,  34,  94, 148, 108,  81, 215, 120, 237,  33},
+    {148, 232, 125, 202,  35, 225,  59, 113, 181,  97, 193, 211, 153,  75, 169, 135,  44, 110, 172,  83, 159, 101, 230, 123, 220,  51, 250, 157,  10, 177, 140,  68},
+    {  3, 174,  62, 106, 167,  93,  23, 233,  46, 135,  23,  62, 116,  36, 223,  86, 193, 238,  54, 204, 131,   5, 197,  23,  74, 186,  27,  70, 232,  49,  97, 210},
+    {113,  46, 216,  20, 141, 186, 210, 147,  76, 164, 227,  90, 244, 179,   2, 125,  20,  74, 142,  30, 247,  63, 169, 143, 235, 129, 171, 207, 116, 195,  22, 249},
+    {188,  92, 155, 245,  69,  43, 123,   0, 248, 105, 184,  12, 145, 204,  96, 251, 152, 219, 177, 117,  91, 214, 111,  47,  89,   1,  99,  41, 142,  85, 162, 130},
+    { 71, 225,   9, 118, 198, 235,  86, 174,  60,  33, 217,  56, 124,  39,  67, 167,  51, 101,  11, 230,  42, 185,  19, 252, 192, 218, 162, 246,  15, 215,  59,  31},
+    {201, 137,  40, 173,  99,  17, 158, 223, 194, 131, 152,  85, 170, 237, 110, 195,  29, 206, 134,  68, 161, 126,  79, 151,  66, 119,  53,  77, 188, 107, 240, 174},
+    {104, 251,  79, 209,  58, 139,  35, 111,  79,   8, 245, 187,  25, 212,   7, 132, 234,  83, 183, 244,  26, 203, 227,  10, 175,  29, 148, 224, 126,  35, 150,  12},
+    { 51, 163,  24, 128, 227, 189, 254,  55, 205, 119,  44, 102,  72, 141,  88, 160,  60, 115,   3, 143,  94,  56, 105, 133, 242, 207, 103,   6, 180,  64, 229,  85},
+    {144, 220, 183, 107,   7,  87, 167,  18, 147, 231, 161, 198, 226,  49, 255, 187,  36, 216, 170,  47, 213, 157, 182,  34,  87,  48, 190, 254,  91, 161, 204, 122},
+    {  1,  73,  42, 245, 159,  65, 124, 215,  96,  66,  22, 128,  10, 173, 103,  19, 124, 240,  70, 109, 252,  13,  69, 233, 166, 123,  73,  21, 137,  45,  24, 238},
+    {172, 211, 140,  94, 198,  45, 241, 175,  38, 183, 249,  86, 153, 217,  69, 201, 151,  92, 190,  28, 133, 195, 117, 205,   3, 146, 212, 172, 222, 116, 193,  97},
+    { 57, 114,  26, 221,  16, 149,  82,   2, 139, 115, 207,  30, 110,  42, 133, 229,  52,  15, 158, 227,  82,  44, 150,  90,  58, 247,  39,  99,  61, 243,  75, 148},
+    {253, 189,  80, 168, 121, 232, 108, 200, 228,  77,  52, 168, 196, 241,   0,  82, 183, 112, 211,  61, 173, 236,  17, 219, 109, 181, 126,   9, 159,  31, 180,  15},
+    { 37, 129, 229,  48,  68, 182,  32,  60, 158,  14, 244, 125,  63,  95, 177, 144, 247,  37, 139,   5, 124, 100, 191, 163,  24,  80, 231, 196, 218, 136, 108, 208},
+    {164, 101,   8, 140, 213,  96, 253, 129, 178,  98, 147,  22, 223, 155,  30, 119,  66, 219,  93, 200, 250,  33,  70, 135, 242,  43, 144,  65,  91,  47, 234,  78},
+    { 55, 194, 246, 175,  27, 154,   9, 220,  43, 194, 217,  84, 185,  49, 236, 203,  10, 156,  55, 166,  76, 151, 225,  54, 118, 202, 171,  21, 121, 192,   5, 144},
+    {231,  32,  90,  64, 118, 200,  71,  88, 114,  27,  65, 118,   7, 133, 102,  80, 187, 105, 226,  19, 115, 185,  12, 209,  85,   1, 104, 225, 154, 248, 173, 114},
+    {214, 131, 158, 222,  49, 240, 137, 167, 233, 143, 250, 164, 208, 229, 171,  35, 254, 130,  41, 198, 243,  50, 105, 168, 140, 254, 186,  57,  32,  84,  63,  20},
+    {181,  73,   4, 179, 102,  16, 185,  54,   3, 197,  47,  95,  25,  74,  56, 149,  18, 178,  70, 145,  88, 134,  28, 235,  63,  38, 130,  96, 210, 138, 199,  97},
+    { 46, 114, 255, 142, 212,  38, 123, 216, 106,  81, 179, 127, 156, 191, 241, 122, 213,  95, 235,  11, 170, 221, 190,  81, 153, 197,  17, 174, 239,  11, 160, 243},
+    {146, 201,  23,  58,  80, 163, 247,  71, 141, 224,  14, 236,  41, 109,   1,  77, 163,  53, 116, 202,  37,  61, 120,   8, 211, 110, 226,  72, 121,  54, 111,  28},
+    {169,  86, 233, 132, 195,  98,  19, 202,  34, 159,  62, 201,  87, 219, 141, 196,  21, 223, 149,  81, 252, 102, 162, 239,  53,  91, 145,  40, 166, 205,  83, 221},
+    {  9, 106, 177,  34, 226, 149,  52, 176, 120, 253, 100, 134,  22, 176,  59, 250, 104,  42, 184,   5, 137, 193,  26, 132, 176,  29, 251, 188,   4, 231, 134,  64},
+    {249,  48, 125,  75,   0, 112, 214,  92,   6, 189,  48, 154, 242, 119,  31,  82, 166, 127, 238,  65, 216,  45,  89, 205,  67, 218, 129,  78, 100, 154,  36, 186},
+    {206, 156, 218, 182, 238, 165,  64, 228, 136,  77, 208,  11,  75, 192, 143, 230, 203,  25,  93, 169, 108, 150, 246,   0, 157, 107,  18, 200,  58, 243, 120,  89},
+    {138,  67,  20,  98,  44, 130,  26, 184,  40, 239, 115, 175, 224,  41,  99,   4,  66, 156,  50, 222,  15, 180,  73, 117, 232,  50, 172, 139, 215,  25, 165,  13},
+    { 40, 112, 246, 146, 206,  83, 251, 103, 147, 165,  29,  62, 107, 160, 217, 178, 117, 248, 136, 189,  39, 128, 203,  31, 187,  95, 248,  38, 113,  76, 188, 236},
+    {204, 168, 192,  57,  16, 155, 194,  13,  60,  90, 213, 132, 249,  18,  56,  87, 209,  13, 103,  76, 239,  92,  55, 224, 145,  78,  14, 191, 152, 228,  52, 101},
+    { 72,   7,  88, 122, 234,  69, 111, 221, 178, 237,   2, 197,  78, 151, 234, 138,  37, 161, 230,  28, 207, 164, 136,  21, 170, 121, 214,  68,  98,   2, 128, 150},
+    {244, 220, 138,  36, 210, 171,  45, 127,  33, 142, 109,  50, 176,  32, 122, 199,  72, 182,  53, 146, 113,   8, 255, 106,  61, 237,  43, 160, 245, 180, 208,  24},
+    {112,  51, 181, 157, 100,   4, 242,  84, 206,  71, 162, 228,  93, 190, 104,   6, 253,  94, 126, 199,  67, 184,  79, 209, 179,   6, 199, 131,  30,  59,  89, 165}
+};
+
+/**
+ Ordered dithering: each pixel is either its nearest palette color, or the nearest color on the opposite side of it,
+ whichever a threshold map picks. The threshold is compared with the share of the second color that a mix of the two
+ would need to match the pixel, so over an area the colors average to the original. Every pixel is independent.
+ */
+LIQ_NONNULL static bool remap_to_palette_ordered(liq_image *input_image, unsigned char *const output_pixels[], liq_remapping_result *quant, const bool output_image_is_remapped)
+{
+    const int rows = input_image->height, cols = input_image->width;
+    const unsigned char *dither_map = quant->use_dither_map ? (input_image->dither_map ? input_image->dither_map : input_image->edges) : NULL;
+    const bool blue_noise = quant->dithering_algorithm == LIQ_DITHER_BLUE_NOISE;
+
+    const colormap *map = quant->palette;
+    const colormap_item *acolormap = map->palette;
+
+    if (!liq_image_get_row_f_init(input_image)) {
+        return false;
+    }
+    if (input_image->background && !liq_image_get_row_f_init(input_image->background)) {
+        return false;
+    }
+
+    struct nearest_map *const n = nearest_init(map, quant->nearest_strategy);
+    if (!n) {
+        return false;
+    }
+    liq_image *background = input_image->background;
+    const int transparent_index = background ? nearest_search(n, &(f_pixel){0,0,0,0}, 0, NULL) : -1;
+    if (background && acolormap[transparent_index].acolor.a > 1.f/256.f) {
+        // palette unsuitable for using the bg
+        background = NULL;
+    }
+
+    // same non-linear response as Floyd-Steinberg
+    float base_dithering_level = quant->dither_level;
+    base_dithering_level = 1.f - (1.f-base_dithering_level)*(1.f-base_dithering_level);
+    if (dither_map) {
+        base_dithering_level *= 1.f/255.f; // convert byte to float
+    }
+
+    int aborted = 0, rows_started = 0, rows_reported = 0;
+    const int progress_rows = MAX(1, rows / 100);
+
+    #pragma omp parallel for if (rows*cols > 3000) schedule(static)
+    for(int row = 0; row < rows; ++row) {
+        int row_aborted;
+        #pragma omp atomic read
+        row_aborted = aborted;
+        if (row_aborted) continue;
+
+        // rows are counted across threads, since each one only has a slice of the image
+        int started;
+        #pragma omp atomic capture
+        started = rows_started++;
+        if (started % progress_rows == 0) {
+            bool abort_remap = false;
+            #pragma omp critical (liq_remap_ordered_progress)
+            {
+                if (started >= rows_reported) {
+                    rows_reported = started;
+                    abort_remap = liq_remap_progress(quant, quant->progress_stage1 + started * (100.f - quant->progress_stage1) / rows);
+                }
+            }
+            if (abort_remap) {
+                #pragma omp atomic write
+                aborted = 1;
+                continue;
+            }
+        }
+
+        const f_pixel *const row_pixels = liq_image_get_row_f(input_image, row);
+        const f_pixel *const bg_pixels = background ? liq_image_get_row_f(background, row) : NULL;
+        unsigned int last_match = 0, last_other_match = 0;
+        for(int col = 0; col < cols; ++col) {
+            const f_pixel px = row_pixels[col];
+            const unsigned int guessed_match = output_image_is_remapped ? output_pixels[row][col] : last_match;
+            float diff;
+            unsigned int match = nearest_search(n, &px, guessed_match, &diff);
+
+            float dither_level = base_dithering_level;
+            if (dither_map) {
+                dither_level *= dither_map[row*cols + col];
+            }
+
+            // near is the nearest color, so the share of the other one can't be over 1/2, and the search can be skipped
+            const float threshold = ((blue_noise ? liq_blue_noise[row & 31][col & 31] : liq_bayer_matrix[row & 7][col & 7]) + 0.5f) * (1.f/256.f);
+            if (threshold < 0.5f * dither_level && diff > 1.f/(256.f*256.f)) {
+                const f_pixel near = acolormap[match].acolor;
+                const f_pixel opposite = {
+                    .a = px.a*2.f - near.a,
+                    .r = px.r*2.f - near.r,
+                    .g = px.g*2.f - near.g,
+                    .b = px.b*2.f - near.b,
+                };
+                const unsigned int other_match = last_other_match = nearest_search(n, &opposite, last_other_match, NULL);
+                if (other_match != match) {
+                    const f_pixel other = acolormap[other_match].acolor;
+                    const float da = other.a - near.a, dr = other.r - near.r, dg = other.g - near.g, db = other.b - near.b;
+                    const float share = ((px.a - near.a)*da + (px.r - near.r)*dr + (px.g - near.g)*dg + (px.b - near.b)*db) /
+                                        (da*da + dr*dr + dg*dg + db*db);
+                    if (threshold < share * dither_level) {
+                        match = other_match;
+                    }
+                }
+            }
+
+            // this is for animgifs: use the background where it's at least as good as the undithered color
+            if (bg_pixels && colordifference(px, bg_pixels[col]) <= diff) {
+                match = transparent_index;
+            }
+
+            output_pixels[row][col] = last_match = match;
+        }
+    }
+
+    nearest_free(n);
+
+    return !aborted;
+}
+
+/**
+ Dithers rows from start_row up to end_row in stripes that are dithered independently. Stripe boundaries are at
+ multiples of stripe_height, counted from row_origin rows above the image, so that bands of a larger image get the
+ same stripes as the whole image would.
+ */
+LIQ_NONNULL static bool remap_to_palette_floyd_rows(liq_image *input_image, unsigned char *const output_pixels[], liq_remapping_result *quant, const float max_dither_error, const bool output_image_is_remapped,
+    const int start_row, const int end_row, const int row_origin, const int stripe_height)
+{
+    const int cols = input_image->width;
+    const unsigned char *dither_map = quant->use_dither_map ? (input_image->dither_map ? input_image->dither_map : input_image->edges) : NULL;
+
+    const colormap *map = quant->palette;
+    const colormap_item *acolormap = map->palette;
+
+    if (!liq_image_get_row_f_init(input_image)) {
+        return false;
+    }
+    if (input_image->background && !liq_image_get_row_f_init(input_image->background)) {
+        return false;
+    }
+
+    const int first_stripe = (row_origin + start_row) / stripe_height;
+    const int stripes = (row_origin + end_row - 1) / stripe_height - first_stripe + 1;
+    const int threads = MIN(stripes, omp_get_max_threads());
+
+    /* Initialize Floyd-Steinberg error vectors. */
+    const size_t errwidth = cols+2;
+    f_pixel *restrict errors = input_image->malloc(errwidth * sizeof(errors[0]) * 2 * threads); // +2 saves from checking out of bounds access
+    if (!errors) return false;
+
+    struct nearest_map *const n = nearest_init(map, quant->nearest_strategy);
+    if (!n) {
+        input_image->free(errors);
+        return false;
+    }
+    liq_image *background = input_image->background;
+    const int transparent_index = background ? nearest_search(n, &(f_pixel){0,0,0,0}, 0, NULL) : -1;
+    if (background && acolormap[transparent_index].acolor.a > 1.f/256.f) {
+        // palette unsuitable for using the bg
+        background = NULL;
+    }
+
+    // response to this value is non-linear and without it any value < 0.8 would give almost no dithering
+    float base_dithering_level = quant->dither_level;
+    base_dithering_level = 1.f - (1.f-base_dithering_level)*(1.f-base_dithering_level);
+
+    if (dither_map) {
+        base_dithering_level *= 1.f/255.f; // convert byte to float
+    }
+    base_dithering_level *= 15.f/16.f; // prevent small errors from accumulating
+
+    bool ok = true;
+    if (stripes == 1) {
+        ok = remap_to_palette_floyd_stripe(input_image, output_pixels, quant, max_dither_error, output_image_is_remapped, dither_map, n, background, transparent_index, base_dithering_level,
+                                           MAX(0, start_row - LIQ_DITHER_STRIPE_OVERLAP), start_row, end_row, errors, true);
+    } else {
+        int aborted = 0, stripes_done = 0;
+
+        #pragma omp parallel for if (threads > 1) num_threads(threads) schedule(dynamic, 1)
+        for (int stripe = 0; stripe < stripes; stripe++) {
+            int stripe_aborted;
+            #pragma omp atomic read
+            stripe_aborted = aborted;
+            if (stripe_aborted) continue;
+
+            const int stripe_start = MAX(start_row, (first_stripe + stripe) * stripe_height - row_origin);
+            const int stripe_end = MIN(end_row, (first_stripe + stripe + 1) * stripe_height - row_origin);
+            const bool stripe_ok = remap_to_palette_floyd_stripe(input_image, output_pixels, quant, max_dither_error, output_image_is_remapped, dither_map, n, background, transparent_index, base_dithering_level,
+                                                                 MAX(0, stripe_start - LIQ_DITHER_STRIPE_OVERLAP), stripe_start, stripe_end,
+                                                                 errors + errwidth * 2 * omp_get_thread_num(), false);
+
+            #pragma omp critical (liq_remap_floyd_progress)
+            {
+                stripes_done++;
+                if (!stripe_ok || liq_remap_progress(quant, quant->progress_stage1 + stripes_done * (100.f - quant->progress_stage1) / stripes)) {
+                    aborted = 1;
+                }
             }
-        } while(1);
-
-        f_pixel *const temperr = thiserr;
-        thiserr = nexterr;
-        nexterr = temperr;
-        fs_direction = -fs_direction;
+        }
+        ok = !aborted;
     }
 
-    input_image->free(MIN(thiserr, nexterr)); // MIN because pointers were swapped
+    input_image->free(errors);
     nearest_free(n);
 
     return ok;
 }
 
+/**
+  Uses edge/noise map to apply dithering only to flat areas. Dithering on edges creates jagged lines, and noisy areas are "naturally" dithered.
+
+  If output_image_is_remapped is true, only pixels noticeably changed by error diffusion will be written to output image.
+ */
+LIQ_NONNULL static bool remap_to_palette_floyd(liq_image *input_image, unsigned char *const output_pixels[], liq_remapping_result *quant, const float max_dither_error, const bool output_image_is_remapped)
+{
+    const int rows = input_image->height;
+
+    // Error diffusion is serial, so parallel dithering splits the image into stripes that are dithered independently.
+    // Each stripe first dithers a few rows of the previous one, without writing them, to hide the seam.
+    // In deterministic mode the stripe height doesn't depend on the number of threads, so the output doesn't either.
+    int stripe_height = rows;
+    if (quant->parallel_dithering) {
+        const int max_threads = omp_get_max_threads();
+        stripe_height = quant->deterministic_dithering ? LIQ_DITHER_STRIPE_HEIGHT : MAX(LIQ_DITHER_STRIPE_HEIGHT, (rows + max_threads - 1) / max_threads);
+        stripe_height = MIN(rows, stripe_height);
+    }
+    return remap_to_palette_floyd_rows(input_image, output_pixels, quant, max_dither_error, output_image_is_remapped, 0, rows, 0, stripe_height);
+}
+
 /* fixed colors are always included in the palette, so it would be wasteful to duplicate them in palette from histogram */
 LIQ_NONNULL static void remove_fixed_colors_from_histogram(histogram *hist, const int fixed_colors_count, const f_pixel fixed_colors[], const float target_mse)
 {
@@ -1569,6 +2953,8 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_histogram_add_colors(liq_histogram *input_h
     }
     input_hist->ignorebits = 0;
 
+    const double start_ms = liq_time_ms();
+
     input_hist->had_image_added = true;
     input_hist->gamma = gamma ? gamma : 0.45455;
 
@@ -1604,6 +2990,7 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_histogram_add_colors(liq_histogram *input_h
         }
     }
 
+    input_hist->histogram_ms += liq_time_ms() - start_ms;
     return LIQ_OK;
 }
 
@@ -1613,11 +3000,31 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_histogram_add_image(liq_histogram *input_hi
     if (!CHECK_STRUCT_TYPE(input_hist, liq_histogram)) return LIQ_INVALID_POINTER;
     if (!CHECK_STRUCT_TYPE(input_image, liq_image)) return LIQ_INVALID_POINTER;
 
-    const unsigned int cols = input_image->width, rows = input_image->height;
-
+    const double start_ms = liq_time_ms();
+    double contrast_maps_ms = 0;
     if (!input_image->importance_map && options->use_contrast_maps) {
         contrast_maps(input_image);
+        contrast_maps_ms = liq_time_ms() - start_ms;
+        input_hist->contrast_maps_ms += contrast_maps_ms;
+    }
+
+    const liq_error err = histogram_add_image_colors(input_hist, options, input_image);
+    const double histogram_ms = liq_time_ms() - start_ms - contrast_maps_ms;
+    input_hist->histogram_ms += histogram_ms;
+
+    if (LIQ_OK == err) {
+        liq_event event = liq_event_init(LIQ_EVENT_HISTOGRAM, LIQ_SEVERITY_INFO, LIQ_TIMING_HISTOGRAM);
+        event.elapsed = histogram_ms / 1000.0;
+        event.colors = input_hist->acht->colors;
+        event.ignorebits = input_hist->ignorebits;
+        liq_attr_event(options, event);
     }
+    return err;
+}
+
+LIQ_NONNULL static liq_error histogram_add_image_colors(liq_histogram *input_hist, const liq_attr *options, liq_image *input_image)
+{
+    const unsigned int cols = input_image->width, rows = input_image->height;
 
     input_hist->gamma = input_image->gamma;
 
@@ -1663,6 +3070,9 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_histogram_add_image(liq_histogram *input_hi
             if (!added_ok) {
                 input_hist->ignorebits++;
                 liq_verbose_printf(options, "  too many colors! Scaling colors to improve clustering... %d", input_hist->ignorebits);
+                liq_event event = liq_event_init(LIQ_EVENT_HISTOGRAM_POSTERIZED, LIQ_SEVERITY_WARNING, LIQ_TIMING_HISTOGRAM);
+                event.ignorebits = input_hist->ignorebits;
+                liq_attr_event(options, event);
                 pam_freeacolorhash(input_hist->acht);
                 input_hist->acht = NULL;
                 if (liq_progress(options, options->progress_stage1 * 0.6f)) return LIQ_ABORTED;
@@ -1673,12 +3083,18 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_histogram_add_image(liq_histogram *input_hi
 
     input_hist->had_image_added = true;
 
-    liq_image_free_importance_map(input_image);
+    if (input_image->cache_mode != LIQ_CACHE_KEEP) {
+        liq_image_free_importance_map(input_image);
+    }
 
     if (input_image->free_pixels && input_image->f_pixels) {
         liq_image_free_rgba_source(input_image); // bow can free the RGBA source if copy has been made in f_pixels
     }
 
+    if (input_image->cache_mode == LIQ_CACHE_DISCARD) {
+        liq_image_release_cache(input_image);
+    }
+
     return LIQ_OK;
 }
 
@@ -1692,6 +3108,7 @@ LIQ_NONNULL static liq_error finalize_histogram(liq_histogram *input_hist, liq_a
         return LIQ_BITMAP_NOT_AVAILABLE;
     }
 
+    const double start_ms = liq_time_ms();
     histogram *hist = pam_acolorhashtoacolorhist(input_hist->acht, input_hist->gamma, options->malloc, options->free);
     pam_freeacolorhash(input_hist->acht);
     input_hist->acht = NULL;
@@ -1702,6 +3119,12 @@ LIQ_NONNULL static liq_error finalize_histogram(liq_histogram *input_hist, liq_a
     liq_verbose_printf(options, "  made histogram...%d colors found", hist->size);
     remove_fixed_colors_from_histogram(hist, input_hist->fixed_colors_count, input_hist->fixed_colors, options->target_mse);
 
+    liq_event event = liq_event_init(LIQ_EVENT_HISTOGRAM_FINALIZED, LIQ_SEVERITY_INFO, LIQ_TIMING_FINALIZE_HISTOGRAM);
+    event.elapsed = (liq_time_ms() - start_ms) / 1000.0;
+    event.colors = hist->size;
+    event.ignorebits = hist->ignorebits;
+    liq_attr_event(options, event);
+
     *hist_output = hist;
     return LIQ_OK;
 }
@@ -1711,34 +3134,30 @@ LIQ_NONNULL static liq_error finalize_histogram(liq_histogram *input_hist, liq_a
     importance_map - approximation of areas with high-frequency noise, except straight edges. 1=flat, 0=noisy.
     edges - noise map including all edges
  */
-LIQ_NONNULL static void contrast_maps(liq_image *image)
+static const f_pixel *contrast_maps_get_row(liq_image *image, unsigned int row, f_pixel *row_copies)
 {
-    const unsigned int cols = image->width, rows = image->height;
-    if (cols < 4 || rows < 4 || (3*cols*rows) > LIQ_HIGH_MEMORY_LIMIT) {
-        return;
+    const f_pixel *row_pixels = liq_image_get_row_f(image, row);
+    if (!row_copies) {
+        return row_pixels;
     }
+    f_pixel *copy = row_copies + (row % 3) * image->width;
+    memcpy(copy, row_pixels, image->width * sizeof(copy[0]));
+    return copy;
+}
 
-    unsigned char *restrict noise = image->importance_map ? image->importance_map : image->malloc(cols*rows);
-    image->importance_map = NULL;
-    unsigned char *restrict edges = image->edges ? image->edges : image->malloc(cols*rows);
-    image->edges = NULL;
-
-    unsigned char *restrict tmp = image->malloc(cols*rows);
-
-    if (!noise || !edges || !tmp || !liq_image_get_row_f_init(image)) {
-        image->free(noise);
-        image->free(edges);
-        image->free(tmp);
-        return;
-    }
+/** Computes both maps for rows from start_row up to end_row, before they're filtered */
+static void contrast_maps_band(liq_image *image, const unsigned int start_row, const unsigned int end_row, f_pixel *row_copies, unsigned char *restrict noise, unsigned char *restrict edges)
+{
+    const unsigned int cols = image->width, rows = image->height;
 
     const f_pixel *curr_row, *prev_row, *next_row;
-    curr_row = prev_row = next_row = liq_image_get_row_f(image, 0);
+    curr_row = next_row = contrast_maps_get_row(image, start_row, row_copies);
+    prev_row = contrast_maps_get_row(image, start_row > 0 ? start_row-1 : 0, row_copies);
 
-    for (unsigned int j=0; j < rows; j++) {
-        prev_row = curr_row;
+    for (unsigned int j=start_row; j < end_row; j++) {
+        prev_row = j > start_row ? curr_row : prev_row;
         curr_row = next_row;
-        next_row = liq_image_get_row_f(image, MIN(rows-1,j+1));
+        next_row = contrast_maps_get_row(image, MIN(rows-1,j+1), row_copies);
 
         f_pixel prev, curr = curr_row[0], next=curr;
         for (unsigned int i=0; i < cols; i++) {
@@ -1774,6 +3193,51 @@ LIQ_NONNULL static void contrast_maps(liq_image *image)
             edges[j*cols+i] = e_int > 0 ? MIN(e_int, 255) : 0;
         }
     }
+}
+
+LIQ_NONNULL static void contrast_maps(liq_image *image)
+{
+    const unsigned int cols = image->width, rows = image->height;
+    if (cols < 4 || rows < 4 || (3*cols*rows) > LIQ_HIGH_MEMORY_LIMIT) {
+        return;
+    }
+
+    if (image->borrowed_importance_map) {
+        liq_image_free_importance_map(image); // not ours to overwrite
+    }
+    unsigned char *restrict noise = image->importance_map ? image->importance_map : image->malloc(cols*rows);
+    image->importance_map = NULL;
+    unsigned char *restrict edges = image->edges ? image->edges : image->malloc(cols*rows);
+    image->edges = NULL;
+
+    unsigned char *restrict tmp = image->malloc(cols*rows);
+
+    if (!noise || !edges || !tmp || !liq_image_get_row_f_init(image)) {
+        image->free(noise);
+        image->free(edges);
+        image->free(tmp);
+        return;
+    }
+
+    // Rows are split into a band per thread. In low-memory mode every row is converted into the same temporary
+    // buffer of the thread, so the three rows a band is using need copies.
+    const int bands = MAX(1, MIN(omp_get_max_threads(), (int)(rows / LIQ_CONTRAST_MAPS_MIN_BAND_ROWS)));
+    f_pixel *row_copies = NULL;
+    if (!image->f_pixels) {
+        row_copies = image->malloc(3 * cols * sizeof(row_copies[0]) * bands);
+        if (!row_copies) {
+            image->free(noise);
+            image->free(edges);
+            image->free(tmp);
+            return;
+        }
+    }
+
+    #pragma omp parallel for if (bands > 1) num_threads(bands) schedule(static, 1)
+    for (int band=0; band < bands; band++) {
+        const unsigned int start_row = band * rows / bands, end_row = (band+1) * rows / bands;
+        contrast_maps_band(image, start_row, end_row, row_copies ? row_copies + 3 * cols * omp_get_thread_num() : NULL, noise, edges);
+    }
 
     // noise areas are shrunk and then expanded to remove thin edges from the map
     liq_max3(noise, tmp, cols, rows);
@@ -1789,11 +3253,14 @@ LIQ_NONNULL static void contrast_maps(liq_image *image)
 
     liq_min3(edges, tmp, cols, rows);
     liq_max3(tmp, edges, cols, rows);
-    for(unsigned int i=0; i < cols*rows; i++) edges[i] = MIN(noise[i], edges[i]);
+    #pragma omp parallel for if (rows*cols > 3000) schedule(static)
+    for(int i=0; i < (int)(cols*rows); i++) edges[i] = MIN(noise[i], edges[i]);
 
     image->free(tmp);
+    if (row_copies) image->free(row_copies);
 
     image->importance_map = noise;
+    image->user_importance_map = false;
     image->edges = edges;
 }
 
@@ -1808,9 +3275,18 @@ LIQ_NONNULL static void update_dither_map(liq_image *input_image, unsigned char
 {
     const unsigned int width = input_image->width;
     const unsigned int height = input_image->height;
-    unsigned char *const edges = input_image->edges;
+    unsigned char *edges = input_image->edges;
+
+    // edges don't depend on the palette, so when they're cached, the dither map is built in a copy
+    if (input_image->cache_mode == LIQ_CACHE_KEEP) {
+        edges = input_image->malloc(width * height);
+        if (!edges) return;
+        memcpy(edges, input_image->edges, width * height);
+    }
 
-    for(unsigned int row=0; row < height; row++) {
+    // each row only writes its own part of the map
+    #pragma omp parallel for if (width*height > 3000) schedule(static)
+    for(int row=0; row < (int)height; row++) {
         unsigned char lastpixel = row_pointers[row][0];
         unsigned int lastcol=0;
 
@@ -1830,7 +3306,7 @@ LIQ_NONNULL static void update_dither_map(liq_image *input_image, unsigned char
                         unsigned char pixelabove = row_pointers[row-1][i];
                         if (pixelabove == lastpixel) neighbor_count += 15;
                     }
-                    if (row < height-1) {
+                    if (row < (int)height-1) {
                         unsigned char pixelbelow = row_pointers[row+1][i];
                         if (pixelbelow == lastpixel) neighbor_count += 15;
                     }
@@ -1845,8 +3321,10 @@ LIQ_NONNULL static void update_dither_map(liq_image *input_image, unsigned char
             }
         }
     }
-    input_image->dither_map = input_image->edges;
-    input_image->edges = NULL;
+    input_image->dither_map = edges;
+    if (edges == input_image->edges) {
+        input_image->edges = NULL;
+    }
 }
 
 /**
@@ -1857,6 +3335,10 @@ static colormap *add_fixed_colors_to_palette(colormap *palette, const int max_co
     if (!fixed_colors_count) return palette;
 
     colormap *newpal = pam_colormap(MIN(max_colors, (palette ? palette->colors : 0) + fixed_colors_count), malloc, free);
+    if (!newpal) {
+        if (palette) pam_freecolormap(palette);
+        return NULL;
+    }
     unsigned int i=0;
     if (palette && fixed_colors_count < max_colors) {
         unsigned int palette_max = MIN(palette->colors, max_colors - fixed_colors_count);
@@ -1884,18 +3366,14 @@ LIQ_NONNULL static void adjust_histogram_callback(hist_item *item, float diff)
 
  feedback_loop_trials controls how long the search will take. < 0 skips the iteration.
  */
-static colormap *find_best_palette(histogram *hist, const liq_attr *options, const double max_mse, const f_pixel fixed_colors[], const unsigned int fixed_colors_count, double *palette_error_p)
+static colormap *find_best_palette(histogram *hist, const liq_attr *options, const double max_mse, const f_pixel fixed_colors[], const unsigned int fixed_colors_count, liq_quantization_stats *stats, double *palette_error_p)
 {
     unsigned int max_colors = options->max_colors;
 
     // if output is posterized it doesn't make sense to aim for perfrect colors, so increase target_mse
     // at this point actual gamma is not set, so very conservative posterization estimate is used
     const double target_mse = MIN(max_mse, MAX(options->target_mse, pow((1<<options->min_posterization_output)/1024.0, 2)));
-    int feedback_loop_trials = options->feedback_loop_trials;
-    if (hist->size > 5000) {feedback_loop_trials = (feedback_loop_trials*3 + 3)/4;}
-    if (hist->size > 25000) {feedback_loop_trials = (feedback_loop_trials*3 + 3)/4;}
-    if (hist->size > 50000) {feedback_loop_trials = (feedback_loop_trials*3 + 3)/4;}
-    if (hist->size > 100000) {feedback_loop_trials = (feedback_loop_trials*3 + 3)/4;}
+    int feedback_loop_trials = liq_scale_budget_for_histogram(options->feedback_loop_trials, hist->size);
     colormap *acolormap = NULL;
     double least_error = MAX_DIFF;
     double target_mse_overshoot = feedback_loop_trials>0 ? 1.05 : 1.0;
@@ -1903,8 +3381,12 @@ static colormap *find_best_palette(histogram *hist, const liq_attr *options, con
     int fails_in_a_row=0;
 
     do {
+        const double mediancut_start_ms = liq_time_ms();
         colormap *newmap;
-        if (hist->size && fixed_colors_count < max_colors) {
+        if (hist->size && fixed_colors_count < max_colors && options->palette_engine == LIQ_PALETTE_WU) {
+            newmap = wu_quantize(hist, max_colors-fixed_colors_count, target_mse * target_mse_overshoot, MAX(MAX(45.0/65536.0, target_mse), least_error)*1.2,
+                                 options->malloc, options->free);
+        } else if (hist->size && fixed_colors_count < max_colors) {
             newmap = mediancut(hist, max_colors-fixed_colors_count, target_mse * target_mse_overshoot, MAX(MAX(45.0/65536.0, target_mse), least_error)*1.2,
                                options->malloc, options->free);
         } else {
@@ -1912,6 +3394,8 @@ static colormap *find_best_palette(histogram *hist, const liq_attr *options, con
             newmap = NULL;
         }
         newmap = add_fixed_colors_to_palette(newmap, max_colors, fixed_colors, fixed_colors_count, options->malloc, options->free);
+        const double kmeans_start_ms = liq_time_ms();
+        stats->mediancut_ms += kmeans_start_ms - mediancut_start_ms;
         if (!newmap) {
             return NULL;
         }
@@ -1925,7 +3409,22 @@ static colormap *find_best_palette(histogram *hist, const liq_attr *options, con
         // and histogram weights are adjusted based on remapping error to give more weight to poorly matched colors
 
         const bool first_run_of_target_mse = !acolormap && target_mse > 0;
-        double total_error = kmeans_do_iteration(hist, newmap, first_run_of_target_mse ? NULL : adjust_histogram_callback);
+        double total_error = kmeans_do_iteration(hist, newmap, options->nearest_strategy, first_run_of_target_mse ? NULL : adjust_histogram_callback);
+        if (total_error < 0) {
+            pam_freecolormap(newmap);
+            if (acolormap) pam_freecolormap(acolormap);
+            return NULL;
+        }
+        const double trial_end_ms = liq_time_ms();
+        stats->feedback_loop_ms += trial_end_ms - kmeans_start_ms;
+        stats->feedback_trials++;
+
+        liq_event event = liq_event_init(LIQ_EVENT_FEEDBACK_TRIAL, LIQ_SEVERITY_DEBUG, LIQ_TIMING_FEEDBACK_LOOP);
+        event.elapsed = (trial_end_ms - mediancut_start_ms) / 1000.0;
+        event.mse = mse_to_standard_mse(total_error);
+        event.colors = newmap->colors;
+        event.iterations = stats->feedback_trials;
+        liq_attr_event(options, event);
 
         // goal is to increase quality or to reduce number of colors used if quality is good enough
         if (!acolormap || total_error < least_error || (total_error <= target_mse && newmap->colors < max_colors)) {
@@ -1970,6 +3469,9 @@ static colormap *histogram_to_palette(const histogram *hist, const liq_attr *opt
         return NULL;
     }
     colormap *acolormap = pam_colormap(hist->size, options->malloc, options->free);
+    if (!acolormap) {
+        return NULL;
+    }
     for(unsigned int i=0; i < hist->size; i++) {
         acolormap->palette[i].acolor = hist->achv[i].acolor;
         acolormap->palette[i].popularity = hist->achv[i].perceptual_weight;
@@ -1977,10 +3479,12 @@ static colormap *histogram_to_palette(const histogram *hist, const liq_attr *opt
     return acolormap;
 }
 
-LIQ_NONNULL static liq_error pngquant_quantize(histogram *hist, const liq_attr *options, const int fixed_colors_count, const f_pixel fixed_colors[], const double gamma, bool fixed_result_colors, liq_result **result_output)
+LIQ_NONNULL static liq_error pngquant_quantize(histogram *hist, const liq_attr *options, const int fixed_colors_count, const f_pixel fixed_colors[], const double gamma, bool fixed_result_colors, liq_quantization_stats *stats, liq_result **result_output)
 {
     colormap *acolormap;
     double palette_error = -1;
+    unsigned int kmeans_iterations_done = 0;
+    const double start_ms = liq_time_ms();
 
     assert((verbose_print(options, "SLOW debug checks enabled. Recompile with NDEBUG for normal operation."),1));
 
@@ -1992,10 +3496,13 @@ LIQ_NONNULL static liq_error pngquant_quantize(histogram *hist, const liq_attr *
     // then it's possible to skip quantization entirely
     if (few_input_colors && options->target_mse == 0) {
         acolormap = add_fixed_colors_to_palette(histogram_to_palette(hist, options), options->max_colors, fixed_colors, fixed_colors_count, options->malloc, options->free);
+        if (!acolormap) {
+            return LIQ_OUT_OF_MEMORY;
+        }
         palette_error = 0;
     } else {
         const double max_mse = options->max_mse * (few_input_colors ? 0.33 : 1.0); // when degrading image that's already paletted, require much higher improvement, since pal2pal often looks bad and there's little gain
-        acolormap = find_best_palette(hist, options, max_mse, fixed_colors, fixed_colors_count, &palette_error);
+        acolormap = find_best_palette(hist, options, max_mse, fixed_colors, fixed_colors_count, stats, &palette_error);
         if (!acolormap) {
             return LIQ_VALUE_OUT_OF_RANGE;
         }
@@ -2014,17 +3521,30 @@ LIQ_NONNULL static liq_error pngquant_quantize(histogram *hist, const liq_attr *
                 }
             }
 
-            if (hist->size > 5000) {iterations = (iterations*3 + 3)/4;}
-            if (hist->size > 25000) {iterations = (iterations*3 + 3)/4;}
-            if (hist->size > 50000) {iterations = (iterations*3 + 3)/4;}
-            if (hist->size > 100000) {iterations = (iterations*3 + 3)/4; iteration_limit *= 2;}
+            iterations = liq_scale_budget_for_histogram(iterations, hist->size);
+            if (hist->size > 100000) {iteration_limit *= 2;}
 
             verbose_print(options, "  moving colormap towards local minimum");
 
             double previous_palette_error = MAX_DIFF;
 
+            const double kmeans_start_ms = liq_time_ms();
             for(unsigned int i=0; i < iterations; i++) {
-                palette_error = kmeans_do_iteration(hist, acolormap, NULL);
+                const double iteration_start_ms = liq_time_ms();
+                palette_error = kmeans_do_iteration(hist, acolormap, options->nearest_strategy, NULL);
+                if (palette_error < 0) {
+                    pam_freecolormap(acolormap);
+                    return LIQ_OUT_OF_MEMORY;
+                }
+                stats->kmeans_iterations++;
+                kmeans_iterations_done++;
+
+                liq_event event = liq_event_init(LIQ_EVENT_KMEANS_ITERATION, LIQ_SEVERITY_DEBUG, LIQ_TIMING_KMEANS);
+                event.elapsed = (liq_time_ms() - iteration_start_ms) / 1000.0;
+                event.mse = mse_to_standard_mse(palette_error);
+                event.colors = acolormap->colors;
+                event.iterations = kmeans_iterations_done;
+                liq_attr_event(options, event);
 
                 if (liq_progress(options, options->progress_stage1 + options->progress_stage2 + (i * options->progress_stage3 * 0.9f) / iterations)) {
                     break;
@@ -2041,12 +3561,19 @@ LIQ_NONNULL static liq_error pngquant_quantize(histogram *hist, const liq_attr *
 
                 previous_palette_error = palette_error;
             }
+            stats->kmeans_ms += liq_time_ms() - kmeans_start_ms;
         }
 
         if (palette_error > max_mse) {
             liq_verbose_printf(options, "  image degradation MSE=%.3f (Q=%d) exceeded limit of %.3f (%d)",
                                mse_to_standard_mse(palette_error), mse_to_quality(palette_error),
                                mse_to_standard_mse(max_mse), mse_to_quality(max_mse));
+            liq_event event = liq_event_init(LIQ_EVENT_QUALITY_TOO_LOW, LIQ_SEVERITY_WARNING, -1);
+            event.elapsed = (liq_time_ms() - start_ms) / 1000.0;
+            event.mse = mse_to_standard_mse(palette_error);
+            event.colors = acolormap->colors;
+            event.iterations = kmeans_iterations_done;
+            liq_attr_event(options, event);
             pam_freecolormap(acolormap);
             return LIQ_QUALITY_TOO_LOW;
         }
@@ -2068,7 +3595,10 @@ LIQ_NONNULL static liq_error pngquant_quantize(histogram *hist, const liq_attr *
     }
 
     liq_result *result = options->malloc(sizeof(liq_result));
-    if (!result) return LIQ_OUT_OF_MEMORY;
+    if (!result) {
+        pam_freecolormap(acolormap);
+        return LIQ_OUT_OF_MEMORY;
+    }
     *result = (liq_result){
         .magic_header = liq_result_magic,
         .malloc = options->malloc,
@@ -2076,13 +3606,90 @@ LIQ_NONNULL static liq_error pngquant_quantize(histogram *hist, const liq_attr *
         .palette = acolormap,
         .palette_error = palette_error,
         .use_dither_map = options->use_dither_map,
+        .nearest_strategy = options->nearest_strategy,
+        .event_callback = options->event_callback,
+        .event_callback_user_info = options->event_callback_user_info,
         .gamma = gamma,
         .min_posterization_output = options->min_posterization_output,
+        .deterministic_dithering = true,
     };
+
+    liq_event event = liq_event_init(LIQ_EVENT_PALETTE, LIQ_SEVERITY_INFO, -1);
+    event.elapsed = (liq_time_ms() - start_ms) / 1000.0;
+    event.mse = palette_error >= 0 ? mse_to_standard_mse(palette_error) : -1;
+    event.colors = acolormap->colors;
+    event.iterations = kmeans_iterations_done;
+    liq_attr_event(options, event);
+
     *result_output = result;
     return LIQ_OK;
 }
 
+/**
+ Runs one trial of the palette size search. Feedback loop and K-Means state left in the histogram
+ by the previous trial is reset, so that each trial gives the same result as a fresh quantization.
+ */
+LIQ_NONNULL static liq_error pngquant_quantize_trial(histogram *hist, liq_attr *trial_options, const unsigned int max_colors, const int fixed_colors_count, const f_pixel fixed_colors[], const double gamma, bool fixed_result_colors, liq_quantization_stats *stats, liq_result **result_output)
+{
+    for(unsigned int i=0; i < hist->size; i++) {
+        hist->achv[i].adjusted_weight = hist->achv[i].perceptual_weight;
+        hist->achv[i].tmp.likely_colormap_index = 0;
+    }
+
+    trial_options->max_colors = max_colors;
+    liq_verbose_printf(trial_options, "  trying palette of %d colors", max_colors);
+    const double start_ms = liq_time_ms();
+    const liq_error err = pngquant_quantize(hist, trial_options, fixed_colors_count, fixed_colors, gamma, fixed_result_colors, stats, result_output);
+
+    liq_event event = liq_event_init(LIQ_EVENT_MIN_COLORS_TRIAL, LIQ_SEVERITY_DEBUG, -1);
+    event.elapsed = (liq_time_ms() - start_ms) / 1000.0;
+    event.colors = max_colors;
+    if (LIQ_OK == err && (*result_output)->palette_error >= 0) {
+        event.mse = mse_to_standard_mse((*result_output)->palette_error);
+    }
+    liq_attr_event(trial_options, event);
+    return err;
+}
+
+/**
+ Bisects the number of colors to find the smallest palette that still meets max_mse (the minimum quality).
+ The histogram is built once and shared by all trials, so only the palette search is repeated.
+ */
+LIQ_NONNULL static liq_error pngquant_quantize_min_colors(histogram *hist, const liq_attr *options, const int fixed_colors_count, const f_pixel fixed_colors[], const double gamma, bool fixed_result_colors, liq_quantization_stats *stats, liq_result **result_output)
+{
+    liq_attr trial_options = *options;
+
+    liq_result *best;
+    liq_error err = pngquant_quantize_trial(hist, &trial_options, options->max_colors, fixed_colors_count, fixed_colors, gamma, fixed_result_colors, stats, &best);
+    if (err != LIQ_OK) {
+        return err;
+    }
+
+    // mediancut may already stop short of max_colors once target_mse is reached
+    unsigned int hi = best->palette->colors;
+    unsigned int lo = MIN(hi, MAX(2, fixed_colors_count));
+
+    while (lo < hi) {
+        const unsigned int mid = (lo + hi) / 2;
+        liq_result *trial;
+        err = pngquant_quantize_trial(hist, &trial_options, mid, fixed_colors_count, fixed_colors, gamma, fixed_result_colors, stats, &trial);
+        if (err == LIQ_OK) {
+            liq_result_destroy(best);
+            best = trial;
+            hi = MIN(mid, best->palette->colors);
+        } else if (err == LIQ_QUALITY_TOO_LOW) {
+            lo = mid + 1;
+        } else {
+            liq_result_destroy(best);
+            return err;
+        }
+    }
+
+    liq_verbose_printf(options, "  smallest palette meeting quality target has %d colors", best->palette->colors);
+    *result_output = best;
+    return LIQ_OK;
+}
+
 LIQ_EXPORT LIQ_NONNULL liq_error liq_write_remapped_image(liq_result *result, liq_image *input_image, void *buffer, size_t buffer_size)
 {
     if (!CHECK_STRUCT_TYPE(result, liq_result)) {
@@ -2101,6 +3708,7 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_write_remapped_image(liq_result *result, li
     }
 
     unsigned char **rows = input_image->malloc(input_image->height * sizeof(unsigned char *));
+    if (!rows) return LIQ_OUT_OF_MEMORY;
     unsigned char *buffer_bytes = buffer;
     for(unsigned int i=0; i < input_image->height; i++) {
         rows[i] = &buffer_bytes[input_image->width * i];
@@ -2111,7 +3719,16 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_write_remapped_image(liq_result *result, li
     return err;
 }
 
-LIQ_EXPORT LIQ_NONNULL liq_error liq_write_remapped_image_rows(liq_result *quant, liq_image *input_image, unsigned char **row_pointers)
+LIQ_NONNULL static void liq_remap_event(const liq_remapping_result *result)
+{
+    liq_event event = liq_event_init(LIQ_EVENT_REMAP, LIQ_SEVERITY_INFO, LIQ_TIMING_REMAP);
+    event.elapsed = (result->remap_ms + result->dither_map_ms + result->dither_ms) / 1000.0;
+    event.mse = result->palette_error >= 0 ? mse_to_standard_mse(result->palette_error) : -1;
+    event.colors = result->palette->colors;
+    liq_emit_event(result->event_callback, result->event_callback_user_info, event);
+}
+
+LIQ_NONNULL static liq_error remap_image_rows(liq_result *quant, liq_image *input_image, unsigned char **row_pointers)
 {
     if (!CHECK_STRUCT_TYPE(quant, liq_result)) return LIQ_INVALID_POINTER;
     if (!CHECK_STRUCT_TYPE(input_image, liq_image)) return LIQ_INVALID_POINTER;
@@ -2125,9 +3742,16 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_write_remapped_image_rows(liq_result *quant
     liq_remapping_result *const result = quant->remapping = liq_remapping_result_create(quant);
     if (!result) return LIQ_OUT_OF_MEMORY;
 
+    // cached edges make it possible to build a dither map that matches this palette
+    if (input_image->cache_mode == LIQ_CACHE_KEEP && input_image->edges) {
+        liq_image_free_dither_map(input_image);
+    }
+
+    double start_ms = liq_time_ms();
     if (!input_image->edges && !input_image->dither_map && quant->use_dither_map) {
         contrast_maps(input_image);
     }
+    result->dither_map_ms = liq_time_ms() - start_ms;
 
     if (liq_remap_progress(result, result->progress_stage1 * 0.25f)) {
         return LIQ_ABORTED;
@@ -2140,16 +3764,28 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_write_remapped_image_rows(liq_result *quant
 
     float remapping_error = result->palette_error;
     if (result->dither_level == 0) {
+        start_ms = liq_time_ms();
         set_rounded_palette(&result->int_palette, result->palette, result->gamma, quant->min_posterization_output);
-        remapping_error = remap_to_palette(input_image, row_pointers, result->palette);
+        // int_palette is already final here, so refining the palette would be wasted work
+        remapping_error = remap_to_palette(input_image, row_pointers, result->palette, result->nearest_strategy, false);
+        result->remap_ms = liq_time_ms() - start_ms;
+        if (remapping_error < 0) {
+            return LIQ_OUT_OF_MEMORY;
+        }
     } else {
         const bool is_image_huge = (input_image->width * input_image->height) > 2000 * 2000;
         const bool allow_dither_map = result->use_dither_map == 2 || (!is_image_huge && result->use_dither_map);
         const bool generate_dither_map = allow_dither_map && (input_image->edges && !input_image->dither_map);
         if (generate_dither_map) {
             // If dithering (with dither map) is required, this image is used to find areas that require dithering
-            remapping_error = remap_to_palette(input_image, row_pointers, result->palette);
+            start_ms = liq_time_ms();
+            remapping_error = remap_to_palette(input_image, row_pointers, result->palette, result->nearest_strategy, !result->fast_remapping);
+            result->remap_ms = liq_time_ms() - start_ms;
+            if (remapping_error < 0) {
+                return LIQ_OUT_OF_MEMORY;
+            }
             update_dither_map(input_image, row_pointers, result->palette);
+            result->dither_map_ms += liq_time_ms() - start_ms - result->remap_ms;
         }
 
         if (liq_remap_progress(result, result->progress_stage1 * 0.5f)) {
@@ -2159,9 +3795,15 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_write_remapped_image_rows(liq_result *quant
         // remapping above was the last chance to do K-Means iteration, hence the final palette is set after remapping
         set_rounded_palette(&result->int_palette, result->palette, result->gamma, quant->min_posterization_output);
 
-        if (!remap_to_palette_floyd(input_image, row_pointers, result, MAX(remapping_error*2.4, 8.f/256.f), generate_dither_map)) {
+        start_ms = liq_time_ms();
+        if (result->dithering_algorithm != LIQ_DITHER_FLOYD_STEINBERG) {
+            if (!remap_to_palette_ordered(input_image, row_pointers, result, generate_dither_map)) {
+                return LIQ_ABORTED;
+            }
+        } else if (!remap_to_palette_floyd(input_image, row_pointers, result, MAX(remapping_error*2.4, 8.f/256.f), generate_dither_map)) {
             return LIQ_ABORTED;
         }
+        result->dither_ms = liq_time_ms() - start_ms;
     }
 
     // remapping error from dithered image is absurd, so always non-dithered value is used
@@ -2171,9 +3813,232 @@ LIQ_EXPORT LIQ_NONNULL liq_error liq_write_remapped_image_rows(liq_result *quant
         result->palette_error = remapping_error;
     }
 
+    liq_remap_event(result);
     return LIQ_OK;
 }
 
+LIQ_EXPORT LIQ_NONNULL liq_error liq_write_remapped_image_rows(liq_result *quant, liq_image *input_image, unsigned char **row_pointers)
+{
+    const liq_error err = remap_image_rows(quant, input_image, row_pointers);
+
+    if (err != LIQ_INVALID_POINTER && input_image->cache_mode == LIQ_CACHE_DISCARD) {
+        liq_image_release_cache(input_image);
+    }
+    return err;
+}
+
+struct liq_band_rows {
+    liq_image_get_rgba_row_callback *row_callback;
+    void *row_callback_user_info;
+    int first_row;
+};
+
+static void liq_band_row_callback(liq_color row_out[], int row, int width, void *user_info)
+{
+    const struct liq_band_rows *band_rows = user_info;
+    liq_executing_user_callback(band_rows->row_callback, row_out, band_rows->first_row + row, width, band_rows->row_callback_user_info);
+}
+
+/**
+ Makes a temporary image of rows from first_row up to end_row, which borrows pixels of the input image
+ */
+LIQ_NONNULL static bool liq_image_band_init(liq_image *band, struct liq_band_rows *band_rows, const liq_image *input_image, const int first_row, const int end_row)
+{
+    *band = (liq_image){
+        .magic_header = liq_image_magic,
+        .malloc = input_image->malloc,
+        .free = input_image->free,
+        .width = input_image->width,
+        .height = end_row - first_row,
+        .gamma = input_image->gamma,
+        .rows = input_image->rows ? input_image->rows + first_row : NULL,
+        .f_pixels = input_image->f_pixels ? input_image->f_pixels + (size_t)input_image->width * first_row : NULL,
+        .memory_mode = input_image->memory_mode,
+    };
+
+    if (!band->rows && !band->f_pixels) {
+        if (input_image->row_callback == liq_image_format_row_callback) {
+            // read the bitmap directly, so that 16-bit pixels keep their precision
+            band->format_pixels = input_image->format_pixels + input_image->format_row_stride * first_row;
+            band->format_row_stride = input_image->format_row_stride;
+            band->format = input_image->format;
+            band->row_callback = liq_image_format_row_callback;
+            band->row_callback_user_info = band;
+        } else {
+            *band_rows = (struct liq_band_rows){
+                .row_callback = input_image->row_callback,
+                .row_callback_user_info = input_image->row_callback_user_info,
+                .first_row = first_row,
+            };
+            band->row_callback = liq_band_row_callback;
+            band->row_callback_user_info = band_rows;
+        }
+        band->temp_row = band->malloc(sizeof(band->temp_row[0]) * LIQ_TEMP_ROW_WIDTH(band->width) * omp_get_max_threads());
+        if (!band->temp_row) return false;
+    }
+    return true;
+}
+
+LIQ_NONNULL static void liq_image_band_release(liq_image *band, const liq_image *input_image)
+{
+    liq_image_free_maps(band);
+    if (band->f_pixels && !input_image->f_pixels) {
+        band->free(band->f_pixels);
+    }
+    if (band->temp_row) {
+        band->free(band->temp_row);
+    }
+    if (band->temp_f_row) {
+        band->free(band->temp_f_row);
+    }
+}
+
+/*
+ Remaps rows from first_row up to end_row. The palette is never refined, and dithering and the dither map only
+ depend on nearby rows, so bands of an image can be remapped separately (e.g. in other processes) and joined.
+ Dithering is done in stripes that start at multiples of LIQ_DITHER_STRIPE_HEIGHT, so when bands start at such
+ rows too, the output is the same however the image is split.
+ */
+LIQ_NONNULL static liq_error remap_image_band(liq_result *quant, liq_image *input_image, const int first_row, const int end_row, unsigned char **row_pointers)
+{
+    if (!CHECK_STRUCT_TYPE(quant, liq_result)) return LIQ_INVALID_POINTER;
+    if (!CHECK_STRUCT_TYPE(input_image, liq_image)) return LIQ_INVALID_POINTER;
+    if (first_row < 0 || end_row <= first_row || end_row > (int)input_image->height) return LIQ_VALUE_OUT_OF_RANGE;
+    for(int i=0; i < end_row - first_row; i++) {
+        if (!CHECK_USER_POINTER(row_pointers+i) || !CHECK_USER_POINTER(row_pointers[i])) return LIQ_INVALID_POINTER;
+    }
+
+    if (quant->remapping) {
+        liq_remapping_result_destroy(quant->remapping);
+    }
+    liq_remapping_result *const result = quant->remapping = liq_remapping_result_create(quant);
+    if (!result) return LIQ_OUT_OF_MEMORY;
+
+    set_rounded_palette(&result->int_palette, result->palette, result->gamma, quant->min_posterization_output);
+
+    // Error diffusion needs rows above the band to warm up, and the maps need some more around them
+    const bool dithered = result->dither_level > 0;
+    int work_first_row = first_row, work_end_row = end_row;
+    if (dithered) {
+        work_first_row = MAX(0, first_row - LIQ_DITHER_STRIPE_OVERLAP - LIQ_REMAP_BAND_MAP_MARGIN) / LIQ_REMAP_BAND_ALIGNMENT * LIQ_REMAP_BAND_ALIGNMENT;
+        work_end_row = MIN((int)input_image->height, end_row + LIQ_REMAP_BAND_MAP_MARGIN);
+    }
+
+    liq_image band, background_band;
+    struct liq_band_rows band_rows, background_band_rows;
+    bool ok = liq_image_band_init(&band, &band_rows, input_image, work_first_row, work_end_row);
+    if (input_image->background) {
+        ok = liq_image_band_init(&background_band, &background_band_rows, input_image->background, work_first_row, work_end_row) && ok;
+        band.background = &background_band;
+    }
+
+    // rows of the band are written straight to the output, and the rows around it to a scratch buffer
+    const int work_rows = work_end_row - work_first_row;
+    unsigned char **work_row_pointers = input_image->malloc(work_rows * sizeof(work_row_pointers[0]));
+    unsigned char *margin_rows = input_image->malloc(MAX(1, work_rows - (end_row - first_row)) * input_image->width);
+    if (work_row_pointers && margin_rows) {
+        for(int i=0, margin_row=0; i < work_rows; i++) {
+            const int row = work_first_row + i;
+            work_row_pointers[i] = row >= first_row && row < end_row ? row_pointers[row - first_row] : &margin_rows[input_image->width * margin_row++];
+        }
+    } else {
+        ok = false;
+    }
+
+    liq_error err = ok ? LIQ_OK : LIQ_OUT_OF_MEMORY;
+    double start_ms = liq_time_ms();
+    if (ok && !dithered) {
+        if (remap_to_palette(&band, work_row_pointers, result->palette, result->nearest_strategy, false) < 0) {
+            err = LIQ_OUT_OF_MEMORY;
+        }
+        result->remap_ms = liq_time_ms() - start_ms;
+    } else if (ok) {
+        const bool is_image_huge = (input_image->width * input_image->height) > 2000 * 2000;
+        const bool allow_dither_map = result->use_dither_map == 2 || (!is_image_huge && result->use_dither_map);
+        if (allow_dither_map) {
+            contrast_maps(&band);
+        }
+        result->dither_map_ms = liq_time_ms() - start_ms;
+        const bool generate_dither_map = allow_dither_map && band.edges;
+        if (generate_dither_map) {
+            start_ms = liq_time_ms();
+            ok = remap_to_palette(&band, work_row_pointers, result->palette, result->nearest_strategy, false) >= 0;
+            result->remap_ms = liq_time_ms() - start_ms;
+            if (ok) update_dither_map(&band, work_row_pointers, result->palette);
+            result->dither_map_ms += liq_time_ms() - start_ms - result->remap_ms;
+        }
+        start_ms = liq_time_ms();
+
+        // the remapping error of the band isn't used, since it would make bands dithered differently
+        const float max_dither_error = MAX(result->palette_error*2.4, 8.f/256.f);
+        if (!ok) {
+            err = LIQ_OUT_OF_MEMORY;
+        } else if (result->dithering_algorithm != LIQ_DITHER_FLOYD_STEINBERG) {
+            ok = remap_to_palette_ordered(&band, work_row_pointers, result, generate_dither_map);
+        } else {
+            ok = remap_to_palette_floyd_rows(&band, work_row_pointers, result, max_dither_error, generate_dither_map,
+                                             first_row - work_first_row, end_row - work_first_row, work_first_row, LIQ_DITHER_STRIPE_HEIGHT);
+        }
+        if (!ok && err == LIQ_OK) {
+            err = LIQ_ABORTED;
+        }
+        result->dither_ms = liq_time_ms() - start_ms;
+    }
+
+    input_image->free(work_row_pointers);
+    input_image->free(margin_rows);
+    if (input_image->background) {
+        liq_image_band_release(&background_band, input_image->background);
+    }
+    liq_image_band_release(&band, input_image);
+    if (LIQ_OK == err) {
+        liq_remap_event(result);
+    }
+    return err;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_write_remapped_image_band_rows(liq_result *quant, liq_image *input_image, int first_row, int rows, unsigned char **row_pointers)
+{
+    const liq_error err = remap_image_band(quant, input_image, first_row, first_row + rows, row_pointers);
+
+    if (err != LIQ_INVALID_POINTER && input_image->cache_mode == LIQ_CACHE_DISCARD) {
+        liq_image_release_cache(input_image);
+    }
+    return err;
+}
+
+LIQ_EXPORT LIQ_NONNULL liq_error liq_write_remapped_image_band(liq_result *result, liq_image *input_image, int first_row, int rows, void *buffer, size_t buffer_size)
+{
+    if (!CHECK_STRUCT_TYPE(result, liq_result)) {
+        return LIQ_INVALID_POINTER;
+    }
+    if (!CHECK_STRUCT_TYPE(input_image, liq_image)) {
+        return LIQ_INVALID_POINTER;
+    }
+    if (!CHECK_USER_POINTER(buffer)) {
+        return LIQ_INVALID_POINTER;
+    }
+    if (rows <= 0) {
+        return LIQ_VALUE_OUT_OF_RANGE;
+    }
+
+    const size_t required_size = (size_t)input_image->width * (size_t)rows;
+    if (buffer_size < required_size) {
+        return LIQ_BUFFER_TOO_SMALL;
+    }
+
+    unsigned char **row_pointers = input_image->malloc(rows * sizeof(unsigned char *));
+    if (!row_pointers) return LIQ_OUT_OF_MEMORY;
+    unsigned char *buffer_bytes = buffer;
+    for(int i=0; i < rows; i++) {
+        row_pointers[i] = &buffer_bytes[input_image->width * i];
+    }
+
+    liq_error err = liq_write_remapped_image_band_rows(result, input_image, first_row, rows, row_pointers);
+    input_image->free(row_pointers);
+    return err;
+}
+
 LIQ_EXPORT int liq_version() {
     return LIQ_VERSION;
 }
@@ -66,6 +66,102 @@ enum liq_ownership {
     LIQ_COPY_PIXELS=16,
 };
 
+enum liq_cache_mode {
+    LIQ_CACHE_AUTO=0,
+    LIQ_CACHE_KEEP=1,
+    LIQ_CACHE_DISCARD=2,
+};
+
+enum liq_memory_mode {
+    LIQ_MEMORY_AUTO=0,
+    LIQ_MEMORY_LOW=1,
+    LIQ_MEMORY_FULL=2,
+};
+
+enum liq_dithering_algorithm {
+    LIQ_DITHER_FLOYD_STEINBERG=0,
+    LIQ_DITHER_BAYER=1,
+    LIQ_DITHER_BLUE_NOISE=2,
+};
+
+enum liq_dither_map_mode {
+    LIQ_DITHER_MAP_OFF=0,
+    LIQ_DITHER_MAP_AUTO=1,
+    LIQ_DITHER_MAP_ALWAYS=2,
+};
+
+enum liq_palette_engine {
+    LIQ_PALETTE_MEDIANCUT=0,
+    LIQ_PALETTE_WU=1,
+};
+
+enum liq_nearest_strategy {
+    LIQ_NEAREST_AUTO=0,
+    LIQ_NEAREST_VP_TREE=1,
+    LIQ_NEAREST_LINEAR=2,
+    LIQ_NEAREST_GRID=3,
+};
+
+enum liq_pixel_format {
+    LIQ_PIXEL_RGBA=0,
+    LIQ_PIXEL_RGB=1,
+    LIQ_PIXEL_RGBX=2,
+    LIQ_PIXEL_BGRA=3,
+    LIQ_PIXEL_ARGB=4,
+    LIQ_PIXEL_GRAY=5,
+    LIQ_PIXEL_RGBA_PREMULTIPLIED=6,
+    LIQ_PIXEL_RGBA16_LE=7,
+    LIQ_PIXEL_RGBA16_BE=8,
+};
+
+enum liq_timing {
+    LIQ_TIMING_HISTOGRAM=0,
+    LIQ_TIMING_CONTRAST_MAPS=1,
+    LIQ_TIMING_FINALIZE_HISTOGRAM=2,
+    LIQ_TIMING_MEDIANCUT=3,
+    LIQ_TIMING_FEEDBACK_LOOP=4,
+    LIQ_TIMING_KMEANS=5,
+    LIQ_TIMING_REMAP=6,
+    LIQ_TIMING_DITHER_MAP=7,
+    LIQ_TIMING_DITHER=8,
+};
+
+enum liq_counter {
+    LIQ_COUNTER_HISTOGRAM_SIZE=0,
+    LIQ_COUNTER_IGNOREBITS=1,
+    LIQ_COUNTER_FEEDBACK_TRIALS=2,
+    LIQ_COUNTER_KMEANS_ITERATIONS=3,
+};
+
+enum liq_event_type {
+    LIQ_EVENT_ERROR=0,
+    LIQ_EVENT_LOW_MEMORY=1,
+    LIQ_EVENT_HISTOGRAM=2,
+    LIQ_EVENT_HISTOGRAM_POSTERIZED=3,
+    LIQ_EVENT_HISTOGRAM_FINALIZED=4,
+    LIQ_EVENT_FEEDBACK_TRIAL=5,
+    LIQ_EVENT_KMEANS_ITERATION=6,
+    LIQ_EVENT_QUALITY_TOO_LOW=7,
+    LIQ_EVENT_PALETTE=8,
+    LIQ_EVENT_MIN_COLORS_TRIAL=9,
+    LIQ_EVENT_REMAP=10,
+};
+
+enum liq_event_severity {
+    LIQ_SEVERITY_DEBUG=0,
+    LIQ_SEVERITY_INFO=1,
+    LIQ_SEVERITY_WARNING=2,
+    LIQ_SEVERITY_ERROR=3,
+};
+
+// Fields that don't apply to an event's type are -1
+typedef struct liq_event {
+    int type, severity, stage; // enum liq_event_type, liq_event_severity and liq_timing
+    double time;               // seconds on a monotonic clock
+    double elapsed, mse;       // seconds taken by the step the event reports, and its MSE
+    int colors, iterations, ignorebits;
+} liq_event;
+
 typedef struct liq_histogram_entry {
     liq_color color;
     unsigned int count;
@@ -75,17 +171,38 @@ LIQ_EXPORT LIQ_USERESULT liq_attr* liq_attr_create(void);
 LIQ_EXPORT LIQ_USERESULT liq_attr* liq_attr_create_with_allocator(void* (*malloc)(size_t), void (*free)(void*));
 LIQ_EXPORT LIQ_USERESULT liq_attr* liq_attr_copy(const liq_attr *orig) LIQ_NONNULL;
 LIQ_EXPORT void liq_attr_destroy(liq_attr *attr) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT size_t liq_attr_get_memory_size(const liq_attr *attr) LIQ_NONNULL;
 
 LIQ_EXPORT LIQ_USERESULT liq_histogram* liq_histogram_create(const liq_attr* attr);
 LIQ_EXPORT liq_error liq_histogram_add_image(liq_histogram *hist, const liq_attr *attr, liq_image* image) LIQ_NONNULL;
 LIQ_EXPORT liq_error liq_histogram_add_colors(liq_histogram *hist, const liq_attr *attr, const liq_histogram_entry entries[], int num_entries, double gamma) LIQ_NONNULL;
 LIQ_EXPORT liq_error liq_histogram_add_fixed_color(liq_histogram *hist, liq_color color, double gamma) LIQ_NONNULL;
 LIQ_EXPORT void liq_histogram_destroy(liq_histogram *hist) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT size_t liq_histogram_get_memory_size(const liq_histogram *hist) LIQ_NONNULL;
 
 LIQ_EXPORT liq_error liq_set_max_colors(liq_attr* attr, int colors) LIQ_NONNULL;
 LIQ_EXPORT LIQ_USERESULT int liq_get_max_colors(const liq_attr* attr) LIQ_NONNULL;
 LIQ_EXPORT liq_error liq_set_speed(liq_attr* attr, int speed) LIQ_NONNULL;
 LIQ_EXPORT LIQ_USERESULT int liq_get_speed(const liq_attr* attr) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_set_kmeans_iterations(liq_attr* attr, int iterations) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_get_kmeans_iterations(const liq_attr* attr) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_set_kmeans_iteration_limit(liq_attr* attr, double limit) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT double liq_get_kmeans_iteration_limit(const liq_attr* attr) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_set_feedback_loop_trials(liq_attr* attr, int trials) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_get_feedback_loop_trials(const liq_attr* attr) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_set_use_dither_map(liq_attr* attr, enum liq_dither_map_mode mode) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_get_use_dither_map(const liq_attr* attr) LIQ_NONNULL;
+LIQ_EXPORT void liq_set_use_contrast_maps(liq_attr* attr, int enabled) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_get_use_contrast_maps(const liq_attr* attr) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_set_palette_engine(liq_attr* attr, enum liq_palette_engine engine) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_get_palette_engine(const liq_attr* attr) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_set_nearest_strategy(liq_attr* attr, enum liq_nearest_strategy strategy) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_get_nearest_strategy(const liq_attr* attr) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_set_proxy_downscale(liq_attr* attr, int factor) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_get_proxy_downscale(const liq_attr* attr) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_set_target_latency(liq_attr* attr, double milliseconds) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT double liq_get_target_latency(const liq_attr* attr) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_calibrate_latency(liq_attr* attr) LIQ_NONNULL;
 LIQ_EXPORT liq_error liq_set_min_opacity(liq_attr* attr, int min) LIQ_NONNULL;
 LIQ_EXPORT LIQ_USERESULT int liq_get_min_opacity(const liq_attr* attr) LIQ_NONNULL;
 LIQ_EXPORT liq_error liq_set_min_posterization(liq_attr* attr, int bits) LIQ_NONNULL;
@@ -94,12 +211,17 @@ LIQ_EXPORT liq_error liq_set_quality(liq_attr* attr, int minimum, int maximum) L
 LIQ_EXPORT LIQ_USERESULT int liq_get_min_quality(const liq_attr* attr) LIQ_NONNULL;
 LIQ_EXPORT LIQ_USERESULT int liq_get_max_quality(const liq_attr* attr) LIQ_NONNULL;
 LIQ_EXPORT void liq_set_last_index_transparent(liq_attr* attr, int is_last) LIQ_NONNULL;
+LIQ_EXPORT void liq_set_minimize_colors(liq_attr* attr, int enabled) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_get_minimize_colors(const liq_attr* attr) LIQ_NONNULL;
 
 typedef void liq_log_callback_function(const liq_attr*, const char *message, void* user_info);
 typedef void liq_log_flush_callback_function(const liq_attr*, void* user_info);
 LIQ_EXPORT void liq_set_log_callback(liq_attr*, liq_log_callback_function*, void* user_info);
 LIQ_EXPORT void liq_set_log_flush_callback(liq_attr*, liq_log_flush_callback_function*, void* user_info);
 
+typedef void liq_event_callback_function(const liq_event *event, void* user_info);
+LIQ_EXPORT void liq_set_event_callback(liq_attr*, liq_event_callback_function*, void* user_info);
+
 typedef int liq_progress_callback_function(float progress_percent, void* user_info);
 LIQ_EXPORT void liq_attr_set_progress_callback(liq_attr*, liq_progress_callback_function*, void* user_info);
 LIQ_EXPORT void liq_result_set_progress_callback(liq_result*, liq_progress_callback_function*, void* user_info);
@@ -107,14 +229,27 @@ LIQ_EXPORT void liq_result_set_progress_callback(liq_result*, liq_progress_callb
 // The rows and their data are not modified. The type of `rows` is non-const only due to a bug in C's typesystem design.
 LIQ_EXPORT LIQ_USERESULT liq_image *liq_image_create_rgba_rows(const liq_attr *attr, void *const rows[], int width, int height, double gamma) LIQ_NONNULL;
 LIQ_EXPORT LIQ_USERESULT liq_image *liq_image_create_rgba(const liq_attr *attr, const void *bitmap, int width, int height, double gamma) LIQ_NONNULL;
+// Rows are converted to RGBA as they're read. A row_stride of 0 means rows are packed. The bitmap must outlive the image.
+LIQ_EXPORT LIQ_USERESULT liq_image *liq_image_create_with_format(const liq_attr *attr, const void *bitmap, enum liq_pixel_format format, int width, int height, size_t row_stride, double gamma) LIQ_NONNULL;
 
 typedef void liq_image_get_rgba_row_callback(liq_color row_out[], int row, int width, void* user_info);
 LIQ_EXPORT LIQ_USERESULT liq_image *liq_image_create_custom(const liq_attr *attr, liq_image_get_rgba_row_callback *row_callback, void* user_info, int width, int height, double gamma);
 
 LIQ_EXPORT liq_error liq_image_set_memory_ownership(liq_image *image, int ownership_flags) LIQ_NONNULL;
 LIQ_EXPORT liq_error liq_image_set_background(liq_image *img, liq_image *background_image) LIQ_NONNULL;
+// With memory_handling 0 the map is borrowed, and must stay valid and unchanged until the image is destroyed
 LIQ_EXPORT liq_error liq_image_set_importance_map(liq_image *img, unsigned char buffer[], size_t buffer_size, enum liq_ownership memory_handling) LIQ_NONNULL;
 LIQ_EXPORT liq_error liq_image_add_fixed_color(liq_image *img, liq_color color) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_image_set_cache_mode(liq_image *img, enum liq_cache_mode mode) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_image_get_cache_mode(const liq_image *img) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT size_t liq_image_get_cache_size(const liq_image *img) LIQ_NONNULL;
+LIQ_EXPORT size_t liq_image_release_cache(liq_image *img) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_image_set_memory_mode(liq_image *img, enum liq_memory_mode mode) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_image_get_memory_mode(const liq_image *img) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_image_is_low_memory(const liq_image *img) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT size_t liq_image_estimate_quantize_memory(const liq_image *img, const liq_attr *attr) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT size_t liq_image_estimate_remap_memory(const liq_image *img, const liq_result *result) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT size_t liq_image_get_memory_size(const liq_image *img) LIQ_NONNULL;
 LIQ_EXPORT LIQ_USERESULT int liq_image_get_width(const liq_image *img) LIQ_NONNULL;
 LIQ_EXPORT LIQ_USERESULT int liq_image_get_height(const liq_image *img) LIQ_NONNULL;
 LIQ_EXPORT void liq_image_destroy(liq_image *img) LIQ_NONNULL;
@@ -123,6 +258,14 @@ LIQ_EXPORT LIQ_USERESULT liq_error liq_histogram_quantize(liq_histogram *const i
 LIQ_EXPORT LIQ_USERESULT liq_error liq_image_quantize(liq_image *const input_image, liq_attr *const options, liq_result **result_output) LIQ_NONNULL;
 
 LIQ_EXPORT liq_error liq_set_dithering_level(liq_result *res, float dither_level) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_set_fast_remapping(liq_result *res, int enabled) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_get_fast_remapping(const liq_result *res) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_set_dithering_algorithm(liq_result *res, enum liq_dithering_algorithm algorithm) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_get_dithering_algorithm(const liq_result *res) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_set_parallel_dithering(liq_result *res, int enabled) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_get_parallel_dithering(const liq_result *res) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_set_deterministic_dithering(liq_result *res, int enabled) LIQ_NONNULL;
+LIQ_EXPORT LIQ_USERESULT int liq_get_deterministic_dithering(const liq_result *res) LIQ_NONNULL;
 LIQ_EXPORT liq_error liq_set_output_gamma(liq_result* res, double gamma) LIQ_NONNULL;
 LIQ_EXPORT LIQ_USERESULT double liq_get_output_gamma(const liq_result *result) LIQ_NONNULL;
 
@@ -130,12 +273,17 @@ LIQ_EXPORT LIQ_USERESULT const liq_palette *liq_get_palette(liq_result *result)
 
 LIQ_EXPORT liq_error liq_write_remapped_image(liq_result *result, liq_image *input_image, void *buffer, size_t buffer_size) LIQ_NONNULL;
 LIQ_EXPORT liq_error liq_write_remapped_image_rows(liq_result *result, liq_image *input_image, unsigned char **row_pointers) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_write_remapped_image_band(liq_result *result, liq_image *input_image, int first_row, int rows, void *buffer, size_t buffer_size) LIQ_NONNULL;
+LIQ_EXPORT liq_error liq_write_remapped_image_band_rows(liq_result *result, liq_image *input_image, int first_row, int rows, unsigned char **row_pointers) LIQ_NONNULL;
 
 LIQ_EXPORT double liq_get_quantization_error(const liq_result *result) LIQ_NONNULL;
 LIQ_EXPORT int liq_get_quantization_quality(const liq_result *result) LIQ_NONNULL;
 LIQ_EXPORT double liq_get_remapping_error(const liq_result *result) LIQ_NONNULL;
 LIQ_EXPORT int liq_get_remapping_quality(const liq_result *result) LIQ_NONNULL;
+LIQ_EXPORT double liq_get_timing(const liq_result *result, enum liq_timing stage) LIQ_NONNULL;
+LIQ_EXPORT int liq_get_counter(const liq_result *result, enum liq_counter counter) LIQ_NONNULL;
 
+LIQ_EXPORT LIQ_USERESULT size_t liq_result_get_memory_size(const liq_result *result) LIQ_NONNULL;
 LIQ_EXPORT void liq_result_destroy(liq_result *) LIQ_NONNULL;
 
 LIQ_EXPORT int liq_version(void);
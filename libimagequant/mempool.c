@@ -33,8 +33,10 @@ LIQ_PRIVATE void* mempool_create(mempoolptr *mptr, const unsigned int size, unsi
     if (!max_size) max_size = (1<<17);
     max_size = size+ALIGN_MASK > max_size ? size+ALIGN_MASK : max_size;
 
-    *mptr = malloc(MEMPOOL_RESERVED + max_size);
-    if (!*mptr) return NULL;
+    // on failure the existing blocks stay in the pool, to be freed with it
+    mempoolptr new_block = malloc(MEMPOOL_RESERVED + max_size);
+    if (!new_block) return NULL;
+    *mptr = new_block;
     **mptr = (struct mempool){
         .malloc = malloc,
         .free = free,
@@ -60,6 +62,16 @@ LIQ_PRIVATE void* mempool_alloc(mempoolptr *mptr, const unsigned int size, const
     return mempool_create(mptr, size, max_size, (*mptr)->malloc, (*mptr)->free);
 }
 
+LIQ_PRIVATE size_t mempool_size(mempoolptr m)
+{
+    size_t size = 0;
+    while (m) {
+        size += m->size;
+        m = m->next;
+    }
+    return size;
+}
+
 LIQ_PRIVATE void mempool_destroy(mempoolptr m)
 {
     while (m) {
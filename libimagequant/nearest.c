@@ -38,9 +38,33 @@ typedef struct vp_node {
     unsigned short restcount;
 } vp_node;
 
+/*
+ Opaque pixels are looked up in a grid of cells. Each cell lists the colors that are nearest to at least one of its
+ pixels, or is marked as NEAREST_GRID_CROWDED if that would take too many, and then the tree is searched instead.
+ */
+#define NEAREST_GRID_BITS 4
+#define NEAREST_GRID_SIZE (1<<NEAREST_GRID_BITS)
+#define NEAREST_GRID_CELLS (NEAREST_GRID_SIZE*NEAREST_GRID_SIZE*NEAREST_GRID_SIZE)
+#define NEAREST_GRID_CANDIDATES 32
+#define NEAREST_GRID_CROWDED 255
+
+// Palettes up to this size are scanned, since a tree or grid doesn't skip enough colors to make up for its overhead.
+// Above the grid's limit, cells of typical images get too crowded for it to beat the tree.
+#define NEAREST_LINEAR_MAX_COLORS 16
+#define NEAREST_GRID_MAX_COLORS 128
+
+struct nearest_grid {
+    unsigned char count[NEAREST_GRID_CELLS];
+    unsigned char candidates[NEAREST_GRID_CELLS][NEAREST_GRID_CANDIDATES];
+};
+
 struct nearest_map {
     vp_node *root;
     const colormap_item *palette;
+    f_pixel *colors;
+    struct nearest_grid *grid;
+    unsigned int colors_count;
+    enum liq_nearest_strategy strategy;
     float nearest_other_color_dist[256];
     mempoolptr mempool;
 };
@@ -125,20 +149,143 @@ static vp_node *vp_create_node(mempoolptr *m, vp_sort_tmp indexes[], int num_ind
     return node;
 }
 
-LIQ_PRIVATE struct nearest_map *nearest_init(const colormap *map) {
-    mempoolptr m = NULL;
-    struct nearest_map *handle = mempool_create(&m, sizeof(handle[0]), sizeof(handle[0]) + sizeof(vp_node)*map->colors+16, map->malloc, map->free);
+/** Finds the nearest color by comparing with every color, starting from the best one known so far */
+static void linear_search(const f_pixel colors[], const unsigned char indexes[], const unsigned int count, const f_pixel *const needle, vp_search_tmp *const best_candidate) {
+    for(unsigned int i=0; i < count; i++) {
+        const unsigned int idx = indexes ? indexes[i] : i;
+        const float distance_squared = colordifference(colors[idx], *needle);
+        if (distance_squared < best_candidate->distance_squared && best_candidate->exclude != (int)idx) {
+            best_candidate->distance_squared = distance_squared;
+            best_candidate->idx = idx;
+        }
+    }
+    best_candidate->distance = sqrtf(best_candidate->distance_squared);
+}
+
+/*
+ Range of colordifference() for one channel, for pixels in the cell from lo to hi compared with a palette color.
+ Opaque pixels make the alpha term constant, so the channels are independent and both bounds are exact.
+ */
+static void grid_channel_bounds(const float lo, const float hi, const float color, const float alphas, float *min, float *max) {
+    const float min_at = MIN(hi, MAX(lo, color - alphas/2.f)); // colordifference_ch is smallest halfway between on black and on white
+    *min = colordifference_ch(min_at, color, alphas);
+    *max = MAX(colordifference_ch(lo, color, alphas), colordifference_ch(hi, color, alphas));
+}
+
+static struct nearest_grid *grid_create(mempoolptr *m, const f_pixel colors[], const unsigned int count, void* (*malloc)(size_t), void (*free)(void*)) {
+    // bounds only depend on the channel's row of cells, so they're computed once per row
+    float *const min_diff = malloc(sizeof(float) * 2 * 3 * NEAREST_GRID_SIZE * count);
+    if (!min_diff) {
+        return NULL;
+    }
+    float *const max_diff = min_diff + 3 * NEAREST_GRID_SIZE * count;
+    for(unsigned int i=0; i < count; i++) {
+        const float alphas = colors[i].a - 1.f;
+        const float channels[3] = {colors[i].r, colors[i].g, colors[i].b};
+        for(unsigned int ch=0; ch < 3; ch++) {
+            for(unsigned int c=0; c < NEAREST_GRID_SIZE; c++) {
+                const unsigned int row = (ch * NEAREST_GRID_SIZE + c) * count;
+                grid_channel_bounds(c / (float)NEAREST_GRID_SIZE, (c+1) / (float)NEAREST_GRID_SIZE, channels[ch], alphas, &min_diff[row + i], &max_diff[row + i]);
+            }
+        }
+    }
+
+    struct nearest_grid *grid = mempool_alloc(m, sizeof(grid[0]), 0);
+    for(unsigned int cell=0; cell < NEAREST_GRID_CELLS; cell++) {
+        const float *const min_r = &min_diff[(0 * NEAREST_GRID_SIZE + (cell >> (2*NEAREST_GRID_BITS))) * count];
+        const float *const min_g = &min_diff[(1 * NEAREST_GRID_SIZE + ((cell >> NEAREST_GRID_BITS) & (NEAREST_GRID_SIZE-1))) * count];
+        const float *const min_b = &min_diff[(2 * NEAREST_GRID_SIZE + (cell & (NEAREST_GRID_SIZE-1))) * count];
+        const float *const max_r = &max_diff[(0 * NEAREST_GRID_SIZE + (cell >> (2*NEAREST_GRID_BITS))) * count];
+        const float *const max_g = &max_diff[(1 * NEAREST_GRID_SIZE + ((cell >> NEAREST_GRID_BITS) & (NEAREST_GRID_SIZE-1))) * count];
+        const float *const max_b = &max_diff[(2 * NEAREST_GRID_SIZE + (cell & (NEAREST_GRID_SIZE-1))) * count];
+
+        // every pixel in the cell is at most this far from its nearest color
+        float farthest_nearest = MAX_DIFF;
+        for(unsigned int i=0; i < count; i++) {
+            farthest_nearest = MIN(farthest_nearest, max_r[i] + max_g[i] + max_b[i]);
+        }
+
+        unsigned int candidates = 0;
+        for(unsigned int i=0; i < count; i++) {
+            if (min_r[i] + min_g[i] + min_b[i] <= farthest_nearest) {
+                if (candidates >= NEAREST_GRID_CANDIDATES) {
+                    candidates = NEAREST_GRID_CROWDED;
+                    break;
+                }
+                grid->candidates[cell][candidates++] = i;
+            }
+        }
+        grid->count[cell] = candidates;
+    }
+
+    free(min_diff);
+    return grid;
+}
+
+/** Returns the grid cell of an opaque pixel, or -1 if the pixel isn't opaque or is out of gamut (e.g. after dithering) */
+inline static int grid_cell(const f_pixel *const px) {
+    if (px->a != 1.f) {
+        return -1;
+    }
+    const float channels[3] = {px->r, px->g, px->b};
+    int cell = 0;
+    for(unsigned int ch=0; ch < 3; ch++) {
+        if (!(channels[ch] >= 0.f && channels[ch] <= 1.f)) {
+            return -1;
+        }
+        cell = (cell << NEAREST_GRID_BITS) | MIN(NEAREST_GRID_SIZE-1, (int)(channels[ch] * NEAREST_GRID_SIZE));
+    }
+    return cell;
+}
+
+static enum liq_nearest_strategy nearest_pick_strategy(const unsigned int colors, const enum liq_nearest_strategy strategy) {
+    if (strategy != LIQ_NEAREST_AUTO) {
+        return strategy;
+    }
+    if (colors <= NEAREST_LINEAR_MAX_COLORS) {
+        return LIQ_NEAREST_LINEAR;
+    }
+    return colors <= NEAREST_GRID_MAX_COLORS ? LIQ_NEAREST_GRID : LIQ_NEAREST_VP_TREE;
+}
+
+LIQ_PRIVATE struct nearest_map *nearest_init(const colormap *map, const enum liq_nearest_strategy requested_strategy) {
+    const enum liq_nearest_strategy strategy = nearest_pick_strategy(map->colors, requested_strategy);
+    const bool needs_tree = strategy != LIQ_NEAREST_LINEAR;
+    const bool needs_grid = strategy == LIQ_NEAREST_GRID;
 
-    LIQ_ARRAY(vp_sort_tmp, indexes, map->colors);
+    mempoolptr m = NULL;
+    // room for every allocation below and its alignment, so that creating the pool is the only one that can fail
+    const unsigned int capacity = sizeof(struct nearest_map) + sizeof(f_pixel)*map->colors + (needs_tree ? sizeof(vp_node)*map->colors : 0) + (needs_grid ? sizeof(struct nearest_grid) : 0) + 16 * (2*map->colors + 4);
+    struct nearest_map *handle = mempool_create(&m, sizeof(handle[0]), capacity, map->malloc, map->free);
+    if (!handle) {
+        return NULL;
+    }
 
+    f_pixel *colors = mempool_alloc(&m, sizeof(colors[0]) * map->colors, 0);
     for(unsigned int i=0; i < map->colors; i++) {
-        indexes[i].idx = i;
+        colors[i] = map->palette[i].acolor;
     }
 
-    vp_node *root = vp_create_node(&m, indexes, map->colors, map->palette);
+    vp_node *root = NULL;
+    if (needs_tree) {
+        LIQ_ARRAY(vp_sort_tmp, indexes, map->colors);
+
+        for(unsigned int i=0; i < map->colors; i++) {
+            indexes[i].idx = i;
+        }
+
+        root = vp_create_node(&m, indexes, map->colors, map->palette);
+    }
+
+    struct nearest_grid *grid = needs_grid ? grid_create(&m, colors, map->colors, map->malloc, map->free) : NULL;
+
     *handle = (struct nearest_map){
         .root = root,
         .palette = map->palette,
+        .colors = colors,
+        .grid = grid,
+        .colors_count = map->colors,
+        .strategy = needs_grid && !grid ? LIQ_NEAREST_VP_TREE : strategy,
         .mempool = m,
     };
 
@@ -148,7 +295,11 @@ LIQ_PRIVATE struct nearest_map *nearest_init(const colormap *map) {
             .distance_squared = MAX_DIFF,
             .exclude = i,
         };
-        vp_search_node(root, &map->palette[i].acolor, &best);
+        if (root) {
+            vp_search_node(root, &map->palette[i].acolor, &best);
+        } else {
+            linear_search(colors, NULL, map->colors, &map->palette[i].acolor, &best);
+        }
         handle->nearest_other_color_dist[i] = best.distance * best.distance / 4.0; // half of squared distance
     }
 
@@ -217,7 +368,23 @@ LIQ_PRIVATE unsigned int nearest_search(const struct nearest_map *handle, const
         .idx = likely_colormap_index,
         .exclude = -1,
     };
-    vp_search_node(handle->root, px, &best_candidate);
+
+    switch (handle->strategy) {
+        case LIQ_NEAREST_LINEAR:
+            linear_search(handle->colors, NULL, handle->colors_count, px, &best_candidate);
+            break;
+        case LIQ_NEAREST_GRID: {
+            const int cell = grid_cell(px);
+            if (cell >= 0 && handle->grid->count[cell] != NEAREST_GRID_CROWDED) {
+                linear_search(handle->colors, handle->grid->candidates[cell], handle->grid->count[cell], px, &best_candidate);
+                break;
+            }
+        }
+        // fall through
+        default:
+            vp_search_node(handle->root, px, &best_candidate);
+    }
+
     if (diff) {
         *diff = best_candidate.distance * best_candidate.distance;
     }
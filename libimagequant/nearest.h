@@ -7,7 +7,8 @@
 #define NEAREST_H
 
 struct nearest_map;
-LIQ_PRIVATE struct nearest_map *nearest_init(const colormap *palette);
+// Returns NULL if out of memory
+LIQ_PRIVATE struct nearest_map *nearest_init(const colormap *palette, const enum liq_nearest_strategy strategy);
 LIQ_PRIVATE unsigned int nearest_search(const struct nearest_map *map, const f_pixel *px, const int palette_index_guess, float *diff);
 LIQ_PRIVATE void nearest_free(struct nearest_map *map);
 
@@ -113,6 +113,7 @@ LIQ_PRIVATE bool pam_add_to_hash(struct acolorhash_table *acht, unsigned int has
                             // estimate how many colors are going to be + headroom
                             const size_t mempool_size = ((acht->rows + rows-row) * 2 * acht->colors / (acht->rows + row + 1) + 1024) * sizeof(struct acolorhist_arr_item);
                             new_items = mempool_alloc(&acht->mempool, sizeof(struct acolorhist_arr_item)*capacity, mempool_size);
+                            if (!new_items) return false;
                         } else {
                             // freestack stores previously freed (reallocated) arrays that can be reused
                             // (all pesimistically assumed to be capacity = 8)
@@ -189,15 +190,19 @@ ALWAYS_INLINE static float pam_add_to_hist(const float *gamma_lut, hist_item *ac
 
 LIQ_PRIVATE histogram *pam_acolorhashtoacolorhist(const struct acolorhash_table *acht, const double gamma, void* (*malloc)(size_t), void (*free)(void*))
 {
+    if (!acht) return NULL;
     histogram *hist = malloc(sizeof(hist[0]));
-    if (!hist || !acht) return NULL;
+    if (!hist) return NULL;
     *hist = (histogram){
         .achv = malloc(MAX(1,acht->colors) * sizeof(hist->achv[0])),
         .size = acht->colors,
         .free = free,
         .ignorebits = acht->ignorebits,
     };
-    if (!hist->achv) return NULL;
+    if (!hist->achv) {
+        free(hist);
+        return NULL;
+    }
 
     float gamma_lut[256];
     to_f_set_gamma(gamma_lut, gamma);
@@ -268,6 +273,7 @@ LIQ_PRIVATE colormap *pam_colormap(unsigned int colors, void* (*malloc)(size_t),
 LIQ_PRIVATE colormap *pam_duplicate_colormap(colormap *map)
 {
     colormap *dupe = pam_colormap(map->colors, map->malloc, map->free);
+    if (!dupe) return NULL;
     for(unsigned int i=0; i < map->colors; i++) {
         dupe->palette[i] = map->palette[i];
     }
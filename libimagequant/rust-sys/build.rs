@@ -55,6 +55,7 @@ fn main() {
             .file("nearest.c")
             .file("kmeans.c")
             .file("mediancut.c")
+            .file("wu.c")
             .file("mempool.c")
             .file("pam.c")
             .file("blur.c");
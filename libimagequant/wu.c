@@ -0,0 +1,272 @@
+/*
+** Xiaolin Wu's variance minimization quantizer, extended to premultiplied RGBA.
+** See "Efficient Statistical Computations for Optimal Color Quantization", Graphics Gems II (1991).
+**
+** See COPYRIGHT file for license.
+*/
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "libimagequant.h"
+#include "pam.h"
+#include "mediancut.h"
+#include "wu.h"
+
+/*
+ Moments of the histogram are summed in a lattice of color cells. The sums are cumulative, so moments of any box
+ of cells can be read from its 16 corners. Opaque images don't need the alpha axis, so they get finer RGB cells.
+ */
+#define WU_DIMENSIONS 4
+#define WU_OPAQUE_RGB_BITS 5
+#define WU_RGB_BITS 4
+#define WU_ALPHA_BITS 4
+
+typedef struct {
+    double weight, a, r, g, b, squares;
+} wu_moments;
+
+struct wu_box {
+    unsigned char min[WU_DIMENSIONS], max[WU_DIMENSIONS]; // min is exclusive, max is inclusive
+    double variance;
+    bool splittable;
+};
+
+struct wu_lattice {
+    wu_moments *moments;
+    unsigned int size[WU_DIMENSIONS], stride[WU_DIMENSIONS];
+};
+
+ALWAYS_INLINE static unsigned int wu_cell_coordinate(float value, unsigned int cells);
+inline static unsigned int wu_cell_coordinate(float value, unsigned int cells)
+{
+    // cell 0 is left empty for the cumulative sums
+    const int coordinate = 1 + (int)(value * cells);
+    return MAX(1, MIN(coordinate, (int)cells));
+}
+
+static unsigned int wu_cell_index(const struct wu_lattice *lattice, const f_pixel px)
+{
+    const float channels[WU_DIMENSIONS] = {px.a, px.r, px.g, px.b};
+    unsigned int index = 0;
+    for(unsigned int d=0; d < WU_DIMENSIONS; d++) {
+        index += wu_cell_coordinate(channels[d], lattice->size[d]-1) * lattice->stride[d];
+    }
+    return index;
+}
+
+static void wu_moments_add(wu_moments *sum, const wu_moments *m, const double sign)
+{
+    sum->weight += sign * m->weight;
+    sum->a += sign * m->a;
+    sum->r += sign * m->r;
+    sum->g += sign * m->g;
+    sum->b += sign * m->b;
+    sum->squares += sign * m->squares;
+}
+
+/** Sum of the moments of all cells in the box */
+static wu_moments wu_volume(const struct wu_lattice *lattice, const struct wu_box *box)
+{
+    wu_moments sum = {0};
+    for(unsigned int corner=0; corner < (1<<WU_DIMENSIONS); corner++) {
+        unsigned int index = 0;
+        double sign = 1;
+        for(unsigned int d=0; d < WU_DIMENSIONS; d++) {
+            if (corner & (1<<d)) {
+                index += box->max[d] * lattice->stride[d];
+            } else {
+                index += box->min[d] * lattice->stride[d];
+                sign = -sign;
+            }
+        }
+        wu_moments_add(&sum, &lattice->moments[index], sign);
+    }
+    return sum;
+}
+
+static double wu_mean_squared(const wu_moments *m)
+{
+    return (m->a*m->a + m->r*m->r + m->g*m->g + m->b*m->b) / m->weight;
+}
+
+static double wu_variance(const struct wu_lattice *lattice, const struct wu_box *box)
+{
+    const wu_moments m = wu_volume(lattice, box);
+    return m.weight > 0 ? MAX(0, m.squares - wu_mean_squared(&m)) : 0;
+}
+
+/**
+ Finds the cut that leaves the least variance in the two halves of the box, i.e. maximizes the sum of their
+ squared means. Returns false if the box can't be split.
+ */
+static bool wu_best_cut(const struct wu_lattice *lattice, const struct wu_box *box, unsigned int *cut_dimension, unsigned int *cut_position)
+{
+    const wu_moments whole = wu_volume(lattice, box);
+    double best = -1;
+
+    for(unsigned int d=0; d < WU_DIMENSIONS; d++) {
+        struct wu_box half = *box;
+        for(unsigned int position = box->min[d]+1; position < box->max[d]; position++) {
+            half.max[d] = position;
+            const wu_moments lower = wu_volume(lattice, &half);
+            if (lower.weight <= 0) continue;
+
+            wu_moments upper = whole;
+            wu_moments_add(&upper, &lower, -1);
+            if (upper.weight <= 0) break;
+
+            const double score = wu_mean_squared(&lower) + wu_mean_squared(&upper);
+            if (score > best) {
+                best = score;
+                *cut_dimension = d;
+                *cut_position = position;
+            }
+        }
+    }
+    return best >= 0;
+}
+
+static bool wu_lattice_init(struct wu_lattice *lattice, const histogram *hist, void* (*malloc)(size_t))
+{
+    bool opaque = true;
+    for(unsigned int i=0; i < hist->size; i++) {
+        if (hist->achv[i].acolor.a < 1.f) {
+            opaque = false;
+            break;
+        }
+    }
+
+    const unsigned int rgb_cells = 1 << (opaque ? WU_OPAQUE_RGB_BITS : WU_RGB_BITS);
+    lattice->size[0] = 1 + (opaque ? 1 : 1 << WU_ALPHA_BITS);
+    lattice->size[1] = lattice->size[2] = lattice->size[3] = 1 + rgb_cells;
+
+    unsigned int cells = 1;
+    for(int d=WU_DIMENSIONS-1; d >= 0; d--) {
+        lattice->stride[d] = cells;
+        cells *= lattice->size[d];
+    }
+
+    lattice->moments = malloc(cells * sizeof(lattice->moments[0]));
+    if (!lattice->moments) return false;
+    memset(lattice->moments, 0, cells * sizeof(lattice->moments[0]));
+
+    for(unsigned int i=0; i < hist->size; i++) {
+        const f_pixel px = hist->achv[i].acolor;
+        const double weight = hist->achv[i].adjusted_weight;
+        wu_moments *const m = &lattice->moments[wu_cell_index(lattice, px)];
+        m->weight += weight;
+        m->a += px.a * weight;
+        m->r += px.r * weight;
+        m->g += px.g * weight;
+        m->b += px.b * weight;
+        m->squares += (px.a*px.a + px.r*px.r + px.g*px.g + px.b*px.b) * weight;
+    }
+
+    // turn the moments into sums over all cells with lower or equal coordinates
+    for(unsigned int d=0; d < WU_DIMENSIONS; d++) {
+        const unsigned int stride = lattice->stride[d], size = lattice->size[d];
+        for(unsigned int i=0; i < cells; i++) {
+            if ((i / stride) % size > 0) {
+                wu_moments_add(&lattice->moments[i], &lattice->moments[i - stride], 1);
+            }
+        }
+    }
+    return true;
+}
+
+LIQ_PRIVATE colormap *wu_quantize(histogram *hist, unsigned int newcolors, const double target_mse, const double max_mse, void* (*malloc)(size_t), void (*free)(void*))
+{
+    struct wu_lattice lattice;
+    if (!wu_lattice_init(&lattice, hist, malloc)) {
+        return NULL;
+    }
+
+    LIQ_ARRAY(struct wu_box, boxes, newcolors);
+    unsigned int box_count = 1;
+    boxes[0] = (struct wu_box){.min = {0}, .splittable = true};
+    for(unsigned int d=0; d < WU_DIMENSIONS; d++) {
+        boxes[0].max[d] = lattice.size[d]-1;
+    }
+    boxes[0].variance = wu_variance(&lattice, &boxes[0]);
+
+    const double total_weight = wu_volume(&lattice, &boxes[0]).weight;
+    double total_variance = boxes[0].variance;
+    bool target_reached = total_weight <= 0 || total_variance / total_weight <= target_mse;
+
+    while (box_count < newcolors && !target_reached) {
+        // the box with the most variance is split next
+        int bi = -1;
+        for(unsigned int i=0; i < box_count; i++) {
+            if (boxes[i].splittable && boxes[i].variance > 0 && (bi < 0 || boxes[i].variance > boxes[bi].variance)) bi = i;
+        }
+        if (bi < 0) {
+            break;
+        }
+
+        unsigned int dimension = 0, position = 0;
+        if (!wu_best_cut(&lattice, &boxes[bi], &dimension, &position)) {
+            boxes[bi].splittable = false; // all of its colors are in one cell
+            continue;
+        }
+
+        struct wu_box *const lower = &boxes[bi], *const upper = &boxes[box_count++];
+        *upper = *lower;
+        lower->max[dimension] = position;
+        upper->min[dimension] = position;
+
+        total_variance -= lower->variance;
+        lower->variance = wu_variance(&lattice, lower);
+        upper->variance = wu_variance(&lattice, upper);
+        total_variance += lower->variance + upper->variance;
+
+        target_reached = total_variance / total_weight <= target_mse;
+    }
+
+    // colors spread along a thin line (e.g. an alpha gradient) fill too few cells for the palette
+    if (box_count < newcolors && !target_reached && box_count < hist->size) {
+        free(lattice.moments);
+        return mediancut(hist, newcolors, target_mse, max_mse, malloc, free);
+    }
+
+    colormap *map = pam_colormap(box_count, malloc, free);
+    if (!map) {
+        free(lattice.moments);
+        return NULL;
+    }
+
+    for(unsigned int bi=0; bi < box_count; bi++) {
+        const wu_moments m = wu_volume(&lattice, &boxes[bi]);
+        if (m.weight > 0) {
+            map->palette[bi].acolor = (f_pixel){
+                .a = m.a / m.weight,
+                .r = m.r / m.weight,
+                .g = m.g / m.weight,
+                .b = m.b / m.weight,
+            };
+        }
+    }
+
+    // moments aren't needed any more, so the lattice is reused to find which box each color ended up in
+    unsigned char *const cell_box = (unsigned char *)lattice.moments;
+    for(unsigned int bi=0; bi < box_count; bi++) {
+        const struct wu_box *const box = &boxes[bi];
+        for(unsigned int a = box->min[0]+1; a <= box->max[0]; a++) {
+            for(unsigned int r = box->min[1]+1; r <= box->max[1]; r++) {
+                for(unsigned int g = box->min[2]+1; g <= box->max[2]; g++) {
+                    const unsigned int row = a*lattice.stride[0] + r*lattice.stride[1] + g*lattice.stride[2];
+                    memset(&cell_box[row + box->min[3]+1], bi, box->max[3] - box->min[3]);
+                }
+            }
+        }
+    }
+
+    for(unsigned int i=0; i < hist->size; i++) {
+        const unsigned int bi = cell_box[wu_cell_index(&lattice, hist->achv[i].acolor)];
+        hist->achv[i].tmp.likely_colormap_index = bi;
+        map->palette[bi].popularity += hist->achv[i].perceptual_weight;
+    }
+
+    free(lattice.moments);
+    return map;
+}
@@ -0,0 +1,6 @@
+#ifndef WU_H
+#define WU_H
+
+LIQ_PRIVATE colormap *wu_quantize(histogram *hist, unsigned int newcolors, const double target_mse, const double max_mse, void* (*malloc)(size_t), void (*free)(void*));
+
+#endif
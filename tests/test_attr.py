@@ -1,3 +1,7 @@
+import gc
+import struct
+import weakref
+
 import libimagequant as liq
 import pytest
 
@@ -21,6 +25,107 @@ def test_attr_copy():
     assert attr2.min_quality == 55
 
 
+def test_attr_create_with_format():
+    """
+    Test Attr.create_with_format()
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+    attr = liq.Attr()
+
+    def quantize(image):
+        result = image.quantize(attr)
+        result.dithering_level = 1.0
+        return result.get_palette(), result.remap_image(image)
+
+    # The test image is opaque, so every format holds all of it
+    assert set(input_pixels[3::4]) == {255}
+    r, g, b, a = (input_pixels[i::4] for i in range(4))
+    formats = {
+        liq.PixelFormat.RGBA: input_pixels,
+        liq.PixelFormat.RGB: bytes(c for pixel in zip(r, g, b) for c in pixel),
+        liq.PixelFormat.RGBX: bytes(c for pixel in zip(r, g, b, b) for c in pixel),
+        liq.PixelFormat.BGRA: bytes(c for pixel in zip(b, g, r, a) for c in pixel),
+        liq.PixelFormat.ARGB: bytes(c for pixel in zip(a, r, g, b) for c in pixel),
+        liq.PixelFormat.RGBA_PREMULTIPLIED: input_pixels,
+    }
+    expected = quantize(attr.create_rgba(input_pixels, width, height, 0))
+    for pixel_format, pixels in formats.items():
+        assert quantize(attr.create_with_format(pixels, pixel_format, width, height, 0)) == expected
+
+    gray = bytes(g)
+    gray_rgba = bytes(c for v in gray for c in (v, v, v, 255))
+    assert (quantize(attr.create_with_format(gray, liq.PixelFormat.GRAY, width, height, 0))
+        == quantize(attr.create_rgba(gray_rgba, width, height, 0)))
+
+    # Padded rows
+    padded = b''.join(input_pixels[y * width * 4 : (y + 1) * width * 4] + bytes(12) for y in range(height))
+    image = attr.create_with_format(padded, liq.PixelFormat.RGBA, width, height, 0, row_stride=width * 4 + 12)
+    assert quantize(image) == expected
+
+    # Premultiplied colors are divided by alpha
+    pixels = bytes([64, 32, 0, 128]) * 16 + bytes(4) * 16
+    palette = attr.create_with_format(pixels, liq.PixelFormat.RGBA_PREMULTIPLIED, 8, 4, 0).quantize(attr).get_palette()
+    assert liq.Color(128, 64, 0, 128) in palette
+    assert sorted(color.a for color in palette) == [0, 128]
+
+    # The owner of the memory is kept alive until the image is closed
+    class Owner:
+        pass
+    owner = Owner()
+    owner_ref = weakref.ref(owner)
+    image = attr.create_with_format(input_pixels, liq.PixelFormat.RGBA, width, height, 0, owner=owner)
+    del owner
+    gc.collect()
+    assert owner_ref() is not None
+    assert quantize(image) == expected
+    image.close()
+    gc.collect()
+    assert owner_ref() is None
+
+    with pytest.raises(liq.BufferTooSmallError):
+        attr.create_with_format(bytes(width * 3 * height - 1), liq.PixelFormat.RGB, width, height, 0)
+    with pytest.raises(liq.BufferTooSmallError):
+        attr.create_with_format(padded, liq.PixelFormat.RGBA, width, height, 0, row_stride=width * 4 + 13)
+
+
+def test_attr_create_with_format_16bit():
+    """
+    Test Attr.create_with_format() with 16-bit pixels
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+    attr = liq.Attr()
+
+    def quantize(image):
+        result = image.quantize(attr)
+        result.dithering_level = 1.0
+        return result.get_palette(), result.remap_image(image)
+
+    # 8-bit values scaled to 16 bits give the same results
+    expected = quantize(attr.create_rgba(input_pixels, width, height, 0))
+    for pixel_format, order in [(liq.PixelFormat.RGBA16_LE, '<'), (liq.PixelFormat.RGBA16_BE, '>')]:
+        pixels = struct.pack(order + '%dH' % len(input_pixels), *(value * 257 for value in input_pixels))
+        assert quantize(attr.create_with_format(pixels, pixel_format, width, height, 0)) == expected
+
+    # Dithering a gray between two 8-bit ones with black and white uses a
+    # share of white pixels between theirs, since the pixels aren't rounded
+    # to 8 bits
+    width = height = 128
+    attr.max_colors = 2
+    attr.dither_map = liq.DitherMapMode.OFF
+
+    def white_pixels(image):
+        image.add_fixed_color(liq.Color(0, 0, 0, 255))
+        image.add_fixed_color(liq.Color(255, 255, 255, 255))
+        palette, output = quantize(image)
+        return sum(palette[index].r == 255 for index in output)
+
+    gray_128 = white_pixels(attr.create_rgba(bytes([128, 128, 128, 255]) * (width * height), width, height, 0))
+    gray_129 = white_pixels(attr.create_rgba(bytes([129, 129, 129, 255]) * (width * height), width, height, 0))
+    value = 128 * 257 + 128
+    pixels = struct.pack('<4H', value, value, value, 65535) * (width * height)
+    assert gray_128 < white_pixels(attr.create_with_format(pixels, liq.PixelFormat.RGBA16_LE, width, height, 0)) < gray_129
+
+
 def test_attr_max_colors():
     """
     Test Attr.max_colors
@@ -66,6 +171,261 @@ def test_attr_speed():
         attr_callback=attr_callback)))
 
 
+def test_attr_kmeans_iterations():
+    """
+    Test Attr.kmeans_iterations and Attr.kmeans_iteration_limit
+    """
+
+    def attr_callback(value, attr):
+        # Speed presets
+        assert attr.kmeans_iterations == 12
+        assert attr.kmeans_iteration_limit == 2 ** -19
+        attr.speed = 1
+        assert attr.kmeans_iterations == 31
+        assert attr.kmeans_iteration_limit == 2 ** -22
+
+        # Test both the getter and setter methods
+        attr.kmeans_iterations = value
+        assert attr.kmeans_iterations == value
+        attr.kmeans_iteration_limit = 0
+        assert attr.kmeans_iteration_limit == 0
+
+        # Test bounds checking
+        with pytest.raises(ValueError):
+            attr.kmeans_iterations = -1
+        with pytest.raises(ValueError):
+            attr.kmeans_iteration_limit = -1
+
+    utils.check_outputs_unique(utils.get_output_datas(utils.try_multiple_values(
+        'flower',
+        [0, 2, 20],
+        attr_callback=attr_callback)))
+
+
+def test_attr_feedback_loop_trials():
+    """
+    Test Attr.feedback_loop_trials
+    """
+
+    def attr_callback(value, attr):
+        # Speed presets
+        assert attr.feedback_loop_trials == 20
+        attr.speed = 7
+        assert attr.feedback_loop_trials == 0
+
+        # Test both the getter and setter methods
+        attr.feedback_loop_trials = value
+        assert attr.feedback_loop_trials == value
+
+        # Test bounds checking
+        with pytest.raises(ValueError):
+            attr.feedback_loop_trials = -1
+
+    utils.check_outputs_unique(utils.get_output_datas(utils.try_multiple_values(
+        'flower',
+        [0, 5, 50],
+        attr_callback=attr_callback)))
+
+
+def test_attr_dither_map():
+    """
+    Test Attr.dither_map
+    """
+
+    def attr_callback(value, attr):
+        # Speed presets
+        assert attr.dither_map == liq.DitherMapMode.AUTO
+        attr.speed = 1
+        assert attr.dither_map == liq.DitherMapMode.ALWAYS
+        attr.speed = 10
+        assert attr.dither_map == liq.DitherMapMode.OFF
+
+        # Test both the getter and setter methods
+        attr.dither_map = value
+        assert attr.dither_map == value
+
+        # Test bounds checking
+        with pytest.raises(ValueError):
+            attr.dither_map = 3
+
+    def result_callback(value, result):
+        result.dithering_level = 1.0
+
+    # ALWAYS only differs from AUTO for images over 4 megapixels
+    utils.check_outputs_unique(utils.get_output_datas(utils.try_multiple_values(
+        'flower',
+        [liq.DitherMapMode.OFF, liq.DitherMapMode.AUTO],
+        attr_callback=attr_callback,
+        result_callback=result_callback)))
+
+
+def test_attr_contrast_maps():
+    """
+    Test Attr.contrast_maps
+    """
+
+    def attr_callback(value, attr):
+        # Speed presets
+        assert attr.contrast_maps is True
+        attr.speed = 10
+        assert attr.contrast_maps is False
+
+        # Test both the getter and setter methods
+        attr.contrast_maps = value
+        assert attr.contrast_maps is value
+
+    utils.check_outputs_unique(utils.get_output_datas(utils.try_multiple_values(
+        'flower',
+        [False, True],
+        attr_callback=attr_callback)))
+
+
+def test_attr_palette_engine():
+    """
+    Test Attr.palette_engine
+    """
+
+    def attr_callback(value, attr):
+        # Test both the getter and setter methods
+        assert attr.palette_engine == liq.PaletteEngine.MEDIANCUT
+        attr.palette_engine = value
+        assert attr.palette_engine == value
+
+        # Test bounds checking
+        with pytest.raises(ValueError):
+            attr.palette_engine = 2
+
+    for img in ['flower', 'alpha-gradient']:
+        results = utils.try_multiple_values(
+            img,
+            list(liq.PaletteEngine),
+            attr_callback=attr_callback)
+        outputs = utils.get_output_datas(results)
+
+        if img == 'flower':
+            utils.check_outputs_unique(outputs)
+        else:
+            # Wu's lattice is too coarse for a gradient, so it falls back
+            # to mediancut
+            assert outputs[0] == outputs[1]
+
+        for _, _, result, _ in results:
+            assert len(result.get_palette()) > 200
+
+
+def test_attr_nearest_strategy():
+    """
+    Test Attr.nearest_strategy
+    """
+
+    def attr_callback(value, attr):
+        # Test both the getter and setter methods
+        assert attr.nearest_strategy == liq.NearestStrategy.AUTO
+        attr.nearest_strategy = value[0]
+        assert attr.nearest_strategy == value[0]
+
+        # Test bounds checking
+        with pytest.raises(ValueError):
+            attr.nearest_strategy = 4
+
+        attr.max_colors = value[1]
+
+    def result_callback(value, result):
+        result.dithering_level = 1.0
+
+    # All strategies find the nearest color, so only the speed differs.
+    # (Colors exactly as near as each other may be picked differently,
+    # but these images don't have any.)
+    for colors in [8, 64, 256]:
+        results = utils.try_multiple_values(
+            'flower',
+            [(strategy, colors) for strategy in liq.NearestStrategy],
+            attr_callback=attr_callback,
+            result_callback=result_callback)
+        outputs = utils.get_output_datas(results)
+
+        for output in outputs[1:]:
+            assert output == outputs[0]
+
+
+def test_attr_proxy_downscale():
+    """
+    Test Attr.proxy_downscale
+    """
+
+    def attr_callback(value, attr):
+        # Test both the getter and setter methods
+        assert attr.proxy_downscale == 1
+        attr.proxy_downscale = value
+        assert attr.proxy_downscale == value
+
+        # Test bounds checking
+        with pytest.raises(ValueError):
+            attr.proxy_downscale = 0
+        with pytest.raises(ValueError):
+            attr.proxy_downscale = 17
+
+    def result_callback(value, result):
+        result.dithering_level = 0
+
+    results = utils.try_multiple_values(
+        'flower',
+        [1, 2, 4, 16],
+        attr_callback=attr_callback,
+        result_callback=result_callback)
+    outputs = utils.get_output_datas(results)
+    utils.check_outputs_unique(outputs)
+
+    # The full image is remapped, and its error is measured then, since the
+    # smaller copy's error would be an underestimate
+    width, height, _ = utils.load_test_image('flower')
+    errors = [result.remapping_error for _, _, result, _ in results]
+    for output in outputs:
+        assert len(output) == width * height
+    for (_, _, result, _), error in zip(results[1:], errors[1:]):
+        assert result.quantization_error == -1
+        assert error > 0
+
+    # A palette from a moderately smaller copy is only a little worse
+    assert errors[1] < errors[0] * 1.5
+    assert errors[2] < errors[0] * 1.5
+
+
+def test_attr_target_latency():
+    """
+    Test Attr.target_latency and Attr.calibrate_latency()
+    """
+
+    def attr_callback(value, attr):
+        # Test both the getter and setter methods
+        assert attr.target_latency == 0
+        attr.target_latency = value
+        assert attr.target_latency == value
+
+        # Test bounds checking
+        with pytest.raises(ValueError):
+            attr.target_latency = -1
+
+        attr.calibrate_latency()
+
+    # A generous target doesn't lower any budgets, and an impossible one
+    # lowers all of them as far as speed 10 does
+    outputs = utils.get_output_datas(utils.try_multiple_values(
+        'flower',
+        [0, 1000000, 0.001],
+        attr_callback=attr_callback))
+    assert outputs[0] == outputs[1]
+    assert outputs[2] != outputs[0]
+
+    def speed_10_callback(value, attr):
+        attr.speed = 10
+
+    assert outputs[2] == utils.get_output_datas(utils.try_multiple_values(
+        'flower',
+        [10],
+        attr_callback=speed_10_callback))[0]
+
+
 @pytest.mark.skipif(liq.LIQ_VERSION >= 21300, reason='min_opacity was replaced with a stub in liq 2.13.0')
 def test_attr_min_opacity():
     """
@@ -210,6 +570,259 @@ def test_attr_last_index_transparent():
     assert palettes[1][-1].a == 0
 
 
+def test_attr_minimize_colors():
+    """
+    Test Attr.minimize_colors
+    """
+
+    def attr_callback(value, attr):
+        # Test both the getter and setter methods
+        assert attr.minimize_colors is False
+        attr.minimize_colors = True
+        assert attr.minimize_colors is True
+
+        attr.min_quality = value
+
+    tuples = utils.try_multiple_values(
+        'flower',
+        [50, 70],
+        attr_callback=attr_callback)
+    palette_sizes = [len(r.get_palette()) for (a, ii, r, e) in tuples]
+
+    # Both palettes should be smaller than the maximum, and the higher
+    # quality target should need more colors
+    assert palette_sizes[0] < palette_sizes[1] < 256
+    for (a, ii, r, e), quality in zip(tuples, [50, 70]):
+        assert r.quantization_quality >= quality
+
+    # One color fewer than the search result should no longer meet the
+    # quality target
+    def attr_callback_2(value, attr):
+        attr.min_quality = 70
+        attr.max_colors = value
+
+    with pytest.raises(liq.QualityTooLowError):
+        utils.try_multiple_values(
+            'flower',
+            [palette_sizes[1] - 1],
+            attr_callback=attr_callback_2)
+
+
+def test_attr_memory_tracker():
+    """
+    Test Attr(memory_tracker=...), Attr.memory_tracker and MemoryTracker
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+
+    tracker = liq.MemoryTracker()
+    attr = liq.Attr(memory_tracker=tracker)
+    assert attr.memory_tracker is tracker
+    assert attr.copy().memory_tracker is tracker
+    assert liq.Attr().memory_tracker is None
+
+    image = attr.create_rgba(input_pixels, width, height, 0)
+    assert tracker.current_bytes > 0
+
+    tracker.reset()
+    assert tracker.allocations == tracker.frees == 0
+    assert tracker.peak_bytes == tracker.current_bytes
+    result = image.quantize(attr)
+    assert tracker.allocations > tracker.frees > 0
+    assert tracker.peak_bytes > tracker.current_bytes
+    assert 0 < tracker.largest_allocation <= tracker.peak_bytes
+
+    # Allocating through the tracker shouldn't change the output
+    untracked_attr = liq.Attr()
+    untracked_result = untracked_attr.create_rgba(input_pixels, width, height, 0).quantize(untracked_attr)
+    assert result.remap_image(image) == untracked_result.remap_image(image)
+
+    # Everything is given back once the objects are destroyed
+    del attr, image, result
+    gc.collect()
+    assert tracker.current_bytes == 0
+
+    # Test the limit
+    tracker = liq.MemoryTracker(limit=width * height)
+    assert tracker.limit == width * height
+    attr = liq.Attr(memory_tracker=tracker)
+    image = attr.create_rgba(input_pixels, width, height, 0)
+    with pytest.raises(MemoryError):
+        image.quantize(attr)
+    assert tracker.failed_allocations > 0
+    assert tracker.peak_bytes <= tracker.limit
+
+    with pytest.raises(MemoryError):
+        liq.Attr(memory_tracker=liq.MemoryTracker(limit=1))
+
+    # Whichever allocation fails, it's reported as a MemoryError, and
+    # nothing is leaked
+    def quantize_and_remap(tracker):
+        attr = liq.Attr(memory_tracker=tracker)
+        image = attr.create_rgba(input_pixels, width, height, 0)
+        result = image.quantize(attr)
+        result.dithering_level = 1.0
+        result.remap_image(image)
+
+    peak = None
+    for step in range(21):
+        tracker = liq.MemoryTracker()
+        if peak is not None:
+            tracker.limit = peak * step // 20
+        try:
+            quantize_and_remap(tracker)
+        except MemoryError:
+            assert tracker.failed_allocations > 0
+        gc.collect()
+        assert tracker.current_bytes == 0
+        if peak is None:
+            peak = tracker.peak_bytes
+
+    with pytest.raises(ValueError):
+        tracker.limit = -1
+
+
+def test_attr_memory_pool():
+    """
+    Test Attr(memory_pool=...), Attr.memory_pool and MemoryPool
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+
+    pool = liq.MemoryPool()
+    tracker = liq.MemoryTracker()
+
+    def quantize_and_remap():
+        attr = liq.Attr(memory_tracker=tracker, memory_pool=pool)
+        assert attr.memory_pool is pool
+        assert attr.copy().memory_pool is pool
+
+        image = attr.create_rgba(input_pixels, width, height, 0)
+        result = image.quantize(attr)
+        result.dithering_level = 1.0
+        output = result.remap_image(image)
+        del attr, image, result
+        gc.collect()
+        return output
+
+    first = quantize_and_remap()
+    assert pool.misses > 0
+    assert pool.cached_bytes > 0
+    assert tracker.current_bytes == 0
+
+    # The second run should reuse the blocks freed by the first one,
+    # without changing the output
+    hits = pool.hits
+    assert quantize_and_remap() == first
+    assert pool.hits > hits
+
+    pool.reset()
+    assert pool.cached_bytes == pool.hits == pool.misses == 0
+
+    # Nothing is kept if there's no room in the cache
+    pool.max_cached_bytes = 0
+    assert pool.max_cached_bytes == 0
+    quantize_and_remap()
+    assert pool.cached_bytes == pool.hits == 0
+
+    with pytest.raises(ValueError):
+        pool.max_cached_bytes = -1
+
+
+def test_attr_close():
+    """
+    Test Attr.close(), Attr.closed and using an Attr as a context manager
+    """
+    tracker = liq.MemoryTracker()
+    with liq.Attr(memory_tracker=tracker) as attr:
+        copy = attr.copy()
+        assert not attr.closed
+        before = tracker.current_bytes
+    assert attr.closed
+    assert tracker.current_bytes < before
+    assert attr.close() == 0
+
+    with pytest.raises(ValueError):
+        attr.max_colors
+    with pytest.raises(ValueError):
+        attr.copy()
+
+    # Copies are independent
+    copy.max_colors = 16
+    before = tracker.current_bytes
+    assert copy.close() == before - tracker.current_bytes > 0
+
+
+def test_attr_event_log():
+    """
+    Test Attr(event_log=...), Attr.event_log and EventLog
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+
+    log = liq.EventLog()
+    attr = liq.Attr(event_log=log)
+    assert attr.event_log is log
+    assert attr.copy().event_log is log
+    assert liq.Attr().event_log is None
+    assert log.capacity == 4096
+    assert log.min_severity == liq.EventSeverity.DEBUG
+
+    image = attr.create_rgba(input_pixels, width, height, 0)
+    result = image.quantize(attr)
+    del attr
+    # The Result keeps the log alive for the remapping's events
+    result.remap_image(image)
+
+    assert log.pending > 0
+    events = log.drain()
+    assert log.pending == 0
+    assert log.drain() == []
+    assert log.dropped == 0
+
+    types = [e.type for e in events]
+    assert types[0] == liq.EventType.HISTOGRAM
+    assert types[-2:] == [liq.EventType.PALETTE, liq.EventType.REMAP]
+    assert liq.EventType.FEEDBACK_TRIAL in types
+    assert liq.EventType.KMEANS_ITERATION in types
+    assert [e.time for e in events] == sorted(e.time for e in events)
+
+    palette_event, remap_event = events[-2:]
+    assert palette_event.severity == liq.EventSeverity.INFO
+    assert palette_event.stage is None
+    assert palette_event.colors == len(result.get_palette())
+    assert palette_event.mse == pytest.approx(result.quantization_error)
+    assert palette_event.iterations == result.counters['kmeans_iterations']
+    assert remap_event.stage == 'remap'
+    assert remap_event.elapsed > 0
+    assert remap_event.ignorebits is None
+
+    trials = [e for e in events if e.type == liq.EventType.FEEDBACK_TRIAL]
+    assert [e.iterations for e in trials] == list(range(1, len(trials) + 1))
+    assert all(e.severity == liq.EventSeverity.DEBUG and e.mse > 0 for e in trials)
+
+    # Events below the minimum severity aren't kept, and those that don't
+    # fit are counted as dropped
+    log = liq.EventLog(capacity=2, min_severity=liq.EventSeverity.INFO)
+    attr = liq.Attr(event_log=log)
+    attr.create_rgba(input_pixels, width, height, 0).quantize(attr)
+    attr.create_rgba(input_pixels, width, height, 0).quantize(attr)
+    events = log.drain()
+    assert [e.type for e in events] == [liq.EventType.HISTOGRAM, liq.EventType.HISTOGRAM_FINALIZED]
+    assert log.dropped == 4
+
+    log = liq.EventLog(min_severity=liq.EventSeverity.WARNING)
+    attr = liq.Attr(event_log=log)
+    attr.max_colors = 2
+    attr.min_quality = 90
+    with pytest.raises(liq.QualityTooLowError):
+        attr.create_rgba(input_pixels, width, height, 0).quantize(attr)
+    [event] = log.drain()
+    assert event.type == liq.EventType.QUALITY_TOO_LOW
+    assert event.severity == liq.EventSeverity.WARNING
+    assert event.colors == 2
+
+    with pytest.raises(ValueError):
+        liq.EventLog(capacity=-1)
+
+
 def test_attr_set_log_callback():
     """
     Test Attr.set_log_callback()
@@ -339,5 +952,51 @@ def test_attr_set_progress_callback_abort():
             attr_callback=attr_callback)
 
 
+def test_attr_progress():
+    """
+    Test Attr(progress=...), Attr.progress and Progress
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+
+    progress = liq.Progress()
+    assert progress.percent == 0
+    assert progress.stage == liq.ProgressStage.IDLE
+    assert not progress.aborted
+
+    attr = liq.Attr(progress=progress)
+    assert attr.progress is progress
+    assert attr.copy().progress is progress
+    assert liq.Attr().progress is None
+
+    image = attr.create_rgba(input_pixels, width, height, 0)
+    result = image.quantize(attr)
+    assert progress.stage == liq.ProgressStage.QUANTIZE
+    assert 50 < progress.percent <= 100
+
+    # Results made from the Attr report their remapping to the same object
+    result.dithering_level = 1.0
+    result.remap_image(image)
+    assert progress.stage == liq.ProgressStage.REMAP
+    assert 50 < progress.percent <= 100
+
+    # Aborting stops every operation using the object until it's reset
+    progress.abort()
+    assert progress.aborted
+    with pytest.raises(liq.AbortedError):
+        image.quantize(attr.copy())
+    with pytest.raises(liq.AbortedError):
+        result.remap_image(image)
+
+    progress.reset()
+    assert progress.percent == 0
+    assert progress.stage == liq.ProgressStage.IDLE
+    assert not progress.aborted
+    image.quantize(attr)
+
+    # A progress callback replaces the object
+    attr.set_progress_callback(lambda percent, user_info: True, None)
+    assert attr.progress is None
+
+
 # There's not much to test for create_rgba(), especially considering
 # that we use it as part of most of the other tests. So let's skip it.
@@ -43,6 +43,35 @@ def test_histogram_basic():
     result.remap_image(image_C)
 
 
+def test_histogram_close():
+    """
+    Test Histogram.close()
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+    tracker = liq.MemoryTracker()
+    attr = liq.Attr(memory_tracker=tracker)
+    image = attr.create_rgba(input_pixels, width, height, 0)
+
+    with liq.Histogram(attr) as hist:
+        hist.add_image(attr, image)
+        before = tracker.current_bytes
+        assert hist.close() == before - tracker.current_bytes > 0
+        assert hist.closed
+        assert hist.close() == 0
+
+    with pytest.raises(ValueError):
+        hist.quantize(attr)
+
+    # The size includes fixed colors and colors added directly
+    hist = liq.Histogram(attr)
+    for i in range(8):
+        hist.add_fixed_color(liq.Color(i * 32, 0, 0, 255), 0)
+    hist.add_colors(attr, [liq.HistogramEntry(liq.Color(0, i, 0, 255), 1) for i in range(256)], 0)
+    hist.add_image(attr, image)
+    before = tracker.current_bytes
+    assert hist.close() == before - tracker.current_bytes > 0
+
+
 def test_histogram_add_colors():
     """
     Test Histogram.add_colors(), as well as the HistogramEntry class
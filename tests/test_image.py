@@ -61,6 +61,57 @@ def test_image_importance_map():
         image_callback=image_callback)))
 
 
+def test_image_set_importance_map():
+    """
+    Test Image.set_importance_map(), with and without copying
+    """
+    width, height, input_pixels = utils.load_test_image('alpha-gradient')
+    map_width, map_height, map_pixels = utils.load_test_image('importance-map-1')
+    assert (map_width, map_height) == (width, height)
+    buffer = bytearray(map_pixels[::4])
+
+    tracker = liq.MemoryTracker()
+    attr = liq.Attr(memory_tracker=tracker)
+
+    def quantize(copy):
+        image = attr.create_rgba(input_pixels, width, height, 0)
+        allocations = tracker.allocations
+        image.set_importance_map(buffer, copy=copy)
+        allocations = tracker.allocations - allocations
+        result = image.quantize(attr)
+        return allocations, result.get_palette(), result.remap_image(image), image
+
+    copied_allocations, *copied_output, _ = quantize(True)
+    allocations, *output, image = quantize(False)
+    assert copied_allocations == 1
+    assert allocations == 0
+    assert output == copied_output
+
+    # The buffer is pinned and left unchanged until the image is closed
+    assert buffer == map_pixels[::4]
+    with pytest.raises(BufferError):
+        buffer.append(0)
+    image.close()
+    buffer.append(0)
+
+    # Even a kept map isn't overwritten by the dither map
+    image = attr.create_rgba(input_pixels, width, height, 0)
+    image.cache_mode = liq.CacheMode.KEEP
+    image.set_importance_map(buffer, copy=False)
+    result = image.quantize(attr)
+    result.dithering_level = 1.0
+    result.remap_image(image)
+    assert buffer == map_pixels[::4] + b'\0'
+    del image, result
+
+    # Any buffer-protocol object works, but it has to be large enough
+    image = attr.create_rgba(input_pixels, width, height, 0)
+    image.set_importance_map(memoryview(bytes(buffer))[:width * height], copy=False)
+    assert image.quantize(attr).get_palette() == output[0]
+    with pytest.raises(liq.BufferTooSmallError):
+        image.set_importance_map(buffer[:width * height - 1], copy=False)
+
+
 def test_image_add_fixed_color():
     """
     Test Image.add_fixed_color()
@@ -128,5 +179,128 @@ def test_image_width_height():
         image_callback=image_callback_2)
 
 
+def test_image_cache_mode():
+    """
+    Test Image.cache_mode, Image.cache_size and Image.release_cache()
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+
+    def quantize_and_remap_twice(mode):
+        attr = liq.Attr()
+        attr.speed = 1
+        image = attr.create_rgba(input_pixels, width, height, 0)
+
+        # Test both the getter and setter methods
+        assert image.cache_mode == liq.CacheMode.AUTO
+        image.cache_mode = mode
+        assert image.cache_mode == mode
+
+        outputs = []
+        for _ in range(2):
+            result = image.quantize(attr)
+            result.dithering_level = 1.0
+            outputs.append(result.remap_image(image))
+        return image, outputs
+
+    # KEEP: float pixels and maps stay around until release_cache()
+    image, outputs = quantize_and_remap_twice(liq.CacheMode.KEEP)
+    size = image.cache_size
+    assert size >= width * height * 16
+    assert image.release_cache() == size
+    assert image.cache_size == 0
+
+    # The dither map is rebuilt for each remap, so identical palettes
+    # give identical output
+    assert outputs[0] == outputs[1]
+
+    # DISCARD: nothing is left over after each operation
+    image, outputs = quantize_and_remap_twice(liq.CacheMode.DISCARD)
+    assert image.cache_size == 0
+    assert image.release_cache() == 0
+
+    # Test bounds checking
+    with pytest.raises(ValueError):
+        image.cache_mode = 3
+
+
+def test_image_memory_mode():
+    """
+    Test Image.memory_mode, Image.low_memory,
+    Image.estimated_quantize_bytes() and Image.estimated_remap_bytes()
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+
+    def quantize_and_remap(mode):
+        attr = liq.Attr()
+        attr.speed = 1
+        image = attr.create_rgba(input_pixels, width, height, 0)
+
+        # Test both the getter and setter methods
+        assert image.memory_mode == liq.MemoryMode.AUTO
+        image.memory_mode = mode
+        assert image.memory_mode == mode
+
+        if mode == liq.MemoryMode.LOW:
+            assert image.low_memory
+        elif mode == liq.MemoryMode.FULL:
+            assert not image.low_memory
+
+        assert image.estimated_quantize_bytes(attr) > 0
+
+        result = image.quantize(attr)
+        result.dithering_level = 1.0
+        assert image.estimated_remap_bytes(result) > 0
+        return result.remap_image(image), result.get_palette()
+
+    outputs = [quantize_and_remap(mode) for mode in liq.MemoryMode]
+
+    # The memory mode only affects how pixels are converted, not the output
+    assert outputs[0] == outputs[1] == outputs[2]
+
+    # Test bounds checking
+    image = liq.Attr().create_rgba(input_pixels, width, height, 0)
+    with pytest.raises(ValueError):
+        image.memory_mode = 3
+
+
+def test_image_close():
+    """
+    Test Image.close(), Image.closed and using an Image as a context manager
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+    tracker = liq.MemoryTracker()
+    attr = liq.Attr(memory_tracker=tracker)
+
+    with attr.create_rgba(input_pixels, width, height, 0) as image:
+        result = image.quantize(attr)
+        result.dithering_level = 1.0
+        output = result.remap_image(image)
+        before = tracker.current_bytes
+    assert image.closed
+    assert before - tracker.current_bytes > width * height * 16 # the f_pixels at least
+    assert image.close() == 0
+
+    with pytest.raises(ValueError):
+        image.width
+    with pytest.raises(ValueError):
+        result.remap_image(image)
+
+    # The Result doesn't depend on the Image
+    assert result.remap_image(attr.create_rgba(input_pixels, width, height, 0)) == output
+
+    # An image frees its background, so closing the background itself frees
+    # nothing, and closing the image closes both
+    image = attr.create_rgba(input_pixels, width, height, 0)
+    background = attr.create_rgba(input_pixels, width, height, 0)
+    image.background = background
+    assert background.close() == 0
+    assert background.closed
+    result.remap_image(image)
+
+    before = tracker.current_bytes
+    assert image.close() == before - tracker.current_bytes > 0
+    assert background.closed
+
+
 # There's not much to test for quantize(), especially considering that
 # we use it as part of most of the other tests. So let's skip it.
@@ -0,0 +1,95 @@
+import io
+
+import libimagequant as liq
+import pytest
+
+import utils
+
+PIL_Image = pytest.importorskip('PIL.Image')
+import libimagequant.pil
+
+
+def quantize_rgba(pixels, width, height):
+    attr = liq.Attr()
+    image = attr.create_rgba(pixels, width, height, 0)
+    result = image.quantize(attr)
+    result.dithering_level = 1.0
+    output = result.remap_image(image)
+    return result.get_palette(), output
+
+
+def palette_of(pil_image, count):
+    rgba = pil_image.getpalette('RGBA')
+    return [liq.Color(*rgba[i * 4 : i * 4 + 4]) for i in range(count)]
+
+
+def test_pil_quantize():
+    """
+    Test libimagequant.pil.quantize()
+    """
+    width, height, input_pixels = utils.load_test_image('alpha-gradient')
+    palette, output = quantize_rgba(input_pixels, width, height)
+
+    quantized = libimagequant.pil.quantize(PIL_Image.frombytes('RGBA', (width, height), input_pixels))
+    assert quantized.mode == 'P'
+    assert quantized.size == (width, height)
+    assert quantized.tobytes() == output
+    assert palette_of(quantized, len(palette)) == palette
+
+    # The palette's alpha is saved as transparency
+    png = io.BytesIO()
+    quantized.save(png, 'PNG')
+    png.seek(0)
+    assert 'transparency' in PIL_Image.open(png).info
+
+
+def test_pil_modes():
+    """
+    Test libimagequant.pil.create_image() with images in several modes
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+    rgba = PIL_Image.frombytes('RGBA', (width, height), input_pixels)
+
+    for mode in ['RGB', 'L', 'LA', 'RGBa', 'P', 'CMYK']:
+        pil_image = rgba.convert(mode)
+        expected = quantize_rgba(pil_image.convert('RGBA').tobytes(), width, height)
+
+        attr = liq.Attr()
+        image = libimagequant.pil.create_image(attr, pil_image)
+        result = image.quantize(attr)
+        result.dithering_level = 1.0
+        assert libimagequant.pil.remap_image(result, image).tobytes() == expected[1], mode
+
+
+def test_pil_multiple_blocks():
+    """
+    Test libimagequant.pil.create_image() with an image Pillow stores in
+    several blocks of memory, which it can't export without copying
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+    expected = quantize_rgba(input_pixels, width, height)
+
+    block_size = PIL_Image.core.get_block_size()
+    PIL_Image.core.set_block_size(4096)
+    try:
+        pil_image = PIL_Image.frombytes('RGBA', (width, height), input_pixels)
+    finally:
+        PIL_Image.core.set_block_size(block_size)
+    assert libimagequant.pil._export_pixels(pil_image) is None
+
+    quantized = libimagequant.pil.quantize(pil_image)
+    assert quantized.tobytes() == expected[1]
+
+
+def test_pil_no_pythonapi(monkeypatch):
+    """
+    Test libimagequant.pil.create_image() where ctypes can't read the
+    exported memory, as on PyPy
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+    expected = quantize_rgba(input_pixels, width, height)
+
+    monkeypatch.setattr(libimagequant.pil, '_PyCapsule_GetPointer', None)
+    pil_image = PIL_Image.frombytes('RGBA', (width, height), input_pixels)
+    assert libimagequant.pil._export_pixels(pil_image) is None
+    assert libimagequant.pil.quantize(pil_image).tobytes() == expected[1]
@@ -1,3 +1,5 @@
+import gc
+
 import libimagequant as liq
 import pytest
 
@@ -145,6 +147,111 @@ def test_result_dithering_level():
         result_callback=result_callback)))
 
 
+def test_result_dithering_algorithm():
+    """
+    Test Result.dithering_algorithm
+    """
+
+    def result_callback(value, result):
+        # Test both the getter and setter methods
+        assert result.dithering_algorithm == liq.DitheringAlgorithm.FLOYD_STEINBERG
+        result.dithering_level = 1.0
+        result.dithering_algorithm = value
+        assert result.dithering_algorithm == value
+
+        # Test bounds checking
+        with pytest.raises(ValueError):
+            result.dithering_algorithm = 3
+
+    values = list(liq.DitheringAlgorithm)
+    utils.check_outputs_unique(utils.get_output_datas(utils.try_multiple_values(
+        'flower',
+        values,
+        result_callback=result_callback)))
+
+    # Ordered dithering should be reproducible
+    outputs = utils.get_output_datas(utils.try_multiple_values(
+        'flower',
+        [liq.DitheringAlgorithm.BAYER] * 2,
+        result_callback=result_callback))
+    assert outputs[0] == outputs[1]
+
+
+def test_result_parallel_dithering():
+    """
+    Test Result.parallel_dithering and Result.deterministic_dithering
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+
+    attr = liq.Attr()
+    image = attr.create_rgba(input_pixels, width, height, 0)
+    # Cache the dither map so that the first remap isn't different
+    image.cache_mode = liq.CacheMode.KEEP
+
+    def remap(parallel, deterministic):
+        result = image.quantize(attr)
+        result.dithering_level = 1.0
+
+        # Test both the getter and setter methods
+        assert result.parallel_dithering is False
+        assert result.deterministic_dithering is True
+        result.parallel_dithering = parallel
+        result.deterministic_dithering = deterministic
+        assert result.parallel_dithering is parallel
+        assert result.deterministic_dithering is deterministic
+
+        return result.remap_image(image)
+
+    serial = remap(False, True)
+    assert remap(False, False) == serial
+
+    # The image is split into stripes, so a few pixels near the seams
+    # are different, but the output is reproducible
+    parallel = remap(True, True)
+    assert parallel != serial
+    assert remap(True, True) == parallel
+    differing = sum(1 for a, b in zip(parallel, serial) if a != b)
+    assert differing < len(serial) * 0.02
+
+
+def test_result_fast_remapping():
+    """
+    Test Result.fast_remapping
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+
+    attr = liq.Attr()
+    image = attr.create_rgba(input_pixels, width, height, 0)
+    # Rebuild the dither map (and refine the palette) on every remap
+    image.cache_mode = liq.CacheMode.KEEP
+
+    def remap(fast, dithering_level):
+        result = image.quantize(attr)
+        result.dithering_level = dithering_level
+
+        # Test both the getter and setter methods
+        assert result.fast_remapping is False
+        result.fast_remapping = fast
+        assert result.fast_remapping is fast
+
+        palette = result.get_palette()
+        output = result.remap_image(image)
+        return output, palette, result.get_palette()
+
+    # The palette is refined while building the dither map...
+    output, quantized_palette, remapped_palette = remap(False, 1.0)
+    assert remapped_palette != quantized_palette
+
+    # ...unless fast remapping is enabled
+    fast_output, quantized_palette, remapped_palette = remap(True, 1.0)
+    assert remapped_palette == quantized_palette
+    assert fast_output != output
+    assert remap(True, 1.0)[0] == fast_output
+
+    # Without dithering, it makes no difference
+    assert remap(True, 0)[0] == remap(False, 0)[0]
+
+
 def test_result_output_gamma():
     """
     Test Result.output_gamma
@@ -186,6 +293,128 @@ def test_result_get_palette():
     assert all(isinstance(col, liq.Color) for col in palette)
 
 
+def test_result_ordered_dithering_progress():
+    """
+    Test that ordered dithering reports progress up to the end of the
+    image, and can be aborted until then, with any number of threads
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+    attr = liq.Attr()
+
+    def remap(algorithm, progress_callback):
+        image = attr.create_rgba(input_pixels, width, height, 0)
+        result = image.quantize(attr)
+        result.dithering_level = 1.0
+        result.dithering_algorithm = algorithm
+        result.set_progress_callback(progress_callback, None)
+        return result.remap_image(image)
+
+    for algorithm in [liq.DitheringAlgorithm.BAYER, liq.DitheringAlgorithm.BLUE_NOISE]:
+        percentages = []
+        remap(algorithm, lambda percent, user_info: percentages.append(percent) or True)
+        assert percentages == sorted(percentages)
+        assert percentages[-1] > 90
+
+        with pytest.raises(liq.AbortedError):
+            remap(algorithm, lambda percent, user_info: percent < 90)
+
+
+def test_result_remap_image_band():
+    """
+    Test Result.remap_image_band()
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+
+    attr = liq.Attr()
+    image = attr.create_rgba(input_pixels, width, height, 0)
+    result = image.quantize(attr)
+    palette = result.get_palette()
+
+    # Test bounds checking
+    with pytest.raises(ValueError):
+        result.remap_image_band(image, -1, 10)
+    with pytest.raises(ValueError):
+        result.remap_image_band(image, 0, 0)
+    with pytest.raises(ValueError):
+        result.remap_image_band(image, height - 5, 10)
+
+    # Without dithering, bands are the same as the whole image
+    result.dithering_level = 0
+    whole = result.remap_image_band(image, 0, height)
+    assert len(whole) == width * height
+    assert whole == result.remap_image(image)
+    assert result.remap_image_band(image, 10, 20) == whole[10 * width : 30 * width]
+
+    # With dithering, bands starting at multiples of 128 rows join up
+    # to the same image however it's split
+    for algorithm in [liq.DitheringAlgorithm.FLOYD_STEINBERG, liq.DitheringAlgorithm.BLUE_NOISE]:
+        result.dithering_level = 1.0
+        result.dithering_algorithm = algorithm
+        whole = result.remap_image_band(image, 0, height)
+        for band_height in [128, 256]:
+            bands = [result.remap_image_band(image, first_row, min(band_height, height - first_row))
+                for first_row in range(0, height, band_height)]
+            assert b''.join(bands) == whole
+
+    # The palette is never refined
+    assert result.get_palette() == palette
+
+
+def test_result_remap_image_into():
+    """
+    Test Result.remap_image_into()
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+
+    attr = liq.Attr()
+
+    def quantize():
+        image = attr.create_rgba(input_pixels, width, height, 0)
+        result = image.quantize(attr)
+        result.dithering_level = 1.0
+        return result, image
+
+    # Remapping refines the palette and keeps the image's dither map, so
+    # each remap gets its own Result and Image
+    result, image = quantize()
+    expected = result.remap_image(image)
+    result, image = quantize()
+    buffer = bytearray(width * height + 10)
+    assert result.remap_image_into(image, buffer) is None
+    assert buffer[:width * height] == expected
+    assert buffer[width * height:] == bytes(10)
+
+    with pytest.raises(liq.BufferTooSmallError):
+        result.remap_image_into(image, bytearray(width * height - 1))
+    with pytest.raises(BufferError):
+        result.remap_image_into(image, bytes(width * height))
+
+
+def test_result_remap_image_memory_limit():
+    """
+    Test Result.remap_image() with a MemoryTracker limit just above the
+    memory already used, so that its allocations fail
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+    tracker = liq.MemoryTracker()
+    attr = liq.Attr(memory_tracker=tracker)
+
+    for dithering_level in [0, 1.0]:
+        for extra_bytes in range(0, 8193, 512):
+            tracker.limit = 0
+            image = attr.create_rgba(input_pixels, width, height, 0)
+            result = image.quantize(attr)
+            result.dithering_level = dithering_level
+            tracker.limit = tracker.current_bytes + extra_bytes
+            with pytest.raises(MemoryError):
+                result.remap_image(image)
+
+    tracker.limit = 0
+    del attr, image, result
+    gc.collect()
+    assert tracker.current_bytes == 0
+
+
 # There's not much to test for remap_image(), especially considering
 # that we use it as part of most of the other tests. So let's skip it.
 
@@ -216,3 +445,68 @@ def test_result_quantization_and_remapping_error_and_quality():
     # *Now* they're available
     assert 0 < result.remapping_error < 255
     assert 0 < result.remapping_quality < 100
+
+
+def test_result_timings_and_counters():
+    """
+    Test:
+        - Result.timings
+        - Result.counters
+    """
+
+    (_, image, result, _), = utils.try_multiple_values(
+        'flower',
+        [None])
+
+    # Remapping stages aren't timed until after remapping
+    quantization_stages = ['histogram', 'contrast_maps', 'finalize_histogram', 'mediancut', 'feedback_loop', 'kmeans']
+    assert list(result.timings) == quantization_stages
+    assert all(seconds >= 0 for seconds in result.timings.values())
+    assert result.timings['mediancut'] > 0
+
+    counters = result.counters
+    assert list(counters) == ['histogram_size', 'ignorebits', 'feedback_trials', 'kmeans_iterations']
+    assert counters['histogram_size'] > 256
+    assert 0 <= counters['ignorebits'] < 8
+    assert counters['feedback_trials'] > 0
+    assert counters['kmeans_iterations'] > 0
+
+    result.dithering_level = 1.0
+    result.remap_image(image)
+
+    # *Now* they are
+    timings = result.timings
+    assert list(timings) == quantization_stages + ['remap', 'dither_map', 'dither']
+    assert timings['remap'] > 0
+    assert timings['dither'] > 0
+
+    # Speed 10 skips the feedback loop and K-Means iterations
+    (_, _, result, _), = utils.try_multiple_values(
+        'flower',
+        [None],
+        attr_callback=lambda value, attr: setattr(attr, 'speed', 10))
+    assert result.counters['feedback_trials'] == 0
+    assert result.counters['kmeans_iterations'] == 0
+    assert result.timings['feedback_loop'] == 0
+    assert result.timings['kmeans'] == 0
+
+
+def test_result_close():
+    """
+    Test Result.close()
+    """
+    width, height, input_pixels = utils.load_test_image('flower')
+    tracker = liq.MemoryTracker()
+    attr = liq.Attr(memory_tracker=tracker)
+    image = attr.create_rgba(input_pixels, width, height, 0)
+
+    with image.quantize(attr) as result:
+        result.remap_image(image)
+        before = tracker.current_bytes
+        assert result.close() == before - tracker.current_bytes > 0
+        assert result.closed
+
+    with pytest.raises(ValueError):
+        result.get_palette()
+    with pytest.raises(ValueError):
+        result.dithering_level = 1.0
@@ -0,0 +1,267 @@
+import gc
+import queue
+import random
+import threading
+import time
+
+import libimagequant as liq
+
+import utils
+
+
+IMAGES = ['flower', 'flower-huechange-1', 'test-card', 'alpha-gradient']
+
+
+def quantize(attr, name):
+    width, height, input_pixels = utils.load_test_image(name)
+    image = attr.create_rgba(input_pixels, width, height, 0)
+    hist = liq.Histogram(attr)
+    hist.add_image(attr, image)
+    return hist.quantize(attr), image
+
+
+def remap(result, image):
+    result.dithering_level = 1.0
+    return result.get_palette(), result.remap_image(image)
+
+
+def run_threads(targets, timeout=300):
+    """
+    Run the functions in threads at once, and re-raise the first exception
+    any of them raised. Fails instead of hanging if they don't all finish
+    within the timeout.
+    """
+    errors = []
+    def wrap(target):
+        def run():
+            try:
+                target()
+            except Exception as e:
+                errors.append(e)
+        return run
+
+    # Daemon threads, so that hung ones don't keep the test run alive
+    threads = [threading.Thread(target=wrap(t), daemon=True) for t in targets]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()))
+    if errors:
+        raise errors[0]
+    assert not any(thread.is_alive() for thread in threads), 'threads still running after %ds' % timeout
+
+
+def test_threads_attr_copy():
+    """
+    Test Attr.copy() of one Attr by several threads at once, each using its
+    copy to quantize
+    """
+    attr = liq.Attr()
+    attr.speed = 8
+    attr.max_colors = 64
+
+    expected = {name: remap(*quantize(attr.copy(), name)) for name in IMAGES}
+
+    outputs = []
+    def worker():
+        for name in IMAGES * 2:
+            outputs.append((name, remap(*quantize(attr.copy(), name))))
+
+    run_threads([worker] * 4)
+
+    assert len(outputs) == 4 * 2 * len(IMAGES)
+    for name, output in outputs:
+        assert output == expected[name]
+
+
+def test_threads_handoff():
+    """
+    Test Histograms, Results and Images made by some threads, and remapped
+    and freed by others
+    """
+    attr = liq.Attr()
+    attr.speed = 8
+    attr.max_colors = 64
+
+    expected = {name: remap(*quantize(attr.copy(), name)) for name in IMAGES}
+
+    # Unbounded, so producers never wait for a consumer that has failed
+    handoff = queue.Queue()
+    outputs = []
+
+    def producer():
+        try:
+            for name in IMAGES * 2:
+                handoff.put((name,) + quantize(attr.copy(), name))
+        finally:
+            handoff.put(None)
+
+    def consumer():
+        while True:
+            item = handoff.get(timeout=60)
+            if item is None:
+                break
+            name, result, image = item
+            outputs.append((name, remap(result, image)))
+            del item, result, image
+
+    run_threads([producer, producer, consumer, consumer])
+
+    assert len(outputs) == 2 * 2 * len(IMAGES)
+    for name, output in outputs:
+        assert output == expected[name]
+
+
+def test_threads_memory_tracker():
+    """
+    Test one MemoryTracker counting and limiting the allocations of several
+    threads, through their copies of an Attr
+    """
+    tracker = liq.MemoryTracker()
+    attr = liq.Attr(memory_tracker=tracker)
+    attr.speed = 8
+    attr.max_colors = 64
+
+    def worker():
+        for name in IMAGES * 2:
+            remap(*quantize(attr.copy(), name))
+
+    run_threads([worker] * 4)
+    del attr
+    gc.collect()
+    assert tracker.current_bytes == 0
+    assert tracker.allocations == tracker.frees > 0
+
+    # With a limit that fits one job at a time, jobs running at once fail
+    # instead of exceeding it together
+    tracker.limit = tracker.peak_bytes // 2
+    tracker.reset()
+    attr = liq.Attr(memory_tracker=tracker)
+    failures = []
+
+    def limited_worker():
+        for name in IMAGES:
+            try:
+                remap(*quantize(attr.copy(), name))
+            except MemoryError:
+                failures.append(name)
+
+    run_threads([limited_worker] * 4)
+    assert tracker.peak_bytes <= tracker.limit
+    assert failures
+
+
+def test_threads_memory_pool():
+    """
+    Test one MemoryPool reused by several threads, through their copies of
+    an Attr
+    """
+    pool = liq.MemoryPool()
+    tracker = liq.MemoryTracker()
+    attr = liq.Attr(memory_tracker=tracker, memory_pool=pool)
+    attr.speed = 8
+    attr.max_colors = 64
+
+    expected = {name: remap(*quantize(attr.copy(), name)) for name in IMAGES}
+
+    outputs = []
+    def worker():
+        for name in IMAGES * 2:
+            outputs.append((name, remap(*quantize(attr.copy(), name))))
+
+    run_threads([worker] * 4)
+
+    assert pool.hits > 0
+    for name, output in outputs:
+        assert output == expected[name]
+
+    del attr
+    gc.collect()
+    assert tracker.current_bytes == 0
+    pool.reset()
+    assert pool.cached_bytes == 0
+
+
+def test_threads_event_log():
+    """
+    Test one EventLog recording the events of several threads, through
+    their copies of an Attr, while another thread drains it
+    """
+    def job(attr, name):
+        remap(*quantize(attr.copy(), name))
+
+    log = liq.EventLog(min_severity=liq.EventSeverity.INFO)
+    attr = liq.Attr(event_log=log)
+    attr.speed = 8
+    for name in IMAGES:
+        job(attr, name)
+    events_per_round = len(log.drain())
+
+    # A small log, so that events are also dropped
+    log = liq.EventLog(capacity=4, min_severity=liq.EventSeverity.INFO)
+    attr = liq.Attr(event_log=log)
+    attr.speed = 8
+    drained = []
+    done = threading.Event()
+
+    def worker():
+        for name in IMAGES * 2:
+            job(attr, name)
+
+    def workers():
+        try:
+            run_threads([worker] * 4)
+        finally:
+            done.set()
+
+    def drainer():
+        while not done.is_set():
+            drained.extend(log.drain())
+            assert log.pending <= log.capacity
+        drained.extend(log.drain())
+
+    run_threads([workers, drainer])
+
+    assert len(drained) + log.dropped == 4 * 2 * events_per_round
+    assert all(e.severity >= liq.EventSeverity.INFO for e in drained)
+
+
+def test_threads_progress_abort():
+    """
+    Test aborting an operation through its Progress from another thread
+    while it runs
+    """
+    # Noise is slow to quantize, so the operation is still running when
+    # it's aborted
+    width = height = 512
+    input_pixels = random.Random(0).getrandbits(width * height * 32).to_bytes(width * height * 4, 'little')
+
+    progress = liq.Progress()
+    attr = liq.Attr(progress=progress)
+    attr.speed = 1
+    image = attr.create_rgba(input_pixels, width, height, 0)
+    started = threading.Event()
+    errors = []
+
+    def worker():
+        started.set()
+        try:
+            image.quantize(attr)
+        except liq.AbortedError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    assert started.wait(60)
+    deadline = time.monotonic() + 60
+    while progress.stage != liq.ProgressStage.QUANTIZE and time.monotonic() < deadline:
+        time.sleep(0.001)
+    progress.abort()
+    thread.join(60)
+
+    assert not thread.is_alive()
+    assert progress.stage == liq.ProgressStage.QUANTIZE
+    assert progress.percent < 100
+    assert progress.aborted
+    assert errors